@@ -18,10 +18,18 @@ def create_app():
     from app.routes.customer_service import cs_bp
     from app.routes.travel.planner import travel_bp
     from app.routes.travel.train import train_bp
+    from app.routes.metrics import metrics_bp
     
     app.register_blueprint(api_bp, url_prefix='/api')
     app.register_blueprint(cs_bp, url_prefix='/api/cs')
     app.register_blueprint(travel_bp, url_prefix='/api/travel')
     app.register_blueprint(train_bp)
+    app.register_blueprint(metrics_bp)
+    
+    # 后台预生成题库，/api/generate-test 直接从池中领取；补充会调用模型，默认不在每次创建应用时执行，
+    # gunicorn 部署由主进程启动时补充一次（见 gunicorn.conf.py）
+    if os.getenv("QUESTION_POOL_WARM_ON_START", "false").lower() not in ("0", "false", "no"):
+        from app.utils.test_helper import bank_pool
+        bank_pool.warm()
     
     return app 
\ No newline at end of file
@@ -3,6 +3,7 @@ from typing import List
 
 @dataclass
 class MBTIQuestion:
+    __slots__ = ('id', 'content', 'option_a', 'option_b', 'dimension_a', 'dimension_b')
     id: int
     content: str
     option_a: str
@@ -12,6 +13,7 @@ class MBTIQuestion:
 
 @dataclass
 class TestQuestion:
+    __slots__ = ('id', 'content', 'option_a', 'option_b', 'option_c', 'option_d', 'option_e', 'category')
     id: int
     content: str
     option_a: str
@@ -1,13 +1,25 @@
-from flask import Blueprint, request, jsonify, send_file
-from app.utils.llm_helper import get_chat_response
-from app.utils.test_helper import get_test_questions, get_test_from_bank, analyze_test_result
+from flask import Blueprint, request, jsonify, send_file, Response, stream_with_context
+from app.utils.llm_helper import get_chat_response, stream_chat_response
+from app.utils.test_helper import (
+    get_pooled_test_questions, stream_test_questions, render_test_from_bank, analyze_test_result, analysis_cache, bank_pool,
+    score_answer_sheets, get_profile_analysis, submit_test_result, get_test_result
+)
 import logging
 import os
+import json
+import time
 import base64
+import tempfile
 from volcenginesdkarkruntime import Ark
 from app.utils.numerology.bazi import BaziPlannerChain
 from pathlib import Path
 from app.routes.config import SCRIPT_DIR
+from app.utils.llm_breaker import health_snapshot
+from app.utils.llm_hedge import hedge_snapshot
+from app.utils.llm_pool import registry
+from app.utils.llm_cache import response_cache
+from app.utils.llm_singleflight import single_flight
+from app.utils.llm_tokens import usage_stats
 # 配置日志
 logger = logging.getLogger(__name__)
 
@@ -34,6 +46,10 @@ def chat():
             'code': 500
         }), 400
         
+    # 流式模式：请求体 stream=true 或 Accept: text/event-stream
+    if data.get('stream') or request.accept_mimetypes.best == 'text/event-stream':
+        return _stream_chat(user_question, provider)
+        
     ai_response = get_chat_response(user_question, provider)
     return jsonify({
         'success': True,
@@ -41,9 +57,66 @@ def chat():
         'code': 200
     })
 
+def _sse(payload, event=None):
+    """格式化一条 SSE 消息"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def _stream_chat(user_question, provider):
+    """以 SSE 形式逐片段返回聊天回答"""
+    deltas = stream_chat_response(user_question, provider)
+    
+    def generate():
+        start = time.perf_counter()
+        ttft_ms = None
+        try:
+            for delta in deltas:
+                if ttft_ms is None:
+                    ttft_ms = round((time.perf_counter() - start) * 1000)
+                yield _sse({'delta': delta})
+            yield _sse({
+                'ttft_ms': ttft_ms,
+                'total_ms': round((time.perf_counter() - start) * 1000)
+            }, event='done')
+        except Exception as e:
+            logger.error(f"流式聊天失败: {str(e)}")
+            yield _sse({'error': '生成回答失败，请重试', 'code': 500}, event='error')
+    
+    return _streaming_response(generate())
+
+def _streaming_response(body, mimetype='text/event-stream'):
+    """流式响应，逐条发送 body 产生的消息"""
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={
+            'Cache-Control': 'no-cache',
+            # 关闭 nginx 代理缓冲，片段才能实时到达客户端
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@api_bp.route('/llm/health', methods=['GET'])
+def llm_health():
+    """查看各模型熔断状态、健康分、对冲统计、响应/分析缓存命中率、在途合并统计和各路由 token 用量"""
+    return jsonify({
+        'success': True,
+        'code': 200,
+        'data': {
+            'breakers': health_snapshot(),
+            'hedge': hedge_snapshot(),
+            'pools': registry.stats(),
+            'cache': response_cache.stats(),
+            'analysis_cache': analysis_cache.stats(),
+            'singleflight': single_flight.stats(),
+            'bank_pool': bank_pool.stats(),
+            'usage': usage_stats.snapshot()
+        }
+    })
+
 @api_bp.route('/generate-test', methods=['POST'])
 def generate_test():
-    """生成心理测试题目"""
+    """生成心理测试题目（优先使用预生成的题库池）"""
     data = request.get_json()
     test_type = data.get('test_type')  # mbti, career, enneagram
     
@@ -54,8 +127,27 @@ def generate_test():
             'code': 500
         }), 400
     
-    # 生成测试题目
-    test_questions = get_test_questions(test_type)
+    # 流式模式：请求体 stream=true 或 Accept 为 text/event-stream / application/x-ndjson
+    best = request.accept_mimetypes.best
+    if data.get('stream') or best in ('text/event-stream', 'application/x-ndjson'):
+        try:
+            events = stream_test_questions(test_type)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e),
+                'code': 400
+            }), 400
+        return _stream_test(events, ndjson=best == 'application/x-ndjson')
+    
+    try:
+        test_questions = get_pooled_test_questions(test_type)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'code': 400
+        }), 400
     
     return jsonify({
         'success': True,
@@ -66,6 +158,27 @@ def generate_test():
         }
     })
 
+def _stream_test(events, ndjson=False):
+    """
+    逐题返回生成的题目
+    
+    SSE 为 question 事件（每道题一条）和 done 事件（含 file_id）；NDJSON 每行为 {"event": ..., "data": ...}。
+    """
+    def message(event, payload):
+        if ndjson:
+            return json.dumps({'event': event, 'data': payload}, ensure_ascii=False) + "\n"
+        return _sse(payload, event=event)
+    
+    def generate():
+        try:
+            for event, payload in events:
+                yield message(event, payload)
+        except Exception as e:
+            logger.error(f"流式生成题目失败: {str(e)}")
+            yield message('error', {'error': '生成题目失败，请重试', 'code': 500})
+    
+    return _streaming_response(generate(), 'application/x-ndjson' if ndjson else 'text/event-stream')
+
 @api_bp.route('/test', methods=['GET'])
 def get_test():
     """获取测试题目"""
@@ -86,25 +199,34 @@ def get_test():
         }), 400
     
     try:
-        # 从题库中获取题目
-        test_questions = get_test_from_bank(test_type)
-        
-        return jsonify({
-            'success': True,
-            'code': 200,
-            'data': test_questions
-        })
-        
+        # 从题库中获取预渲染的响应，题库版本即 ETag
+        rendered = render_test_from_bank(test_type)
     except ValueError as e:
         return jsonify({
             'success': False,
             'error': str(e),
             'code': 500
         }), 400
+    
+    use_gzip = rendered['gzip'] is not None and 'gzip' in request.accept_encodings
+    etag = rendered['etag'] + ('-gzip' if use_gzip else '')
+    headers = {
+        # 允许缓存但每次都要向服务器确认，题库更新后客户端立即拿到新题
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept-Encoding'
+    }
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+    else:
+        response = Response(rendered['gzip'] if use_gzip else rendered['body'], mimetype='application/json', headers=headers)
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    return response
 
 @api_bp.route('/test/submit', methods=['POST'])
 def submit_test():
-    """提交测试答案并获取分析结果"""
+    """提交测试答案，立即返回类型和得分，分析在后台生成（wait=true 时等待分析完成）"""
     # 添加请求数据验证
     if not request.is_json:
         return jsonify({
@@ -133,8 +255,12 @@ def submit_test():
         }), 400
     
     try:
-        # 分析测试结果
-        result = analyze_test_result(test_type, file_id, answers)
+        if data.get('wait'):
+            # 兼容旧版：等待模型分析完成后一起返回
+            result = analyze_test_result(test_type, file_id, answers)
+        else:
+            # 立即返回本地计分结果，分析凭 result_id 通过 /api/test/result 获取
+            result = submit_test_result(test_type, file_id, answers)
         
         return jsonify({
             'success': True,
@@ -149,6 +275,251 @@ def submit_test():
             'code': 400
         }), 400
 
+# 流式等待分析时查询结果的间隔、最长等待时间（秒）
+# 同步 worker 在整个流式响应期间被占用，等待时间不能超过 gunicorn 的 --timeout，
+# 否则 worker 会在流中途被杀死（连同其中的后台分析线程），因此限制在 worker 超时的一半以内
+RESULT_POLL_INTERVAL = float(os.getenv('RESULT_POLL_INTERVAL', '0.5'))
+WORKER_TIMEOUT = float(os.getenv('GUNICORN_TIMEOUT', '120'))
+RESULT_STREAM_TIMEOUT = min(float(os.getenv('RESULT_STREAM_TIMEOUT', '45')), WORKER_TIMEOUT / 2)
+
+@api_bp.route('/test/result/<result_id>', methods=['GET'])
+def get_result(result_id):
+    """查询测试结果和分析进度，分析生成中时返回 202"""
+    result = get_test_result(result_id)
+    if result is None:
+        return jsonify({
+            'success': False,
+            'error': '测试结果不存在或已过期',
+            'code': 404
+        }), 404
+    code = 202 if result['status'] == 'pending' else 200
+    return jsonify({
+        'success': True,
+        'code': code,
+        'data': result
+    }), code
+
+@api_bp.route('/test/result/<result_id>/stream', methods=['GET'])
+def stream_result(result_id):
+    """
+    以 SSE 等待分析完成
+    
+    先发送 result 事件（类型和得分），分析完成后发送 analysis 事件，失败发送 error 事件。
+    RESULT_STREAM_TIMEOUT 秒内仍未完成时发送 pending 事件并结束，客户端改为轮询 /test/result/<result_id>。
+    """
+    result = get_test_result(result_id)
+    if result is None:
+        return jsonify({
+            'success': False,
+            'error': '测试结果不存在或已过期',
+            'code': 404
+        }), 404
+    
+    def generate():
+        current = result
+        yield _sse({k: v for k, v in current.items() if k != 'analysis'}, event='result')
+        deadline = time.monotonic() + RESULT_STREAM_TIMEOUT
+        last_sent = time.monotonic()
+        while current['status'] == 'pending' and time.monotonic() < deadline:
+            time.sleep(RESULT_POLL_INTERVAL)
+            current = get_test_result(result_id) or dict(current, status='failed')
+            # 定期发送注释行，避免代理因长时间无数据断开连接
+            if time.monotonic() - last_sent > 15:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+        if current['status'] == 'ready':
+            yield _sse({'result_id': result_id, 'analysis': current['analysis']}, event='analysis')
+        elif current['status'] == 'pending':
+            yield _sse({'result_id': result_id, 'status': 'pending',
+                        'poll': f"/api/test/result/{result_id}"}, event='pending')
+        else:
+            yield _sse({'error': '生成分析失败，请稍后重试', 'code': 500}, event='error')
+    
+    return _streaming_response(generate())
+
+# JSON 数组提交的最大答卷数，更多答卷请用 NDJSON 流式提交
+BULK_SUBMIT_MAX_SHEETS = int(os.getenv('BULK_SUBMIT_MAX_SHEETS', '5000'))
+# NDJSON 提交的最大请求体（字节），超过 1MB 的部分暂存到临时文件
+BULK_SUBMIT_MAX_BYTES = int(os.getenv('BULK_SUBMIT_MAX_BYTES', str(64 * 1024 * 1024)))
+_SPOOL_MEMORY_BYTES = 1024 * 1024
+
+@api_bp.route('/test/submit-batch', methods=['POST'])
+def submit_test_batch():
+    """
+    批量提交答卷，本地计分后立即返回每份答卷的类型和得分
+    
+    JSON：{"test_type", "file_id", "sheets": [{"id", "answers"}], "analysis": false}，返回全部结果和汇总。
+    NDJSON（Content-Type: application/x-ndjson）：test_type、file_id、analysis 放在查询参数中，
+    每行一份答卷；请求体（最多 BULK_SUBMIT_MAX_BYTES 字节）读完后逐行计分，以 NDJSON 逐份返回结果，
+    最后一行为汇总。
+    analysis 为真时按得分画像在后台生成分析，通过 /api/test/analysis 获取。
+    """
+    body = None
+    if request.mimetype == 'application/x-ndjson':
+        params = request.args
+        if request.content_length is not None and request.content_length > BULK_SUBMIT_MAX_BYTES:
+            body = None
+        else:
+            body = _spool_body(request.stream, BULK_SUBMIT_MAX_BYTES)
+        if body is None:
+            return jsonify({
+                'success': False,
+                'error': f'请求体超过 {BULK_SUBMIT_MAX_BYTES} 字节，请分批提交',
+                'code': 413
+            }), 413
+        sheets = _ndjson_sheets(body)
+        with_analysis = params.get('analysis', '').lower() in ('1', 'true', 'yes')
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({
+                'success': False,
+                'error': '请求必须是JSON或NDJSON格式',
+                'code': 400
+            }), 400
+        params = data
+        sheets = data.get('sheets')
+        with_analysis = bool(data.get('analysis'))
+        if not isinstance(sheets, list) or not sheets:
+            return jsonify({
+                'success': False,
+                'error': '缺少答卷',
+                'code': 400
+            }), 400
+        if len(sheets) > BULK_SUBMIT_MAX_SHEETS:
+            return jsonify({
+                'success': False,
+                'error': f'答卷数超过 {BULK_SUBMIT_MAX_SHEETS} 份，请使用 NDJSON 流式提交',
+                'code': 413
+            }), 413
+    
+    test_type = params.get('test_type')
+    file_id = params.get('file_id')
+    if not all([test_type, file_id]):
+        if body is not None:
+            body.close()
+        return jsonify({
+            'success': False,
+            'error': '缺少必要参数',
+            'code': 400
+        }), 400
+    
+    try:
+        results = score_answer_sheets(test_type, file_id, sheets, with_analysis)
+    except ValueError as e:
+        if body is not None:
+            body.close()
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'code': 400
+        }), 400
+    
+    summary = {'total': 0, 'invalid': 0, 'types': {}}
+    
+    def count(item):
+        summary['total'] += 1
+        if 'error' in item:
+            summary['invalid'] += 1
+        else:
+            summary['types'][item['type']] = summary['types'].get(item['type'], 0) + 1
+        return item
+    
+    if request.mimetype != 'application/x-ndjson':
+        return jsonify({
+            'success': True,
+            'code': 200,
+            'data': {
+                'results': [count(item) for item in results],
+                'summary': summary
+            }
+        })
+    
+    def generate():
+        try:
+            for item in results:
+                yield json.dumps({'event': 'result', 'data': count(item)}, ensure_ascii=False) + "\n"
+            yield json.dumps({'event': 'done', 'data': summary}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"批量计分失败: {str(e)}")
+            yield json.dumps({'event': 'error', 'data': {'error': '批量计分失败', 'code': 500}}) + "\n"
+        finally:
+            body.close()
+    
+    return _streaming_response(generate(), 'application/x-ndjson')
+
+def _spool_body(stream, limit):
+    """
+    在开始返回结果之前读完请求体
+    
+    边读请求边写响应时，先发完请求再读响应的客户端（大多数 HTTP 库）直连同步 worker、前面没有缓冲请求的
+    代理时，双方的套接字缓冲区写满后会互相等待。请求体超过 _SPOOL_MEMORY_BYTES 的部分暂存到临时文件。
+    
+    @param stream: 请求体
+    @param limit: 最大字节数
+    @return: 已回到开头的文件对象，超过 limit 时返回 None
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MEMORY_BYTES)
+    size = 0
+    while True:
+        block = stream.read(64 * 1024)
+        if not block:
+            break
+        size += len(block)
+        if size > limit:
+            spool.close()
+            return None
+        spool.write(block)
+    spool.seek(0)
+    return spool
+
+def _ndjson_sheets(stream):
+    """逐行读取 NDJSON 答卷，无法解析的行返回 None"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+@api_bp.route('/test/analysis', methods=['GET'])
+def get_test_analysis():
+    """获取批量提交时在后台生成的画像分析"""
+    test_type = request.args.get('test_type')
+    file_id = request.args.get('file_id')
+    profile = request.args.get('profile')
+    if not all([test_type, file_id, profile]):
+        return jsonify({
+            'success': False,
+            'error': '缺少必要参数',
+            'code': 400
+        }), 400
+    
+    status, analysis = get_profile_analysis(test_type, file_id, profile)
+    if status == 'missing':
+        return jsonify({
+            'success': False,
+            'error': '该画像的分析尚未生成',
+            'code': 404
+        }), 404
+    if status == 'failed':
+        return jsonify({
+            'success': False,
+            'error': '生成分析失败，请稍后重试',
+            'code': 502
+        }), 502
+    return jsonify({
+        'success': True,
+        'code': 200 if status == 'ready' else 202,
+        'data': {
+            'status': status,
+            'profile': profile,
+            'analysis': analysis
+        }
+    }), 200 if status == 'ready' else 202
+
 @api_bp.route('/photo-qa', methods=['POST'])
 def photo_qa():
     """处理图片问答请求"""
@@ -4,3 +4,9 @@ BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # 项目根目录
 DATA_DIR = os.path.join(BASE_DIR, "data")
 SCRIPT_DIR = os.path.join(DATA_DIR, "script")
 SCRIPT_DIR_QUESTION_BANK = os.path.join(BASE_DIR, "question_bank")
+CACHE_DIR = os.path.join(DATA_DIR, "cache")  # LLM 响应缓存等运行时数据
+QUESTION_BANK_DB = os.getenv("QUESTION_BANK_DB", os.path.join(DATA_DIR, "question_bank.sqlite3"))  # 题库存储
+KNOWLEDGE_BASE_PATHS = [  # 客服知识库文件，多个文件用 os.pathsep 分隔
+    p for p in os.getenv("KNOWLEDGE_BASE_PATHS", os.path.join(DATA_DIR, "knowledge_base.txt")).split(os.pathsep) if p
+]
+KNOWLEDGE_INDEX_DIR = os.getenv("KNOWLEDGE_INDEX_DIR", os.path.join(CACHE_DIR, "knowledge_index"))  # 持久化的 FAISS 索引
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from app.utils.customer_bot import CustomerSupportBot
 import logging
+import uuid
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -23,6 +24,8 @@ def chat():
         
     data = request.get_json()
     user_input = data.get('message')
+    # 会话 ID：同一会话共享对话历史，未提供时新建会话并在响应中返回
+    session_id = str(data.get('session_id') or uuid.uuid4().hex)
     
     if not user_input:
         return jsonify({
@@ -32,12 +35,13 @@ def chat():
         }), 400
     
     try:
-        response = bot.handle_query(user_input)
+        response = bot.handle_query(user_input, session_id)
         return jsonify({
             'success': True,
             'code': 200,
             'data': {
-                'response': response
+                'response': response,
+                'session_id': session_id
             }
         })
         
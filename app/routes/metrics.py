@@ -0,0 +1,10 @@
+from flask import Blueprint, Response
+from app.utils.llm_metrics import render_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 指标（LLM 调用耗时、首字延迟、token 用量、回退和错误）"""
+    content, content_type = render_metrics()
+    return Response(content, content_type=content_type)
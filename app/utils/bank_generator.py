@@ -0,0 +1,162 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+import re
+
+from rapidfuzz import fuzz, process
+
+from .question_bank import extract_questions, validate_bank
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 去重前统一文本：去掉空白和标点
+_NORMALIZE = re.compile(r"[\s，。、！？；：,.!?;:\"'“”‘’（）()]+")
+
+
+@dataclass(frozen=True)
+class Shard:
+    """一个生成分片：覆盖的维度范围和题目数量"""
+    scope: str
+    count: int
+
+
+@dataclass
+class ShardResult:
+    shard: Shard
+    questions: Optional[List[Dict[str, Any]]] = None
+    response: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+
+
+def _normalize(text: str) -> str:
+    return _NORMALIZE.sub("", str(text)).lower()
+
+
+def parse_shard(test_type: str, response: str, min_ratio: float = 0.5) -> List[Dict[str, Any]]:
+    """
+    解析一个分片的响应，丢弃格式不合法的题目
+
+    @param test_type: 测试类型
+    @param response: 模型响应
+    @param min_ratio: 合法题目占比低于该值时视为分片失败
+    @return: 合法的题目列表
+    @raise ValueError: 没有有效的 JSON 或合法题目太少
+    """
+    raw_questions = extract_questions(response)
+    if not isinstance(raw_questions, list):
+        raise ValueError("分片响应不是 JSON 数组")
+    valid = []
+    for question in raw_questions:
+        try:
+            validate_bank(test_type, [question])
+            valid.append(question)
+        except ValueError:
+            continue
+    if not valid or len(valid) < len(raw_questions) * min_ratio:
+        raise ValueError(f"分片中合法题目过少: {len(valid)}/{len(raw_questions)}")
+    return valid
+
+
+def _merge(shards: List[List[Dict[str, Any]]], threshold: float) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """merge_questions 的实现，同时返回每个分片去重后保留的题目数"""
+    merged, seen, kept = [], [], []
+    dropped = 0
+    for questions in shards:
+        kept.append(0)
+        for question in questions:
+            text = _normalize(question.get('content', ''))
+            if seen and process.extractOne(text, seen, scorer=fuzz.ratio, score_cutoff=threshold):
+                dropped += 1
+                continue
+            seen.append(text)
+            merged.append(dict(question, id=len(merged) + 1))
+            kept[-1] += 1
+    if dropped:
+        logger.info(f"合并分片时去掉了 {dropped} 道相似题目")
+    return merged, kept
+
+
+def merge_questions(shards: List[List[Dict[str, Any]]], threshold: float = 85.0) -> List[Dict[str, Any]]:
+    """
+    合并各分片的题目：按分片顺序去掉措辞相近的重复题，并重新编号为 1..n
+
+    @param shards: 各分片的题目列表（按分片顺序）
+    @param threshold: RapidFuzz 相似度阈值（0-100），达到阈值视为重复
+    @return: 合并后的题目列表
+    """
+    return _merge(shards, threshold)[0]
+
+
+def generate_sharded(test_type: str, shards: List[Shard],
+                     build_messages: Callable[[str, Shard], List[Dict[str, str]]],
+                     run_batch: Callable[[List[List[Dict[str, str]]]], Any],
+                     retries: int = 2, threshold: float = 85.0,
+                     min_questions: int = 1) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    并发生成各分片并合并，只重试失败的分片
+
+    去重后题目少于 min_questions 时视为分片题目不足：去重后保留数少于目标数的分片按缺少的数量补充生成，
+    与解析失败的重试共用 retries 次数。
+
+    @param test_type: 测试类型
+    @param shards: 分片定义
+    @param build_messages: 构造分片提示词
+    @param run_batch: 批量调用（如 client.get_completions），返回 BatchResult
+    @param retries: 失败或题目不足分片的最大重试次数
+    @param threshold: 去重相似度阈值
+    @param min_questions: 合并后至少需要的题目数
+    @return: (合并后的题目, 各分片原始响应拼接)
+    @raise ValueError: 重试后仍有分片失败，或去重后题目仍不足
+    """
+    results = [ShardResult(shard) for shard in shards]
+    for attempt in range(retries + 1):
+        requests = [(r, r.shard) for r in results if r.questions is None]
+        if requests:
+            if attempt:
+                logger.warning(f"{test_type} 有 {len(requests)} 个分片失败，第 {attempt} 次重试")
+        else:
+            questions, kept = _merge([r.questions for r in results], threshold)
+            if len(questions) >= min_questions:
+                break
+            # 只补充去重后不足的分片，数量为缺少的题目数
+            requests = [
+                (r, Shard(r.shard.scope, r.shard.count - n))
+                for r, n in zip(results, kept) if n < r.shard.count
+            ]
+            if not requests:
+                break
+            logger.warning(
+                f"{test_type} 去重后只有 {len(questions)} 道题目（至少 {min_questions}），"
+                f"第 {attempt} 次补充生成 {len(requests)} 个分片"
+            )
+        batch = run_batch([build_messages(test_type, shard) for _, shard in requests])
+        for (result, _), item in zip(requests, batch.items):
+            result.attempts += 1
+            if not item.ok:
+                result.error = item.error
+                continue
+            try:
+                parsed = parse_shard(test_type, item.content)
+            except ValueError as e:
+                result.error = str(e)
+                continue
+            if result.questions is None:
+                result.questions, result.response = parsed, item.content
+            else:
+                result.questions = result.questions + parsed
+                result.response += "\n\n" + item.content
+            result.error = None
+
+    failed = [r for r in results if r.questions is None]
+    if failed:
+        raise ValueError(
+            "生成题目失败: " + "；".join(f"{r.shard.scope}({r.error})" for r in failed)
+        )
+
+    questions = merge_questions([r.questions for r in results], threshold)
+    if len(questions) < min_questions:
+        raise ValueError(f"生成题目失败: 去重后只有 {len(questions)} 道题目，至少需要 {min_questions} 道")
+    response = "\n\n".join(f"# 分片 {r.shard.scope}:\n{r.response}" for r in results)
+    return questions, response
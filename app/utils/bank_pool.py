@@ -0,0 +1,130 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import logging
+import sqlite3
+import threading
+
+from .llm_singleflight import InflightLease
+from .question_bank import BankEntry, QuestionBankIndex, QuestionBankStore
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 生成一套题目: test_type -> (原始题目列表, 模型原始响应)
+BankGenerator = Callable[[str], Tuple[List[Dict[str, Any]], str]]
+
+
+class QuestionBankPool:
+    """
+    预生成题库池
+
+    每种测试类型在存储的 bank_pool 表中保持 target 套已校验的题目；领取后剩余数量低于 low_watermark 时
+    在后台线程中补充。多个 worker 通过 SQLite 租约保证同一类型同时只有一个在补充。
+    """
+
+    def __init__(self, store: QuestionBankStore, index: QuestionBankIndex, generator: BankGenerator,
+                 test_types: List[str], target: int = 3, low_watermark: int = 1,
+                 workers: int = 1, lease_seconds: float = 900.0):
+        self.store = store
+        self.index = index
+        self.generator = generator
+        self.test_types = test_types
+        self.target = target
+        self.low_watermark = low_watermark
+        self._lease = InflightLease(store.db_path, lease_seconds)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="bank-pool")
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stats = {"claimed": 0, "empty": 0, "generated": 0, "failed": 0}
+
+    def _count(self, stat: str, n: int = 1):
+        with self._lock:
+            self._stats[stat] += n
+
+    def claim(self, test_type: str) -> Optional[BankEntry]:
+        """
+        领取一套预生成的题目
+
+        @param test_type: 测试类型
+        @return: BankEntry，池为空时返回 None（同时触发补充）
+        """
+        file_id = self.store.claim_pooled(test_type) if self.target > 0 else None
+        if file_id is None:
+            self._count("empty")
+            self.refill_async(test_type)
+            return None
+
+        self._count("claimed")
+        self.index.invalidate(test_type)
+        if self.store.pool_size(test_type) < self.low_watermark:
+            self.refill_async(test_type)
+        return self.index.get(test_type, file_id)
+
+    def refill_async(self, test_type: str) -> Optional[Future]:
+        """
+        在后台补充题库池，同一类型已在排队时忽略
+
+        @return: 补充任务的 Future，未提交时返回 None
+        """
+        if self.target <= 0:
+            return None
+        with self._lock:
+            if test_type in self._pending:
+                return None
+            self._pending.add(test_type)
+        return self._executor.submit(self._refill, test_type)
+
+    def warm(self, wait: bool = False):
+        """
+        为所有测试类型补充题库池
+
+        @param wait: 是否等待补充完成
+        """
+        futures = [self.refill_async(test_type) for test_type in self.test_types]
+        if wait:
+            for future in futures:
+                if future is not None:
+                    future.result()
+
+    def _refill(self, test_type: str):
+        owner = None
+        key = f"bank-pool:{test_type}"
+        try:
+            owner = self._lease.acquire(key)
+            if owner is None:
+                logger.info(f"{test_type} 题库池正由其他 worker 补充")
+                return
+            failures = 0
+            while self.store.pool_size(test_type) < self.target and failures < 3:
+                try:
+                    raw_questions, response = self.generator(test_type)
+                    source = f"deepseek_{test_type}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.json"
+                    self.store.add_pooled(test_type, source, raw_questions, response)
+                    self._count("generated")
+                except Exception as e:
+                    failures += 1
+                    self._count("failed")
+                    logger.error(f"预生成 {test_type} 题库失败: {str(e)}")
+            logger.info(f"{test_type} 题库池当前 {self.store.pool_size(test_type)}/{self.target} 套")
+        except sqlite3.Error as e:
+            logger.error(f"补充 {test_type} 题库池失败: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.discard(test_type)
+            if owner is not None:
+                try:
+                    self._lease.release(key, owner)
+                except sqlite3.Error as e:
+                    logger.warning(f"释放题库池租约失败: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["refilling"] = sorted(self._pending)
+        try:
+            stats["available"] = {t: self.store.pool_size(t) for t in self.test_types}
+        except sqlite3.Error:
+            stats["available"] = None
+        stats["target"] = self.target
+        return stats
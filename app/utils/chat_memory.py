@@ -0,0 +1,176 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+import logging
+import threading
+import time
+
+from langchain_core.memory import BaseMemory
+from langchain_core.messages import HumanMessage, AIMessage
+from pydantic import BaseModel, Field, PrivateAttr
+
+from .llm_tokens import count_tokens
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 根据 (已有摘要, 被移出窗口的对话) 生成新摘要
+Summarizer = Callable[[str, str], str]
+
+
+class ChatMemory(BaseMemory, BaseModel):
+    """
+    自定义对话记忆类
+
+    只保留最近 max_tokens 个 token 以内的对话（至少保留最近一轮），格式化后的历史随每轮对话增量维护，
+    读取时不再重新拼接。设置 summarizer 时，移出窗口的对话在后台合并进摘要，摘要放在历史开头。
+    """
+    chat_history: List = Field(default_factory=list)
+    max_tokens: int = 2000
+    summary: str = ""
+    summarizer: Optional[Callable] = Field(default=None, exclude=True)
+    executor: Optional[Any] = Field(default=None, exclude=True)
+
+    _turns: deque = PrivateAttr(default_factory=deque)       # (格式化文本, token 数)
+    _formatted: str = PrivateAttr(default="")
+    _tokens: int = PrivateAttr(default=0)
+    _evicted: List[str] = PrivateAttr(default_factory=list)  # 等待合并进摘要的对话
+    _summarizing: bool = PrivateAttr(default=False)
+    _lock: Any = PrivateAttr(default_factory=threading.RLock)
+
+    def clear(self):
+        with self._lock:
+            self.chat_history = []
+            self.summary = ""
+            self._turns.clear()
+            self._formatted = ""
+            self._tokens = 0
+            self._evicted = []
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return ["chat_history"]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            if self.summary:
+                return {"chat_history": f"之前的对话摘要: {self.summary}\n\n{self._formatted}"}
+            return {"chat_history": self._formatted}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, Any]) -> None:
+        if "input" in inputs and "output" in outputs:
+            turn = f"用户: {inputs['input']}\n助手: {outputs['output']}\n\n"
+            tokens = count_tokens(turn)
+            with self._lock:
+                self.chat_history.append(HumanMessage(content=inputs["input"]))
+                self.chat_history.append(AIMessage(content=outputs["output"]))
+                self._turns.append((turn, tokens))
+                self._formatted += turn
+                self._tokens += tokens
+                self._evict()
+
+    def _evict(self):
+        """移出超出 token 上限的最早几轮对话"""
+        dropped = 0
+        while self._tokens > self.max_tokens and len(self._turns) > 1:
+            turn, tokens = self._turns.popleft()
+            self._tokens -= tokens
+            dropped += len(turn)
+            if self.summarizer is not None:
+                self._evicted.append(turn)
+            del self.chat_history[:2]
+        if dropped:
+            self._formatted = self._formatted[dropped:]
+            self._schedule_summary()
+
+    def _schedule_summary(self):
+        if self.summarizer is None or self._summarizing or not self._evicted:
+            return
+        self._summarizing = True
+        if self.executor is not None:
+            self.executor.submit(self._summarize)
+        else:
+            threading.Thread(target=self._summarize, daemon=True).start()
+
+    def _summarize(self):
+        with self._lock:
+            evicted, self._evicted = "".join(self._evicted), []
+            summary = self.summary
+        try:
+            summary = self.summarizer(summary, evicted)
+        except Exception as e:
+            logger.warning(f"对话摘要失败，保留原摘要: {str(e)}")
+        with self._lock:
+            self.summary = summary
+            self._summarizing = False
+            # 摘要期间又有对话被移出
+            self._schedule_summary()
+
+    @property
+    def tokens(self) -> int:
+        """窗口内对话的 token 数（不含摘要）"""
+        return self._tokens
+
+
+class SessionMemoryStore:
+    """
+    按会话隔离的对话记忆
+
+    最多保留 max_sessions 个会话，超出时淘汰最久未使用的；超过 idle_seconds 未使用的会话也会被清理。
+    """
+
+    def __init__(self, max_sessions: int = 1000, idle_seconds: float = 3600, max_tokens: int = 2000,
+                 summarizer: Summarizer = None, summary_workers: int = 1):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, summary_workers), thread_name_prefix="chat-summary"
+        ) if summarizer else None
+        self._sessions = OrderedDict()  # session_id -> (最近使用时间, ChatMemory)
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "evicted": 0, "expired": 0}
+
+    def get(self, session_id: str) -> ChatMemory:
+        """
+        获取会话的对话记忆，不存在时创建
+
+        @param session_id: 会话 ID
+        @return: ChatMemory
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                memory = ChatMemory(max_tokens=self.max_tokens, summarizer=self.summarizer, executor=self._executor)
+                self._stats["created"] += 1
+            else:
+                memory = entry[1]
+            self._sessions[session_id] = (now, memory)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._stats["evicted"] += 1
+            return memory
+
+    def _expire(self, now: float):
+        # 按最近使用排序，最早的在前
+        while self._sessions:
+            session_id, (last_used, _) = next(iter(self._sessions.items()))
+            if now - last_used <= self.idle_seconds:
+                break
+            del self._sessions[session_id]
+            self._stats["expired"] += 1
+
+    def drop(self, session_id: str):
+        """结束会话"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sessions"] = len(self._sessions)
+        return stats
@@ -1,45 +1,21 @@
 from langchain.prompts import ChatPromptTemplate
-from langchain_core.memory import BaseMemory
-from langchain_core.messages import HumanMessage, AIMessage
 from langchain_openai import ChatOpenAI
-from langchain_community.document_loaders import TextLoader
-from langchain_community.vectorstores import FAISS
 from langchain_community.embeddings import DashScopeEmbeddings
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains.retrieval import create_retrieval_chain
-from langchain_core.runnables import RunnablePassthrough
 from app.utils.email_service import send_support_email
-from pydantic import BaseModel, Field
+from app.utils.knowledge_index import load_or_build_index
+from app.utils.embedding_cache import CachedEmbeddings
+from app.utils.query_router import KnowledgeRouter, KNOWLEDGE_ROUTE
+from app.routes.config import KNOWLEDGE_BASE_PATHS
+from app.utils.chat_memory import ChatMemory, SessionMemoryStore
+from app.utils.llm_pool import env_int, env_float
 import os
 import logging
-from typing import Dict, Any, List
 
 logger = logging.getLogger(__name__)
 
-class ChatMemory(BaseMemory, BaseModel):
-    """自定义对话记忆类"""
-    chat_history: List = Field(default_factory=list)
-    
-    def clear(self):
-        self.chat_history = []
-    
-    @property
-    def memory_variables(self) -> List[str]:
-        return ["chat_history"]
-    
-    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
-        formatted_history = ""
-        for i in range(0, len(self.chat_history), 2):
-            if i + 1 < len(self.chat_history):
-                user_msg = self.chat_history[i].content
-                ai_msg = self.chat_history[i + 1].content
-                formatted_history += f"用户: {user_msg}\n助手: {ai_msg}\n\n"
-        return {"chat_history": formatted_history}
-    
-    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, Any]) -> None:
-        if "input" in inputs and "output" in outputs:
-            self.chat_history.append(HumanMessage(content=inputs["input"]))
-            self.chat_history.append(AIMessage(content=outputs["output"]))
+# 知识库向量化模型，更换后索引自动重建
+EMBEDDING_MODEL = os.getenv("KNOWLEDGE_EMBEDDING_MODEL", "text-embedding-v2")
 
 class CustomerSupportBot:
     def __init__(self):
@@ -52,8 +28,14 @@ class CustomerSupportBot:
             openai_api_key=os.getenv("DASHSCOPE_API_KEY")
         )
         
-        # 初始化自定义对话记忆
-        self.memory = ChatMemory()
+        # 按会话隔离的对话记忆，每个会话只保留最近 CHAT_MEMORY_MAX_TOKENS 个 token 的对话
+        self.sessions = SessionMemoryStore(
+            max_sessions=env_int("CHAT_MEMORY_MAX_SESSIONS", 1000),
+            idle_seconds=env_float("CHAT_MEMORY_IDLE_SECONDS", 3600),
+            max_tokens=env_int("CHAT_MEMORY_MAX_TOKENS", 2000),
+            # 可选：移出窗口的对话在后台压缩为摘要
+            summarizer=self._summarize if os.getenv("CHAT_MEMORY_SUMMARIZE", "false").lower() == "true" else None,
+        )
         
         # 创建对话提示模板
         self.chat_prompt = ChatPromptTemplate.from_messages([
@@ -66,14 +48,8 @@ class CustomerSupportBot:
             ("human", "{input}")
         ])
         
-        # 创建对话链
-        self.conversation = (
-            RunnablePassthrough.assign(
-                chat_history=lambda x: self.memory.load_memory_variables({})["chat_history"]
-            )
-            | self.chat_prompt 
-            | self.chat_model
-        )
+        # 创建对话链，对话历史由调用方按会话传入
+        self.conversation = self.chat_prompt | self.chat_model
         
         # 创建文档检索提示模板
         self.qa_prompt = ChatPromptTemplate.from_messages([
@@ -87,65 +63,80 @@ class CustomerSupportBot:
     def _init_knowledge_base(self):
         """初始化知识库"""
         try:
-            # 加载文档
-            knowledge_path = os.path.join('app', 'data', 'knowledge_base.txt')
-            loader = TextLoader(knowledge_path, encoding='utf-8')
-            documents = loader.load()
-            
-            # 创建向量存储
-            embeddings = DashScopeEmbeddings(
-                model="text-embedding-v2",  # 使用最新的v2模型
-                dashscope_api_key=os.getenv("DASHSCOPE_API_KEY")  # 使用 dashscope_api_key 而不是 api_key
+            # 查询和文档向量都经过缓存，重复的问题不再调用向量化接口
+            embeddings = CachedEmbeddings(
+                DashScopeEmbeddings(
+                    model=EMBEDDING_MODEL,
+                    dashscope_api_key=os.getenv("DASHSCOPE_API_KEY")  # 使用 dashscope_api_key 而不是 api_key
+                ),
+                EMBEDDING_MODEL
             )
-            self.vectorstore = FAISS.from_documents(documents, embeddings)
+            # 加载磁盘上的索引，知识库内容或向量化模型变化时才重新向量化
+            self.vectorstore = load_or_build_index(KNOWLEDGE_BASE_PATHS, embeddings, EMBEDDING_MODEL)
             
-            # 创建新的问答链
-            combine_docs_chain = create_stuff_documents_chain(
+            # 创建问答链，上下文为路由时检索到的文档，不再重复检索
+            self.qa_chain = create_stuff_documents_chain(
                 self.chat_model,
                 self.qa_prompt  # 使用包含 context 的提示模板
             )
             
-            self.qa_chain = create_retrieval_chain(
-                self.vectorstore.as_retriever(),
-                combine_docs_chain
-            )
+            # 调用模型之前按知识库相似度选择问答链或对话链
+            self.router = KnowledgeRouter(self.vectorstore)
             
         except Exception as e:
             logger.error(f"初始化知识库失败: {str(e)}")
             logger.error("详细错误信息: ", exc_info=True)
             raise
             
-    def handle_query(self, user_input: str) -> str:
-        """处理用户查询"""
+    def _summarize(self, summary: str, turns: str) -> str:
+        """把移出窗口的对话合并进摘要"""
+        response = self.chat_model.invoke(
+            "请把以下客服对话合并进已有摘要，保留用户的问题、诉求和已给出的解决方案，不超过200字，只返回摘要。\n\n"
+            f"已有摘要：{summary or '无'}\n\n对话：\n{turns}"
+        )
+        return response.content.strip()
+            
+    def handle_query(self, user_input: str, session_id: str = "default") -> str:
+        """
+        处理用户查询
+        
+        @param user_input: 用户输入
+        @param session_id: 会话 ID，不同会话的对话历史相互独立
+        @return: 回复
+        """
+        memory = self.sessions.get(session_id)
         try:
+            # 先用知识库相似度选择路由，每个问题只调用一次模型
+            decision = self.router.route(user_input)
+            if decision.route == KNOWLEDGE_ROUTE:
+                answer = self.qa_chain.invoke({
+                    "input": user_input,
+                    "context": decision.documents
+                })
+                answer = f"根据知识库，您可以参考以下内容：\n{answer}"
+                # 保存知识库回答到记忆
+                memory.save_context(
+                    {"input": user_input},
+                    {"output": answer}
+                )
+                return answer
+            
             # 使用对话链处理输入
-            response = self.conversation.invoke({"input": user_input})
+            response = self.conversation.invoke({
+                "input": user_input,
+                "chat_history": memory.load_memory_variables({})["chat_history"]
+            })
             response_text = response.content
             
             # 保存对话到记忆
-            self.memory.save_context(
+            memory.save_context(
                 {"input": user_input},
                 {"output": response_text}
             )
-            
-            # 检查是否需要查询知识库
-            if self._needs_knowledge_base(response_text):
-                qa_response = self.qa_chain.invoke({
-                    "input": user_input,
-                    "chat_history": self.memory.load_memory_variables({}).get("chat_history", "")
-                })
-                if qa_response and hasattr(qa_response, 'answer'):
-                    answer = f"根据知识库，您可以参考以下内容：\n{qa_response.answer}"
-                    # 保存知识库回答到记忆
-                    self.memory.save_context(
-                        {"input": user_input},
-                        {"output": answer}
-                    )
-                    return answer
                     
             # 如果无法解决，升级到人工客服
             if self._needs_escalation(response_text):
-                return self._escalate_to_human(user_input)
+                return self._escalate_to_human(user_input, memory)
                 
             return response_text
             
@@ -153,21 +144,16 @@ class CustomerSupportBot:
             logger.error(f"处理查询时出错: {str(e)}")
             return "抱歉，系统出现了一些问题，请稍后再试。"
             
-    def _needs_knowledge_base(self, response: str) -> bool:
-        """判断是否需要查询知识库"""
-        keywords = ['不清楚', '不知道', '无法回答', '需要查询']
-        return any(keyword in response for keyword in keywords)
-        
     def _needs_escalation(self, response: str) -> bool:
         """判断是否需要升级到人工"""
         keywords = ['无法解决', '需要人工', '太复杂', '建议联系客服']
         return any(keyword in response for keyword in keywords)
         
-    def _escalate_to_human(self, query: str) -> str:
+    def _escalate_to_human(self, query: str, memory: ChatMemory) -> str:
         """升级到人工客服"""
         try:
-            # 获取完整对话历史
-            chat_history = self.memory.load_memory_variables({})["chat_history"]
+            # 获取会话的对话历史
+            chat_history = memory.load_memory_variables({})["chat_history"]
             
             # 发送邮件通知
             subject = "客服机器人：问题升级通知"
@@ -0,0 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import hashlib
+import logging
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .llm_cache import TwoTierCache, CACHE_DB
+from .llm_metrics import EMBEDDING_CALLS, EMBEDDING_LATENCY, EMBEDDING_TEXTS
+from .llm_pool import env_int, env_float
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 各模型单次请求的最大文本数（DashScope 的限制），未列出的模型使用 DEFAULT_BATCH_SIZE
+BATCH_LIMITS = {"text-embedding-v1": 25, "text-embedding-v2": 25, "text-embedding-v3": 6}
+DEFAULT_BATCH_SIZE = 10
+
+# 向量缓存：float32 字节，默认保留三十天
+embedding_cache = TwoTierCache(
+    "embeddings",
+    CACHE_DB,
+    ttl=env_float("EMBEDDING_CACHE_TTL", 30 * 24 * 3600),
+    max_entries=env_int("EMBEDDING_CACHE_MEMORY_SIZE", 2048),
+)
+
+
+def normalize_text(text: str) -> str:
+    """缓存键使用的规范化文本：NFKC、合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    带缓存和批量调用的向量化模型
+
+    按 (模型, query/document, 规范化文本) 缓存向量；未命中的文本去重后按模型的批量上限分批，
+    多个批次并发调用。查询和文档分开缓存，因为 DashScope 对两者使用不同的 text_type。
+    """
+
+    def __init__(self, inner: Embeddings, model: str, cache: TwoTierCache = None,
+                 batch_size: int = None, max_concurrency: int = None):
+        self.inner = inner
+        self.model = model
+        self.cache = cache or embedding_cache
+        self.batch_size = batch_size or BATCH_LIMITS.get(model, DEFAULT_BATCH_SIZE)
+        self.max_concurrency = max(1, max_concurrency or env_int("EMBEDDING_MAX_CONCURRENCY", 4))
+        self._lock = threading.Lock()
+        self._stats = {"cached": 0, "embedded": 0, "calls": 0}
+
+    def _key(self, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{self.model}|{kind}|{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[List[float]]:
+        value = self.cache.get(key)
+        return None if value is None else np.frombuffer(value, dtype=np.float32).tolist()
+
+    def _store(self, key: str, vector: List[float]):
+        self.cache.set(key, np.asarray(vector, dtype=np.float32).tobytes())
+
+    def _count(self, kind: str, cached: int, embedded: int, calls: int):
+        with self._lock:
+            self._stats["cached"] += cached
+            self._stats["embedded"] += embedded
+            self._stats["calls"] += calls
+        if cached:
+            EMBEDDING_TEXTS.labels(self.model, kind, "cached").inc(cached)
+        if embedded:
+            EMBEDDING_TEXTS.labels(self.model, kind, "embedded").inc(embedded)
+
+    def _call(self, kind: str, fn, payload):
+        start = time.perf_counter()
+        try:
+            result = fn(payload)
+        except Exception:
+            EMBEDDING_CALLS.labels(self.model, kind, "error").inc()
+            raise
+        EMBEDDING_CALLS.labels(self.model, kind, "success").inc()
+        EMBEDDING_LATENCY.labels(self.model, kind).observe(time.perf_counter() - start)
+        return result
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        向量化多段文档
+
+        @param texts: 文本列表
+        @return: 与 texts 顺序一致的向量
+        """
+        keys = [self._key("document", text) for text in texts]
+        vectors: Dict[str, List[float]] = {}
+        missing: Dict[str, str] = {}  # 缓存键 -> 文本（相同文本只调用一次）
+        for key, text in zip(keys, texts):
+            if key in vectors or key in missing:
+                continue
+            vector = self._lookup(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                vectors[key] = vector
+
+        pending = list(missing.items())
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+
+        def run(batch):
+            return self._call("document", self.inner.embed_documents, [text for _, text in batch])
+
+        if len(batches) > 1 and self.max_concurrency > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches)),
+                                    thread_name_prefix="embedding") as executor:
+                results = list(executor.map(run, batches))
+        else:
+            results = [run(batch) for batch in batches]
+
+        for batch, batch_vectors in zip(batches, results):
+            for (key, _), vector in zip(batch, batch_vectors):
+                vectors[key] = vector
+                self._store(key, vector)
+
+        self._count("document", len(texts) - len(pending), len(pending), len(batches))
+        if batches:
+            logger.info(f"向量化 {len(pending)} 段文本（{len(batches)} 次调用），缓存命中 {len(texts) - len(pending)} 段")
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """向量化查询，相同的查询直接使用缓存"""
+        key = self._key("query", text)
+        vector = self._lookup(key)
+        if vector is not None:
+            self._count("query", 1, 0, 0)
+            return vector
+        vector = self._call("query", self.inner.embed_query, text)
+        self._store(key, vector)
+        self._count("query", 0, 1, 1)
+        return vector
+
+    def stats(self) -> Dict[str, int]:
+        """缓存命中的文本数、实际向量化的文本数和接口调用次数"""
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,226 @@
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.routes.config import KNOWLEDGE_INDEX_DIR
+from .llm_cache import CACHE_DB
+from .llm_pool import env_float, env_int
+from .llm_singleflight import InflightLease
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "index"
+# 向量写入和查询前都做 L2 归一化，平方欧氏距离 d 与余弦相似度满足 cos = 1 - d/2（路由阈值依赖这一点）；
+# 该设置参与指纹计算，未归一化的旧索引不会被加载或用作增量更新的基础
+NORMALIZE_L2 = True
+_BUILDING_PREFIX = ".building-"
+# 首次构建索引的租约时长：同一内容只由一个 worker 调用向量化接口，其他 worker 等待后直接加载
+BUILD_LEASE_SECONDS = env_float("KNOWLEDGE_INDEX_BUILD_LEASE", 600)
+BUILD_POLL_SECONDS = 0.5
+# 分块：按 "# " 标题切分章节，超过 CHUNK_SIZE 个字符的章节再按段落/行切分并保留 CHUNK_OVERLAP 个字符的重叠
+CHUNK_SIZE = env_int("KNOWLEDGE_CHUNK_SIZE", 800)
+CHUNK_OVERLAP = env_int("KNOWLEDGE_CHUNK_OVERLAP", 100)
+
+_SECTION_HEADER = re.compile(r"^#\s+(.+?)\s*$", re.MULTILINE)
+
+
+def _split_sections(text: str) -> List[Tuple[str, str]]:
+    """按 "# " 标题切分为 (标题, 章节全文)，第一个标题之前的内容标题为空"""
+    headers = list(_SECTION_HEADER.finditer(text))
+    starts = [0] + [m.start() for m in headers] + [len(text)]
+    titles = [""] + [m.group(1) for m in headers]
+    sections = []
+    for title, start, end in zip(titles, starts, starts[1:]):
+        body = text[start:end].strip()
+        if body:
+            sections.append((title, body))
+    return sections
+
+
+def chunk_documents(paths: List[str], chunk_size: int = CHUNK_SIZE,
+                    chunk_overlap: int = CHUNK_OVERLAP) -> List[Document]:
+    """
+    读取知识库并按章节分块
+
+    每个块的 metadata 包含 source、section 和 chunk_id。chunk_id 为来源、章节和块内容的哈希，
+    内容不变时保持不变；完全相同的块按出现顺序区分。
+
+    @param paths: 知识库文件
+    @param chunk_size: 每块最大字符数
+    @param chunk_overlap: 同一章节相邻块的重叠字符数
+    @return: 分块后的文档
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=min(chunk_overlap, chunk_size // 2),
+        separators=["\n\n", "\n", "。", " ", ""],
+    )
+    documents, seen = [], {}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        source = os.path.basename(path)
+        for title, body in _split_sections(text):
+            pieces = splitter.split_text(body) if len(body) > chunk_size else [body]
+            for i, piece in enumerate(pieces):
+                # 续块带上章节标题，检索到时仍知道所属章节
+                content = piece if i == 0 or not title else f"# {title}\n{piece}"
+                digest = hashlib.sha256(f"{source}\0{title}\0{content}".encode('utf-8')).hexdigest()
+                seen[digest] = seen.get(digest, 0) + 1
+                chunk_id = digest if seen[digest] == 1 else f"{digest}-{seen[digest]}"
+                documents.append(Document(
+                    page_content=content,
+                    metadata={'source': source, 'section': title, 'chunk_id': chunk_id},
+                ))
+    return documents
+
+
+def _model_key(embedding_model: str) -> str:
+    return hashlib.sha256(f"{embedding_model}\0normalize_L2={NORMALIZE_L2}".encode('utf-8')).hexdigest()[:12]
+
+
+def index_fingerprint(documents: List[Document], embedding_model: str) -> str:
+    """
+    索引目录名：向量化模型（含归一化设置）和全部块 ID 的哈希
+
+    @param documents: chunk_documents 的结果
+    @param embedding_model: 向量化模型名称
+    @return: "<模型哈希>-<块集合哈希>"
+    """
+    ids = sorted(doc.metadata['chunk_id'] for doc in documents)
+    return f"{_model_key(embedding_model)}-{hashlib.sha256(chr(10).join(ids).encode('utf-8')).hexdigest()}"
+
+
+def _load(folder: str, embeddings: Embeddings) -> Optional[FAISS]:
+    if not os.path.exists(os.path.join(folder, f"{INDEX_NAME}.faiss")):
+        return None
+    try:
+        # docstore 是本服务自己写入的 pickle 文件
+        return FAISS.load_local(folder, embeddings, INDEX_NAME, allow_dangerous_deserialization=True,
+                                normalize_L2=NORMALIZE_L2)
+    except Exception as e:
+        logger.warning(f"加载知识库索引 {folder} 失败，重新构建: {str(e)}")
+        return None
+
+
+def _latest_base(index_dir: str, embedding_model: str, embeddings: Embeddings) -> Optional[FAISS]:
+    """同一向量化模型最近保存的索引，用作增量更新的基础"""
+    if not os.path.isdir(index_dir):
+        return None
+    prefix = _model_key(embedding_model) + "-"
+    folders = [os.path.join(index_dir, name) for name in os.listdir(index_dir) if name.startswith(prefix)]
+    for folder in sorted(folders, key=os.path.getmtime, reverse=True):
+        index = _load(folder, embeddings)
+        if index is not None:
+            return index
+    return None
+
+
+def _update(index: Optional[FAISS], documents: List[Document], embeddings: Embeddings) -> FAISS:
+    """
+    把索引更新为 documents：删除已不存在的块，只向量化新增或改动的块
+
+    @return: 更新后的索引（index 为 None 时全部向量化）
+    """
+    wanted: Dict[str, Document] = {doc.metadata['chunk_id']: doc for doc in documents}
+    if index is None:
+        logger.info(f"知识库索引全量构建: {len(wanted)} 个块")
+        return FAISS.from_documents(list(wanted.values()), embeddings, ids=list(wanted), normalize_L2=NORMALIZE_L2)
+
+    existing = set(index.index_to_docstore_id.values())
+    stale = [chunk_id for chunk_id in existing if chunk_id not in wanted]
+    added = [chunk_id for chunk_id in wanted if chunk_id not in existing]
+    if stale:
+        index.delete(stale)
+    if added:
+        index.add_documents([wanted[chunk_id] for chunk_id in added], ids=added)
+    logger.info(f"知识库索引增量更新: 新增 {len(added)} 个块，删除 {len(stale)} 个块，未变 {len(wanted) - len(added)} 个块")
+    return index
+
+
+def _save(index: FAISS, index_dir: str, folder: str):
+    # 先写入临时目录再改名，其他 worker 不会读到写了一半的索引
+    os.makedirs(index_dir, exist_ok=True)
+    building = tempfile.mkdtemp(prefix=_BUILDING_PREFIX, dir=index_dir)
+    index.save_local(building, INDEX_NAME)
+    try:
+        os.rename(building, folder)
+    except OSError:
+        # 其他进程已经写入了同一指纹的索引
+        shutil.rmtree(building, ignore_errors=True)
+
+
+def _prune(index_dir: str, keep: str):
+    """删除其他指纹（旧内容或旧模型）的索引"""
+    for name in os.listdir(index_dir):
+        if name != keep and not name.startswith(_BUILDING_PREFIX):
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+
+
+def load_or_build_index(paths: List[str], embeddings: Embeddings, embedding_model: str,
+                        index_dir: str = KNOWLEDGE_INDEX_DIR) -> FAISS:
+    """
+    加载持久化的知识库索引，知识库内容或向量化模型变化时才更新
+
+    索引保存在 index_dir/<指纹> 下，指纹由向量化模型和全部块 ID 决定。内容变化时以同一模型最近的索引
+    为基础增量更新，只向量化改动的章节块。多个 worker 同时启动时通过 SQLite 租约只由一个 worker 更新。
+
+    @param paths: 知识库文件
+    @param embeddings: 向量化模型
+    @param embedding_model: 向量化模型名称（参与指纹计算）
+    @param index_dir: 索引目录
+    @return: FAISS 向量存储
+    """
+    documents = chunk_documents(paths)
+    fingerprint = index_fingerprint(documents, embedding_model)
+    folder = os.path.join(index_dir, fingerprint)
+    index = _load(folder, embeddings)
+    if index is not None:
+        return index
+
+    lease = InflightLease(CACHE_DB, BUILD_LEASE_SECONDS)
+    key = f"knowledge-index:{fingerprint}"
+    deadline = time.monotonic() + BUILD_LEASE_SECONDS
+    owner = None
+    while True:
+        try:
+            owner = lease.acquire(key)
+        except sqlite3.Error as e:
+            logger.warning(f"获取知识库索引构建租约失败，直接构建: {str(e)}")
+            break
+        if owner is not None or time.monotonic() > deadline:
+            break
+        # 其他 worker 正在构建
+        time.sleep(BUILD_POLL_SECONDS)
+        index = _load(folder, embeddings)
+        if index is not None:
+            return index
+
+    try:
+        # 等待租约期间可能已由其他 worker 构建完成
+        index = _load(folder, embeddings)
+        if index is None:
+            start = time.perf_counter()
+            index = _update(_latest_base(index_dir, embedding_model, embeddings), documents, embeddings)
+            _save(index, index_dir, folder)
+            _prune(index_dir, fingerprint)
+            logger.info(f"知识库索引已保存: {index.index.ntotal} 个向量，耗时 {time.perf_counter() - start:.1f}s")
+        return index
+    finally:
+        if owner is not None:
+            try:
+                lease.release(key, owner)
+            except sqlite3.Error as e:
+                logger.warning(f"释放知识库索引构建租约失败: {str(e)}")
@@ -0,0 +1,140 @@
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+import time
+
+from .llm_pool import env_int, registry
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 批量调用的默认并发数，不要超过连接池上限（<PROVIDER>_MAX_CONNECTIONS）
+DEFAULT_BATCH_CONCURRENCY = env_int("LLM_BATCH_CONCURRENCY", 8)
+
+
+@dataclass
+class BatchItem:
+    """批量调用中单条请求的结果"""
+    index: int
+    content: Optional[str] = None
+    error: Optional[str] = None
+    latency: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class BatchResult:
+    """批量调用结果，items 与输入顺序一致"""
+    items: List[BatchItem] = field(default_factory=list)
+    elapsed: float = 0.0
+    max_concurrency: int = 0
+
+    @property
+    def contents(self) -> List[Optional[str]]:
+        """按输入顺序的回复内容，失败的条目为 None"""
+        return [item.content for item in self.items]
+
+    @property
+    def succeeded(self) -> int:
+        return sum(1 for item in self.items if item.ok)
+
+    @property
+    def failed(self) -> int:
+        return len(self.items) - self.succeeded
+
+    @property
+    def throughput(self) -> float:
+        """每分钟完成的条数"""
+        return round(len(self.items) * 60 / self.elapsed, 2) if self.elapsed else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        latencies = sorted(item.latency for item in self.items if item.ok)
+        return {
+            "total": len(self.items),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "elapsed": round(self.elapsed, 2),
+            "max_concurrency": self.max_concurrency,
+            "per_minute": self.throughput,
+            "avg_latency": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "max_latency": round(latencies[-1], 2) if latencies else None,
+        }
+
+
+async def arun_batch(aget_completion: Callable[..., Awaitable[str]], batch: List[List[Dict[str, Any]]],
+                     max_concurrency: int = None, **kwargs) -> BatchResult:
+    """
+    并发执行一批补全请求
+
+    用信号量限制同时在途的请求数；单条失败只记录在对应的 BatchItem 中，不影响其他请求。
+
+    @param aget_completion: 客户端的异步补全方法
+    @param batch: 消息列表的列表
+    @param max_concurrency: 最大并发数，默认 LLM_BATCH_CONCURRENCY
+    @param kwargs: 透传给 aget_completion 的参数（如 use_cache）
+    @return: BatchResult
+    """
+    max_concurrency = max(1, max_concurrency or DEFAULT_BATCH_CONCURRENCY)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    total = len(batch)
+    done = 0
+
+    async def run_one(index: int, messages: List[Dict[str, Any]]) -> BatchItem:
+        nonlocal done
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                content = await aget_completion(messages, **kwargs)
+                item = BatchItem(index, content=content, latency=time.monotonic() - started)
+            except Exception as e:
+                logger.error(f"批量调用第 {index} 条失败: {str(e)}")
+                item = BatchItem(index, error=str(e) or type(e).__name__, latency=time.monotonic() - started)
+        done += 1
+        logger.debug(f"批量调用进度: {done}/{total}")
+        return item
+
+    started = time.monotonic()
+    items = await asyncio.gather(*(run_one(i, messages) for i, messages in enumerate(batch)))
+    result = BatchResult(items=list(items), elapsed=time.monotonic() - started, max_concurrency=max_concurrency)
+    summary = result.summary()
+    logger.info(
+        f"批量调用完成: 成功 {summary['succeeded']}/{summary['total']}，耗时 {summary['elapsed']}s，"
+        f"并发 {max_concurrency}，吞吐 {summary['per_minute']} 条/分钟"
+    )
+    return result
+
+
+class BatchCompletionMixin:
+    """为提供 aget_completion 的客户端增加批量调用接口"""
+
+    async def aget_completions(self, batch: List[List[Dict[str, Any]]], max_concurrency: int = None,
+                               **kwargs) -> BatchResult:
+        """
+        并发获取一批消息的回复
+
+        @param batch: 消息列表的列表
+        @param max_concurrency: 最大并发数
+        @param kwargs: 透传给 aget_completion 的参数
+        @return: BatchResult，items 与 batch 顺序一致
+        """
+        return await arun_batch(self.aget_completion, batch, max_concurrency, **kwargs)
+
+    def get_completions(self, batch: List[List[Dict[str, Any]]], max_concurrency: int = None,
+                        **kwargs) -> BatchResult:
+        """
+        aget_completions 的同步入口，供离线任务使用
+
+        内部会新建事件循环，不能在已运行的事件循环中调用（此时请使用 aget_completions）。
+        异步客户端的连接池绑定在事件循环上，循环结束前关闭，避免每次调用泄漏一组连接。
+        """
+        async def run():
+            try:
+                return await self.aget_completions(batch, max_concurrency, **kwargs)
+            finally:
+                await registry.aclose()
+        
+        return asyncio.run(run())
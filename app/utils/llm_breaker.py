@@ -0,0 +1,197 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict
+import logging
+import threading
+import time
+
+from .llm_pool import env_int, env_float
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+@dataclass
+class BreakerConfig:
+    """熔断配置"""
+    window_seconds: float = 60.0
+    min_calls: int = 5
+    failure_rate_threshold: float = 0.5
+    slow_call_seconds: float = 30.0
+    slow_call_rate_threshold: float = 0.8
+    open_seconds: float = 30.0
+    half_open_max_calls: int = 1
+
+    @classmethod
+    def from_env(cls) -> "BreakerConfig":
+        return cls(
+            window_seconds=env_float("LLM_BREAKER_WINDOW", cls.window_seconds),
+            min_calls=env_int("LLM_BREAKER_MIN_CALLS", cls.min_calls),
+            failure_rate_threshold=env_float("LLM_BREAKER_FAILURE_RATE", cls.failure_rate_threshold),
+            slow_call_seconds=env_float("LLM_BREAKER_SLOW_CALL", cls.slow_call_seconds),
+            slow_call_rate_threshold=env_float("LLM_BREAKER_SLOW_RATE", cls.slow_call_rate_threshold),
+            open_seconds=env_float("LLM_BREAKER_OPEN_SECONDS", cls.open_seconds),
+            half_open_max_calls=env_int("LLM_BREAKER_HALF_OPEN_CALLS", cls.half_open_max_calls),
+        )
+
+
+class CircuitBreaker:
+    """
+    单个模型的熔断器
+
+    closed: 正常放行，滑动窗口内错误率或慢调用率超过阈值时转为 open
+    open: 拒绝请求，open_seconds 后转为 half_open
+    half_open: 放行少量探测请求，成功则恢复 closed，失败或过慢则重新 open
+    """
+
+    def __init__(self, name: str, config: BreakerConfig = None):
+        self.name = name
+        self.config = config or BreakerConfig.from_env()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._calls = deque()  # (时间戳, 是否成功, 耗时)
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            return self._state
+
+    def _refresh_state(self, now: float):
+        if self._state == OPEN and now - self._opened_at >= self.config.open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+            logger.info(f"熔断器 {self.name} 进入半开状态，开始探测")
+
+    def _prune(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.config.window_seconds:
+            self._calls.popleft()
+
+    def _rates(self):
+        total = len(self._calls)
+        if not total:
+            return 0.0, 0.0
+        failures = sum(1 for _, ok, _ in self._calls if not ok)
+        slow = sum(1 for _, ok, latency in self._calls if ok and latency >= self.config.slow_call_seconds)
+        return failures / total, slow / total
+
+    def _trip(self, now: float, reason: str):
+        self._state = OPEN
+        self._opened_at = now
+        self._probes = 0
+        logger.warning(f"熔断器 {self.name} 打开: {reason}")
+
+    def allow_request(self) -> bool:
+        """
+        判断当前是否放行请求；half_open 状态下放行的请求占用一个探测名额
+
+        @return: 是否放行
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refresh_state(now)
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.config.half_open_max_calls:
+                self._probes += 1
+                return True
+            return False
+
+    def record_success(self, latency: float):
+        """记录一次成功调用"""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if latency >= self.config.slow_call_seconds:
+                    self._trip(now, f"探测请求过慢 ({latency:.1f}s)")
+                else:
+                    self._state = CLOSED
+                    self._calls.clear()
+                    logger.info(f"熔断器 {self.name} 已恢复")
+                return
+            self._calls.append((now, True, latency))
+            self._evaluate(now)
+
+    def record_failure(self, latency: float):
+        """记录一次失败调用"""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                self._trip(now, "探测请求失败")
+                return
+            self._calls.append((now, False, latency))
+            self._evaluate(now)
+
+    def release(self):
+        """请求被取消、未产生结果时归还探测名额"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def _evaluate(self, now: float):
+        self._prune(now)
+        if self._state != CLOSED or len(self._calls) < self.config.min_calls:
+            return
+        failure_rate, slow_rate = self._rates()
+        if failure_rate >= self.config.failure_rate_threshold:
+            self._trip(now, f"错误率 {failure_rate:.0%}")
+        elif slow_rate >= self.config.slow_call_rate_threshold:
+            self._trip(now, f"慢调用率 {slow_rate:.0%}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """熔断器状态和健康分 (0-1)"""
+        with self._lock:
+            now = time.monotonic()
+            self._refresh_state(now)
+            self._prune(now)
+            failure_rate, slow_rate = self._rates()
+            latencies = [latency for _, _, latency in self._calls]
+            if self._state == OPEN:
+                score = 0.0
+            else:
+                score = (1 - failure_rate) * (1 - 0.5 * slow_rate)
+            return {
+                "state": self._state,
+                "health_score": round(score, 3),
+                "calls": len(self._calls),
+                "failure_rate": round(failure_rate, 3),
+                "slow_call_rate": round(slow_rate, 3),
+                "avg_latency": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                "retry_in": round(max(0.0, self.config.open_seconds - (now - self._opened_at)), 1)
+                if self._state == OPEN else 0.0,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(label: str) -> CircuitBreaker:
+    """
+    获取（必要时创建）模型对应的熔断器
+
+    @param label: "提供商/模型"
+    @return: CircuitBreaker
+    """
+    breaker = _breakers.get(label)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(label)
+            if breaker is None:
+                breaker = _breakers[label] = CircuitBreaker(label)
+    return breaker
+
+
+def health_snapshot() -> Dict[str, Dict[str, Any]]:
+    """所有熔断器的状态快照"""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {label: breaker.snapshot() for label, breaker in breakers.items()}
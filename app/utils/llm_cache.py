@@ -0,0 +1,268 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from app.routes.config import CACHE_DIR
+from .llm_pool import env_int, env_float
+from .llm_singleflight import single_flight
+from .sqlite_helper import thread_connection
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 磁盘层每写入 PURGE_EVERY 次清理一次：删除过期条目，并把每个命名空间的条目数限制在 DISK_MAX_ENTRIES 以内（0 表示不限制）
+PURGE_EVERY = env_int("LLM_CACHE_PURGE_EVERY", 256)
+DISK_MAX_ENTRIES = env_int("LLM_CACHE_DISK_MAX_ENTRIES", 100000)
+
+
+class TwoTierCache:
+    """
+    两级缓存：进程内 LRU + 磁盘 SQLite
+
+    SQLite 使用 WAL 模式，同一台机器上的多个 gunicorn worker 共享磁盘层；
+    每个线程使用独立连接。值可以是 str 或 bytes。
+    过期条目读取时跳过，每写入 purge_every 次从磁盘删除，同时按过期时间淘汰超出 max_disk_entries 的条目。
+    """
+
+    def __init__(self, name: str, db_path: str, ttl: float, max_entries: int = 512,
+                 max_disk_entries: int = None, purge_every: int = None):
+        self.name = name
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = DISK_MAX_ENTRIES if max_disk_entries is None else max_disk_entries
+        self.purge_every = max(1, PURGE_EVERY if purge_every is None else purge_every)
+        self._memory = OrderedDict()  # key -> (过期时间, 值)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # 启动后的第一次写入也清理一次，重启频繁时磁盘层同样不会无限增长
+        self._writes_since_purge = self.purge_every - 1
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "purged": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        return thread_connection(
+            self._local, self.db_path,
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB,"
+            " expires_at REAL NOT NULL, PRIMARY KEY (namespace, key));"
+            "CREATE INDEX IF NOT EXISTS cache_entries_expiry ON cache_entries (namespace, expires_at);"
+        )
+
+    def _count(self, stat: str, n: int = 1):
+        with self._lock:
+            self._stats[stat] += n
+
+    def _remember(self, key: str, value: Any, expires_at: float):
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        读取缓存，先查内存再查磁盘，磁盘命中会回填内存
+
+        @param key: 缓存键
+        @return: 缓存值，未命中或已过期时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+
+        try:
+            row = self._connect().execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.name, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"读取 {self.name} 磁盘缓存失败: {str(e)}")
+            row = None
+
+        if row is None or row[1] <= now:
+            self._count("misses")
+            return None
+        self._remember(key, row[0], row[1])
+        self._count("disk_hits")
+        return row[0]
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        """
+        写入缓存（内存和磁盘）
+
+        @param key: 缓存键
+        @param value: 缓存值
+        @param ttl: 过期秒数，默认使用缓存的 ttl
+        """
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._remember(key, value, expires_at)
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.name, key, value, expires_at)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"写入 {self.name} 磁盘缓存失败: {str(e)}")
+        with self._lock:
+            self._stats["writes"] += 1
+            self._writes_since_purge += 1
+            due = self._writes_since_purge >= self.purge_every
+            if due:
+                self._writes_since_purge = 0
+        if due:
+            try:
+                self.purge_expired()
+            except sqlite3.Error as e:
+                logger.warning(f"清理 {self.name} 磁盘缓存失败: {str(e)}")
+
+    def delete(self, key: str):
+        """删除缓存"""
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.name, key))
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"删除 {self.name} 磁盘缓存失败: {str(e)}")
+
+    def purge_expired(self) -> int:
+        """
+        清理磁盘中已过期的缓存；条目数超过 max_disk_entries 时再删除最早过期的条目
+
+        @return: 清理条数
+        """
+        conn = self._connect()
+        purged = conn.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?", (self.name, time.time())
+        ).rowcount
+        if self.max_disk_entries > 0:
+            purged += conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                " SELECT key FROM cache_entries WHERE namespace = ?"
+                " ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.name, self.name, self.max_disk_entries)
+            ).rowcount
+        conn.commit()
+        if purged:
+            self._count("purged", purged)
+            logger.info(f"清理 {self.name} 磁盘缓存 {purged} 条")
+        return purged
+
+    def stats(self) -> Dict[str, Any]:
+        """命中/未命中计数和命中率"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else None
+        return stats
+
+
+def completion_cache_key(messages: List[Dict[str, Any]], model: str, temperature: Optional[float],
+                         max_tokens: Optional[int], stop: Optional[List[str]] = None) -> str:
+    """
+    生成补全请求的缓存键
+
+    消息内容去掉首尾空白并统一换行符，确保只因格式差异不同的请求命中同一缓存。
+
+    @return: sha256 十六进制字符串
+    """
+    normalized = [
+        {
+            "role": message.get("role"),
+            "content": message.get("content", "").replace("\r\n", "\n").strip()
+            if isinstance(message.get("content"), str) else message.get("content"),
+        }
+        for message in messages
+    ]
+    payload = json.dumps(
+        {"messages": normalized, "model": model, "temperature": temperature,
+         "max_tokens": max_tokens, "stop": stop},
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+
+CACHE_DB = os.getenv("LLM_CACHE_DB", os.path.join(CACHE_DIR, "llm_cache.sqlite3"))
+
+# LLM 响应缓存，默认保留一天
+response_cache = TwoTierCache(
+    "llm",
+    CACHE_DB,
+    ttl=env_float("LLM_CACHE_TTL", 24 * 3600),
+    max_entries=env_int("LLM_CACHE_MEMORY_SIZE", 512),
+)
+
+
+def cached_call(key: str, compute: Callable[[], str], use_cache: bool = True,
+                refresh_cache: bool = False, cache: TwoTierCache = None,
+                cacheable: Callable[[], bool] = None) -> str:
+    """
+    带缓存的调用
+
+    未命中时经 single_flight 执行，相同键的并发请求只调用一次模型。
+
+    @param key: 缓存键
+    @param compute: 未命中时执行的调用，返回值为空时不缓存
+    @param use_cache: False 时完全绕过缓存（不读不写）
+    @param refresh_cache: True 时跳过读取、重新调用并覆盖缓存
+    @param cache: 使用的缓存，默认 response_cache
+    @param cacheable: compute 完成后调用，返回 False 时结果不写入缓存（如由备用模型生成的回复）
+    @return: 调用结果
+    """
+    cache = cache or response_cache
+    use_cache = use_cache and CACHE_ENABLED
+    if use_cache and not refresh_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"LLM缓存命中: {key[:12]}")
+            return cached
+
+    def load() -> str:
+        value = compute()
+        if use_cache and value and (cacheable is None or cacheable()):
+            cache.set(key, value)
+        return value
+
+    # 刷新缓存时不能读取其他 worker 写入的旧结果
+    lookup = (lambda: cache.get(key)) if use_cache and not refresh_cache else None
+    return single_flight.do(key, load, lookup)
+
+
+async def acached_call(key: str, compute: Callable[[], Awaitable[str]], use_cache: bool = True,
+                       refresh_cache: bool = False, cache: TwoTierCache = None,
+                       cacheable: Callable[[], bool] = None) -> str:
+    """cached_call 的异步版本"""
+    cache = cache or response_cache
+    use_cache = use_cache and CACHE_ENABLED
+    if use_cache and not refresh_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"LLM缓存命中: {key[:12]}")
+            return cached
+
+    async def load() -> str:
+        value = await compute()
+        if use_cache and value and (cacheable is None or cacheable()):
+            cache.set(key, value)
+        return value
+
+    lookup = (lambda: cache.get(key)) if use_cache and not refresh_cache else None
+    return await single_flight.ado(key, load, lookup)
@@ -1,13 +1,24 @@
 from abc import ABC, abstractmethod
-from openai import OpenAI
 import os
 from dotenv import load_dotenv
 import logging
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
 from langchain_core.outputs import ChatResult, ChatGeneration
-from typing import List, Any, Optional, Dict
+from typing import List, Any, Optional, Dict, AsyncIterator, Iterator
 from pydantic import BaseModel, Field  # 使用 pydantic v2
+import asyncio
+import socket
+import threading
+import time
+import httpx
+from .llm_pool import get_openai_client, get_async_openai_client, registry
+from .llm_hedge import Attempt, HedgeCancelled, hedged_call, ahedged_call, policy as hedge_policy
+from .llm_breaker import get_breaker
+from .llm_cache import completion_cache_key, cached_call, acached_call
+from .llm_tokens import prepare_request, count_tokens, record_usage, current_endpoint
+from .llm_batch import BatchCompletionMixin
+from .llm_metrics import track_call, record_fallback
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -15,13 +26,35 @@ logger = logging.getLogger(__name__)
 # 加载环境变量
 load_dotenv()
 
-class BaseLLMClient(ABC):
-    """LLM客户端基类"""
+class BaseLLMClient(BatchCompletionMixin, ABC):
+    """LLM客户端基类，批量调用见 get_completions / aget_completions"""
     
     @abstractmethod
     def get_completion(self, messages):
         """获取模型回复"""
         pass
+    
+    async def aget_completion(self, messages, **kwargs):
+        """异步获取模型回复，子类未实现原生异步时在线程池中执行同步版本"""
+        return await asyncio.to_thread(self.get_completion, messages, **kwargs)
+
+def _format_messages(messages: List[BaseMessage]) -> List[Dict[str, str]]:
+    """将 LangChain 消息转换为 OpenAI 格式"""
+    formatted_messages = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            formatted_messages.append({"role": "user", "content": message.content})
+        elif isinstance(message, AIMessage):
+            formatted_messages.append({"role": "assistant", "content": message.content})
+        else:
+            formatted_messages.append({"role": "system", "content": message.content})
+    return formatted_messages
+
+def _chat_result(content: str) -> ChatResult:
+    """包装为 LangChain ChatResult"""
+    return ChatResult(generations=[
+        ChatGeneration(message=AIMessage(content=content))
+    ])
 
 # class OpenAIClient(BaseLLMClient):
 #     """OpenAI API客户端"""
@@ -43,7 +76,156 @@ class BaseLLMClient(ABC):
 #         logger.info(f"\nOpenAI响应:\n{response.choices[0].message.content}\n")
 #         return response.choices[0].message.content
 
-class DeepSeekClient(BaseChatModel, BaseModel):
+# 主模型和备用模型都失败时返回给用户的友好提示
+GENERATION_ERROR_MESSAGE = "很抱歉，生成旅行计划时遇到了问题。请稍后重试。"
+
+# 主模型与备用模型: (提供商, 模型, max_tokens)
+PRIMARY_MODEL = ("deepseek", "deepseek-r1", 8000)
+FALLBACK_MODEL = ("dashscope", "qwen-turbo", 4000)
+PRIMARY_LABEL = f"{PRIMARY_MODEL[0]}/{PRIMARY_MODEL[1]}"
+MODEL_NAMES = {
+    "deepseek/deepseek-r1": "DeepSeek",
+    "dashscope/qwen-turbo": "通义千问",
+}
+
+def _record_usage(tracker, endpoint, model, prompt_tokens, content, usage=None):
+    """记录 token 用量，优先使用接口返回的 usage，没有时本地计算"""
+    if usage is not None:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+    else:
+        completion_tokens = count_tokens(content)
+    record_usage(endpoint, model, prompt_tokens, completion_tokens)
+    tracker.tokens(prompt_tokens, completion_tokens)
+
+def _iter_chunks(provider, model, messages, max_tokens=None, endpoint=None, on_stream=None,
+                 **params) -> Iterator[Optional[str]]:
+    """
+    流式调用模型，每收到一个片段返回一次（无正文的片段如推理过程返回 None）
+    
+    请求前按上下文窗口做 token 预算，结束时记录用量、耗时和首字延迟。
+    
+    @param provider: 提供商，客户端从连接池注册表获取
+    @param model: 模型名称
+    @param messages: OpenAI 格式消息
+    @param max_tokens: 期望的最大输出，None 时使用模型上限
+    @param endpoint: 调用路由，默认取当前请求
+    @param on_stream: 收到响应头后以流对象调用，供其他线程关闭连接
+    @return: 片段正文迭代器
+    """
+    endpoint = endpoint or current_endpoint()
+    messages, max_tokens, prompt_tokens = prepare_request(messages, model, max_tokens)
+    with track_call(provider, model, endpoint) as tracker:
+        stream = get_openai_client(provider).chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params
+        )
+        if on_stream is not None:
+            on_stream(stream)
+        parts, usage = [], None
+        with stream:
+            for chunk in stream:
+                usage = chunk.usage or usage
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if content:
+                    tracker.first_token()
+                    parts.append(content)
+                yield content
+        _record_usage(tracker, endpoint, model, prompt_tokens, "".join(parts), usage)
+
+async def _aiter_chunks(provider, model, messages, max_tokens=None, endpoint=None, **params) -> AsyncIterator[Optional[str]]:
+    """_iter_chunks 的异步版本"""
+    endpoint = endpoint or current_endpoint()
+    messages, max_tokens, prompt_tokens = prepare_request(messages, model, max_tokens)
+    with track_call(provider, model, endpoint) as tracker:
+        stream = await get_async_openai_client(provider).chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params
+        )
+        parts, usage = [], None
+        async with stream:
+            async for chunk in stream:
+                usage = chunk.usage or usage
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if content:
+                    tracker.first_token()
+                    parts.append(content)
+                yield content
+        _record_usage(tracker, endpoint, model, prompt_tokens, "".join(parts), usage)
+
+def _abort_stream(stream):
+    """
+    从其他线程中止流式响应
+    
+    阻塞在 recv 上的线程不会因为另一个线程关闭套接字而返回，先 shutdown 套接字让读取立即报错，
+    连接由读取线程自己关闭；取不到套接字时直接关闭响应。
+    """
+    network_stream = stream.response.extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    if sock is None:
+        stream.close()
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+def _completion_attempt(provider, model, max_tokens, messages, stop=None, endpoint=None) -> Attempt:
+    """
+    构造一次可对冲的模型调用
+    
+    内部使用流式请求，以便判断模型是否仍在响应并在被取消时及时关闭连接。每个片段（包括推理过程的
+    片段）都调用 mark_alive，首个正文片段的延迟只作为指标记录。读超时不超过对冲策略的 read_timeout，
+    卡在首个片段之前的调用不会长时间占用对冲线程。
+    
+    @return: Attempt，label 为 "提供商/模型"
+    """
+    label = f"{provider}/{model}"
+    config = registry.get_config(provider)
+    timeout = httpx.Timeout(config.timeout, connect=config.connect_timeout,
+                            read=min(config.timeout, hedge_policy.read_timeout))
+    
+    def run(cancel, mark_alive):
+        parts = []
+        chunks = _iter_chunks(provider, model, messages, max_tokens, endpoint,
+                              on_stream=lambda stream: cancel.on_cancel(lambda: _abort_stream(stream)),
+                              temperature=0.7, stop=stop, timeout=timeout)
+        try:
+            for content in chunks:
+                if cancel.is_set():
+                    break
+                mark_alive()
+                if content:
+                    parts.append(content)
+        except Exception:
+            # 被取消时连接由取消方关闭，读取报错属于预期
+            if not cancel.is_set():
+                raise
+        finally:
+            chunks.close()
+        if cancel.is_set():
+            raise HedgeCancelled(f"{label} 已被取消")
+        return "".join(parts)
+    
+    async def arun(mark_alive):
+        parts = []
+        async for content in _aiter_chunks(provider, model, messages, max_tokens, endpoint,
+                                           temperature=0.7, stop=stop, timeout=timeout):
+            mark_alive()
+            if content:
+                parts.append(content)
+        return "".join(parts)
+    
+    return Attempt(label=label, fn=run, afn=arun)
+
+class DeepSeekClient(BatchCompletionMixin, BaseChatModel, BaseModel):
     """DeepSeek API 客户端"""
     
     name: str = "deepseek_chat"
@@ -54,28 +236,39 @@ class DeepSeekClient(BaseChatModel, BaseModel):
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        # 初始化 DeepSeek 客户端
-        self.client = OpenAI(
-            api_key=os.getenv("DEEPSEEK_API_KEY"),
-            # base_url="https://api.deepseek.com/v1",
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-        )
-        # 初始化通义千问客户端作为备用
-        self.dashscope_client = OpenAI(
-            api_key=os.getenv("DASHSCOPE_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-        )
+        # 从进程级注册表获取 DeepSeek 客户端（长连接复用）
+        self.client = get_openai_client("deepseek")
+        # 通义千问客户端作为备用
+        self.dashscope_client = get_openai_client("dashscope")
     
-    def get_completion(self, messages):
-        response = self.client.chat.completions.create(
-            model="deepseek-r1",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1000
-        )
-        # 打印响应
-        logger.info(f"\nOpenAI响应:\n{response.choices[0].message.content}\n")
-        return response.choices[0].message.content
+    def get_completion(self, messages, use_cache=True, refresh_cache=False):
+        """
+        获取模型回复
+        
+        @param messages: OpenAI 格式消息
+        @param use_cache: False 时绕过响应缓存
+        @param refresh_cache: True 时忽略已有缓存并重新生成
+        @return: 回复内容
+        """
+        endpoint = current_endpoint()
+        
+        def compute():
+            request_messages, max_tokens, prompt_tokens = prepare_request(messages, "deepseek-r1", 1000)
+            with track_call("deepseek", "deepseek-r1", endpoint) as tracker:
+                response = self.client.chat.completions.create(
+                    model="deepseek-r1",
+                    messages=request_messages,
+                    temperature=0.7,
+                    max_tokens=max_tokens
+                )
+                content = response.choices[0].message.content
+                _record_usage(tracker, endpoint, "deepseek-r1", prompt_tokens, content, response.usage)
+            # 打印响应
+            logger.info(f"\nOpenAI响应:\n{content}\n")
+            return content
+        
+        key = completion_cache_key(messages, "deepseek-r1", 0.7, 1000)
+        return cached_call(key, compute, use_cache, refresh_cache)
     
     def _generate(
         self,
@@ -86,65 +279,183 @@ class DeepSeekClient(BaseChatModel, BaseModel):
     ) -> ChatResult:
         """生成回复"""
         # 将消息转换为 OpenAI 格式
-        formatted_messages = []
-        for message in messages:
-            if isinstance(message, HumanMessage):
-                formatted_messages.append({"role": "user", "content": message.content})
-            elif isinstance(message, AIMessage):
-                formatted_messages.append({"role": "assistant", "content": message.content})
-            else:
-                formatted_messages.append({"role": "system", "content": message.content})
+        formatted_messages = _format_messages(messages)
         
         # 记录请求信息
         logger.debug(f"请求消息: {formatted_messages}")
+        # 对冲调用在线程池中执行，需要提前取出当前路由
+        endpoint = current_endpoint()
+        
+        winner = []
+        
+        def compute():
+            # DeepSeek 为主、通义千问为备用；主模型超过截止时间未响应时并行对冲
+            label, content = hedged_call(
+                _completion_attempt(*PRIMARY_MODEL, formatted_messages, stop, endpoint),
+                _completion_attempt(*FALLBACK_MODEL, formatted_messages, stop, endpoint),
+            )
+            winner.append(label)
+            if label != PRIMARY_LABEL:
+                record_fallback(endpoint, PRIMARY_LABEL, label)
+            logger.info(f"\n{MODEL_NAMES[label]}响应成功:\n{content}\n")
+            return content
         
-        # 首先尝试使用 DeepSeek
         try:
-            response = self.client.chat.completions.create(
-                # model="deepseek-chat",
-                model="deepseek-r1",
-                messages=formatted_messages,
-                temperature=0.7,
-                max_tokens=8000,
-                stop=stop
+            # 可通过 invoke(..., use_cache=False / refresh_cache=True) 控制缓存
+            # 只缓存主模型的回复：备用模型（降级或对冲胜出）的回复不能以主模型的键保存一整天
+            key = completion_cache_key(formatted_messages, PRIMARY_LABEL, 0.7, PRIMARY_MODEL[2], stop)
+            content = cached_call(
+                key, compute, kwargs.get("use_cache", True), kwargs.get("refresh_cache", False),
+                cacheable=lambda: winner == [PRIMARY_LABEL]
             )
+            return _chat_result(content)
             
-            content = response.choices[0].message.content
-            logger.info(f"\nDeepSeek响应成功:\n{content}\n")
-            
-            return ChatResult(generations=[
-                ChatGeneration(message=AIMessage(content=content))
-            ])
-            
-        except Exception as deepseek_error:
-            logger.warning(f"DeepSeek调用失败，切换到通义千问: {str(deepseek_error)}")
+        except Exception as e:
+            logger.error(f"DeepSeek和通义千问都失败了: {str(e)}")
+            logger.error("详细错误信息: ", exc_info=True)
             
+            # 返回一个友好的错误消息
+            return _chat_result(GENERATION_ERROR_MESSAGE)
+    
+    def stream_completion(self, messages) -> Iterator[str]:
+        """
+        流式获取模型回复
+        
+        DeepSeek 熔断中或在输出第一个片段之前失败时使用通义千问；已经开始输出后失败则直接抛出。
+        
+        @param messages: OpenAI 格式消息
+        @return: 回复片段迭代器
+        """
+        endpoint = current_endpoint()
+        breaker = get_breaker(PRIMARY_LABEL)
+        if breaker.allow_request():
+            started = finished = False
+            start = time.perf_counter()
             try:
-                # 使用通义千问作为备用
-                response = self.dashscope_client.chat.completions.create(
-                    model="qwen-turbo",
-                    messages=formatted_messages,
+                for content in _iter_chunks("deepseek", "deepseek-r1", messages, 8000, endpoint, temperature=0.7):
+                    if content:
+                        started = True
+                        yield content
+                finished = True
+                breaker.record_success(time.perf_counter() - start)
+                return
+            except Exception as deepseek_error:
+                finished = True
+                breaker.record_failure(time.perf_counter() - start)
+                if started:
+                    raise
+                logger.warning(f"DeepSeek流式调用失败，切换到通义千问: {str(deepseek_error)}")
+            finally:
+                # 调用方提前关闭生成器时没有结果可记录，只归还探测名额
+                if not finished:
+                    breaker.release()
+        else:
+            logger.info("DeepSeek熔断中，直接使用通义千问")
+        
+        record_fallback(endpoint, PRIMARY_LABEL, "dashscope/qwen-turbo")
+        for content in _iter_chunks("dashscope", "qwen-turbo", messages, 4000, endpoint, temperature=0.7):
+            if content:
+                yield content
+    
+    async def aget_completion(self, messages, use_cache=True, refresh_cache=False):
+        """异步获取模型回复，参数同 get_completion"""
+        endpoint = current_endpoint()
+        
+        async def compute():
+            request_messages, max_tokens, prompt_tokens = prepare_request(messages, "deepseek-r1", 1000)
+            with track_call("deepseek", "deepseek-r1", endpoint) as tracker:
+                response = await get_async_openai_client("deepseek").chat.completions.create(
+                    model="deepseek-r1",
+                    messages=request_messages,
                     temperature=0.7,
-                    max_tokens=4000,
-                    stop=stop
+                    max_tokens=max_tokens
                 )
-                
                 content = response.choices[0].message.content
-                logger.info(f"\n通义千问响应成功:\n{content}\n")
-                
-                return ChatResult(generations=[
-                    ChatGeneration(message=AIMessage(content=content))
-                ])
-                
-            except Exception as qwen_error:
-                logger.error(f"通义千问也失败了: {str(qwen_error)}")
-                logger.error("详细错误信息: ", exc_info=True)
-                
-                # 返回一个友好的错误消息
-                error_message = "很抱歉，生成旅行计划时遇到了问题。请稍后重试。"
-                return ChatResult(generations=[
-                    ChatGeneration(message=AIMessage(content=error_message))
-                ])
+                _record_usage(tracker, endpoint, "deepseek-r1", prompt_tokens, content, response.usage)
+            logger.info(f"\nOpenAI响应:\n{content}\n")
+            return content
+        
+        key = completion_cache_key(messages, "deepseek-r1", 0.7, 1000)
+        return await acached_call(key, compute, use_cache, refresh_cache)
+    
+    async def astream_completion(self, messages) -> AsyncIterator[str]:
+        """
+        异步流式获取模型回复
+        
+        DeepSeek 熔断中或在输出第一个片段之前失败时使用通义千问；已经开始输出后失败则直接抛出。
+        
+        @param messages: OpenAI 格式消息
+        @return: 回复片段的异步迭代器
+        """
+        endpoint = current_endpoint()
+        breaker = get_breaker(PRIMARY_LABEL)
+        if breaker.allow_request():
+            started = finished = False
+            start = time.perf_counter()
+            try:
+                async for content in _aiter_chunks("deepseek", "deepseek-r1", messages, 8000, endpoint,
+                                                   temperature=0.7):
+                    if content:
+                        started = True
+                        yield content
+                finished = True
+                breaker.record_success(time.perf_counter() - start)
+                return
+            except Exception as deepseek_error:
+                finished = True
+                breaker.record_failure(time.perf_counter() - start)
+                if started:
+                    raise
+                logger.warning(f"DeepSeek流式调用失败，切换到通义千问: {str(deepseek_error)}")
+            finally:
+                if not finished:
+                    breaker.release()
+        else:
+            logger.info("DeepSeek熔断中，直接使用通义千问")
+        
+        record_fallback(endpoint, PRIMARY_LABEL, "dashscope/qwen-turbo")
+        async for content in _aiter_chunks("dashscope", "qwen-turbo", messages, 4000, endpoint,
+                                           temperature=0.7):
+            if content:
+                yield content
+    
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """异步生成回复（与 _generate 相同的对冲和回退逻辑）"""
+        formatted_messages = _format_messages(messages)
+        logger.debug(f"请求消息: {formatted_messages}")
+        endpoint = current_endpoint()
+        
+        winner = []
+        
+        async def compute():
+            label, content = await ahedged_call(
+                _completion_attempt(*PRIMARY_MODEL, formatted_messages, stop, endpoint),
+                _completion_attempt(*FALLBACK_MODEL, formatted_messages, stop, endpoint),
+            )
+            winner.append(label)
+            if label != PRIMARY_LABEL:
+                record_fallback(endpoint, PRIMARY_LABEL, label)
+            logger.info(f"\n{MODEL_NAMES[label]}响应成功:\n{content}\n")
+            return content
+        
+        try:
+            key = completion_cache_key(formatted_messages, PRIMARY_LABEL, 0.7, PRIMARY_MODEL[2], stop)
+            content = await acached_call(
+                key, compute, kwargs.get("use_cache", True), kwargs.get("refresh_cache", False),
+                cacheable=lambda: winner == [PRIMARY_LABEL]
+            )
+            return _chat_result(content)
+            
+        except Exception as e:
+            logger.error(f"DeepSeek和通义千问都失败了: {str(e)}")
+            logger.error("详细错误信息: ", exc_info=True)
+            return _chat_result(GENERATION_ERROR_MESSAGE)
     
     @property
     def _llm_type(self) -> str:
@@ -158,33 +469,63 @@ class DashScopeClient(BaseLLMClient):
     """DashScope API客户端"""
     
     def __init__(self):
-        self.client = OpenAI(
-            api_key=os.getenv("DASHSCOPE_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-        )
+        self.client = get_openai_client("dashscope")
         
-    def get_completion(self, messages):
-        completion = self.client.chat.completions.create(
-            model="qwen-omni-turbo",
-            messages=messages,
-            modalities=["text"],
-            stream=True
-        )
+    def stream_completion(self, messages) -> Iterator[str]:
+        """
+        流式获取模型回复，片段到达即返回
         
-        full_response = ""
-        for chunk in completion:
-            if hasattr(chunk.choices[0].delta, 'content'):
-                content = chunk.choices[0].delta.content
-                if content:
-                    full_response += content
-                    logger.debug(f"收到响应片段: {content}")
+        @param messages: OpenAI 格式消息
+        @return: 回复片段迭代器
+        """
+        for content in _iter_chunks("dashscope", "qwen-omni-turbo", messages, modalities=["text"]):
+            if content:
+                logger.debug(f"收到响应片段: {content}")
+                yield content
+        
+    def get_completion(self, messages, use_cache=True, refresh_cache=False):
+        def compute():
+            full_response = "".join(self.stream_completion(messages))
+            
+            # 打印完整响应
+            logger.info(f"\nDashScope响应:\n{full_response}\n")
+            return full_response
+        
+        key = completion_cache_key(messages, "qwen-omni-turbo", None, None)
+        return cached_call(key, compute, use_cache, refresh_cache)
+    
+    async def astream_completion(self, messages) -> AsyncIterator[str]:
+        """
+        异步流式获取模型回复
+        
+        @param messages: OpenAI 格式消息
+        @return: 回复片段的异步迭代器
+        """
+        async for content in _aiter_chunks("dashscope", "qwen-omni-turbo", messages, modalities=["text"]):
+            if content:
+                logger.debug(f"收到响应片段: {content}")
+                yield content
+    
+    async def aget_completion(self, messages, use_cache=True, refresh_cache=False):
+        """异步获取模型回复"""
+        async def compute():
+            full_response = "".join([piece async for piece in self.astream_completion(messages)])
+            logger.info(f"\nDashScope响应:\n{full_response}\n")
+            return full_response
         
-        # 打印完整响应
-        logger.info(f"\nDashScope响应:\n{full_response}\n")
-        return full_response
+        key = completion_cache_key(messages, "qwen-omni-turbo", None, None)
+        return await acached_call(key, compute, use_cache, refresh_cache)
+
+# 已创建的客户端实例，同一进程内按提供商复用
+_client_instances: Dict[str, Any] = {}
+_client_instances_lock = threading.Lock()
 
 def create_llm_client(provider="deepseek"):
-    """LLM客户端工厂函数"""
+    """LLM客户端工厂函数（同一进程内按提供商返回共享实例）"""
+    cached = _client_instances.get(provider.lower())
+    if cached is not None:
+        return cached
+    
     try:
         # 打印环境变量检查
         logger.info("检查环境变量:")
@@ -206,8 +547,12 @@ def create_llm_client(provider="deepseek"):
             logger.error(f"不支持的模型提供商: {provider}")
             raise ValueError(f"不支持的模型提供商: {provider}")
             
-        client = client_class()
-        logger.info(f"成功创建客户端: {client.__class__.__name__}")
+        with _client_instances_lock:
+            client = _client_instances.get(provider.lower())
+            if client is None:
+                client = client_class()
+                _client_instances[provider.lower()] = client
+                logger.info(f"成功创建客户端: {client.__class__.__name__}")
         return client
         
     except Exception as e:
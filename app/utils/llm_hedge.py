@@ -0,0 +1,484 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+
+from .llm_pool import env_int, env_float
+from .llm_breaker import get_breaker
+from .llm_metrics import HEDGE_OUTCOMES
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class HedgeCancelled(Exception):
+    """对冲请求中落败的一方被取消"""
+
+
+class CancelToken:
+    """
+    同步调用的取消标记
+
+    与 threading.Event 一样通过 is_set() 检查；调用方还可以用 on_cancel 注册回调（如关闭进行中的
+    流式响应），取消方调用 set() 时立即执行，卡在读取上的线程因此不必等到下一个片段或超时。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def set(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug(f"执行取消回调失败: {str(e)}")
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """注册取消回调，已取消时立即执行"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+
+class LatencyTracker:
+    """滑动窗口内的延迟统计"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """
+        计算窗口内延迟的百分位数
+
+        @param pct: 百分位 (0-100)
+        @return: 延迟秒数，没有样本时返回 None
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, math.ceil(pct / 100 * len(samples)) - 1))
+        return samples[index]
+
+
+@dataclass
+class HedgePolicy:
+    """
+    对冲策略：主模型开始执行后超过截止时间仍未返回任何片段时启动备用模型
+
+    截止时间取主模型首个片段延迟的滑动分位数。推理模型在正文之前会先输出很长的推理过程，
+    任何片段（包括推理片段）都说明主模型仍在工作，因此统计的是首个片段而不是首个正文片段。
+    """
+    enabled: bool = True
+    default_delay: float = 10.0
+    percentile: float = 95.0
+    min_delay: float = 1.0
+    max_delay: float = 30.0
+    min_samples: int = 20
+    # 对冲调用的读超时：主模型卡在首个片段之前时，落败方的线程最迟在这个时间后释放
+    read_timeout: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> "HedgePolicy":
+        return cls(
+            enabled=os.getenv("LLM_HEDGE_ENABLED", "true").lower() not in ("0", "false", "no"),
+            default_delay=env_float("LLM_HEDGE_DELAY", cls.default_delay),
+            percentile=env_float("LLM_HEDGE_PERCENTILE", cls.percentile),
+            min_delay=env_float("LLM_HEDGE_MIN_DELAY", cls.min_delay),
+            max_delay=env_float("LLM_HEDGE_MAX_DELAY", cls.max_delay),
+            min_samples=env_int("LLM_HEDGE_MIN_SAMPLES", cls.min_samples),
+            read_timeout=env_float("LLM_HEDGE_READ_TIMEOUT", env_float("LLM_HEDGE_MAX_DELAY", cls.max_delay)),
+        )
+
+    def deadline(self, tracker: LatencyTracker) -> Optional[float]:
+        """
+        根据主模型的历史首个片段延迟计算对冲截止时间
+
+        @param tracker: 主模型的首个片段延迟统计
+        @return: 截止秒数，未启用对冲时返回 None
+        """
+        if not self.enabled:
+            return None
+        if len(tracker) < self.min_samples:
+            return self.default_delay
+        return min(self.max_delay, max(self.min_delay, tracker.percentile(self.percentile)))
+
+
+@dataclass
+class Attempt:
+    """
+    一次模型调用
+
+    fn(cancel, mark_alive) 同步执行并返回完整回复；cancel 为 CancelToken，需要在收到每个片段后
+    检查 cancel.is_set()，并通过 cancel.on_cancel 注册关闭连接的回调；每收到一个片段（包括没有正文的
+    推理片段）调用 mark_alive()，只有第一次生效。
+    afn(mark_alive) 为对应的异步版本，取消通过 Task.cancel() 完成。
+    """
+    label: str
+    fn: Optional[Callable[[CancelToken, Callable[[], None]], str]] = None
+    afn: Optional[Callable[[Callable[[], None]], Awaitable[str]]] = None
+
+
+class HedgeStats:
+    """对冲结果计数"""
+
+    OUTCOMES = (
+        "primary_won", "fallback_won", "primary_failed", "primary_skipped",
+        "both_failed", "hedged", "cancelled",
+    )
+
+    def __init__(self):
+        self._counts = {outcome: 0 for outcome in self.OUTCOMES}
+        self._lock = threading.Lock()
+
+    def record(self, outcome: str):
+        with self._lock:
+            self._counts[outcome] += 1
+        HEDGE_OUTCOMES.labels(outcome).inc()
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+policy = HedgePolicy.from_env()
+hedge_stats = HedgeStats()
+_first_response_trackers: Dict[str, LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+_executor = ThreadPoolExecutor(
+    max_workers=env_int("LLM_HEDGE_WORKERS", 32),
+    thread_name_prefix="llm-hedge"
+)
+
+
+def get_tracker(label: str) -> LatencyTracker:
+    """获取（必要时创建）模型的首个片段延迟统计"""
+    with _trackers_lock:
+        tracker = _first_response_trackers.get(label)
+        if tracker is None:
+            tracker = _first_response_trackers[label] = LatencyTracker()
+        return tracker
+
+
+class _AliveMarker:
+    """
+    只生效一次的存活回调，记录从调用开始执行到收到第一个片段的延迟
+
+    alive、started 为 threading.Event 或 asyncio.Event，分别在收到第一个片段和调用开始执行时置位。
+    """
+
+    def __init__(self, label: str, alive=None, started=None):
+        self.label = label
+        self.start = time.perf_counter()
+        self._alive = alive
+        self._started = started
+        self._fired = False
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """调用开始执行（离开线程池队列）时调用，延迟从此刻算起"""
+        self.start = time.perf_counter()
+        if self._started is not None:
+            self._started.set()
+
+    def remaining(self, delay: Optional[float]) -> Optional[float]:
+        """距离截止时间还剩的秒数，delay 为 None 时返回 None（不设截止时间）"""
+        if delay is None:
+            return None
+        return max(0.0, delay - (time.perf_counter() - self.start))
+
+    def _record(self) -> bool:
+        with self._lock:
+            if self._fired:
+                return False
+            self._fired = True
+        get_tracker(self.label).record(time.perf_counter() - self.start)
+        return True
+
+    def __call__(self):
+        if self._record() and self._alive is not None:
+            self._alive.set()
+
+    def censor(self):
+        """
+        调用在收到第一个片段前被取消时调用
+
+        真实延迟不小于已等待的时间，以它作为样本；丢弃这类调用会让分位数只从快的调用中学习而偏低。
+        """
+        self._record()
+
+
+def _run(attempt: Attempt, cancel: CancelToken, marker: _AliveMarker) -> str:
+    marker.begin()
+    return attempt.fn(cancel, marker)
+
+
+async def _arun(attempt: Attempt, marker: _AliveMarker) -> str:
+    marker.begin()
+    return await attempt.afn(marker)
+
+
+def _guarded(attempt: Attempt) -> Attempt:
+    """包装调用，把结果和耗时记录到对应模型的熔断器；被取消的调用只归还探测名额"""
+    breaker = get_breaker(attempt.label)
+
+    def fn(cancel, mark_alive):
+        start = time.perf_counter()
+        try:
+            content = attempt.fn(cancel, mark_alive)
+        except HedgeCancelled:
+            breaker.release()
+            raise
+        except Exception:
+            breaker.record_failure(time.perf_counter() - start)
+            raise
+        breaker.record_success(time.perf_counter() - start)
+        return content
+
+    async def afn(mark_alive):
+        start = time.perf_counter()
+        try:
+            content = await attempt.afn(mark_alive)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception:
+            breaker.record_failure(time.perf_counter() - start)
+            raise
+        breaker.record_success(time.perf_counter() - start)
+        return content
+
+    return Attempt(label=attempt.label, fn=fn, afn=afn)
+
+
+def _should_hedge(fallback: Attempt) -> bool:
+    """备用模型熔断中时不再并行对冲，避免给故障的备用模型增加压力"""
+    return get_breaker(fallback.label).allow_request()
+
+
+def hedged_call(primary: Attempt, fallback: Attempt) -> Tuple[str, str]:
+    """
+    带对冲和熔断的同步调用
+
+    主模型熔断中时直接使用备用模型；主模型开始执行后在截止时间内没有返回任何片段时并行启动备用模型，
+    采用先完成的结果并取消另一方；主模型直接失败时立即切换到备用模型。
+    两者都失败时抛出最后一个异常。
+
+    @param primary: 主模型调用
+    @param fallback: 备用模型调用
+    @return: (获胜方 label, 回复内容)
+    """
+    primary, fallback = _guarded(primary), _guarded(fallback)
+    if not get_breaker(primary.label).allow_request():
+        hedge_stats.record("primary_skipped")
+        logger.info(f"{primary.label} 熔断中，直接使用 {fallback.label}")
+        return _fallback_only(fallback)
+
+    delay = policy.deadline(get_tracker(primary.label))
+    start = time.perf_counter()
+    primary_started, primary_alive = threading.Event(), threading.Event()
+    primary_cancel = CancelToken()
+    primary_marker = _AliveMarker(primary.label, primary_alive, primary_started)
+    primary_future = _executor.submit(_run, primary, primary_cancel, primary_marker)
+    # 主模型完成（无论成败）也视为有响应
+    primary_future.add_done_callback(lambda _: primary_alive.set())
+
+    # 截止时间从主模型开始执行时算起，在线程池中排队的时间不触发对冲
+    primary_started.wait()
+    responded = primary_alive.wait(primary_marker.remaining(delay))
+    if not responded and not _should_hedge(fallback):
+        logger.warning(f"{primary.label} 超过 {delay:.1f}s 未响应，{fallback.label} 熔断中，继续等待主模型")
+        responded = primary_alive.wait()
+
+    if responded:
+        try:
+            content = primary_future.result()
+            hedge_stats.record("primary_won")
+            return primary.label, content
+        except Exception as primary_error:
+            hedge_stats.record("primary_failed")
+            logger.warning(f"{primary.label} 调用失败，切换到 {fallback.label}: {str(primary_error)}")
+        return _fallback_only(fallback)
+
+    # 超过截止时间仍无响应，并行启动备用模型
+    hedge_stats.record("hedged")
+    logger.warning(f"{primary.label} 超过 {delay:.1f}s 未响应，并行启动 {fallback.label}")
+    fallback_cancel = CancelToken()
+    fallback_future = _executor.submit(_run, fallback, fallback_cancel, _AliveMarker(fallback.label))
+    contenders = {
+        primary_future: (primary, primary_cancel, "primary_won"),
+        fallback_future: (fallback, fallback_cancel, "fallback_won"),
+    }
+    pending = set(contenders)
+    last_error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            attempt, _, outcome = contenders[future]
+            try:
+                content = future.result()
+            except Exception as e:
+                last_error = e
+                logger.warning(f"{attempt.label} 对冲调用失败: {str(e)}")
+                continue
+            # 取消落败的一方：关闭其连接，阻塞在读取上的线程随即退出
+            for loser in pending:
+                if loser is primary_future:
+                    primary_marker.censor()
+                contenders[loser][1].set()
+                hedge_stats.record("cancelled")
+            hedge_stats.record(outcome)
+            logger.info(f"对冲请求由 {attempt.label} 胜出，耗时 {time.perf_counter() - start:.2f}s")
+            return attempt.label, content
+
+    hedge_stats.record("both_failed")
+    raise last_error
+
+
+def _fallback_only(fallback: Attempt) -> Tuple[str, str]:
+    """只调用备用模型"""
+    try:
+        content = _run(fallback, CancelToken(), _AliveMarker(fallback.label))
+    except Exception:
+        hedge_stats.record("both_failed")
+        raise
+    hedge_stats.record("fallback_won")
+    return fallback.label, content
+
+
+async def _afallback_only(fallback: Attempt) -> Tuple[str, str]:
+    """只调用备用模型（异步）"""
+    try:
+        content = await _arun(fallback, _AliveMarker(fallback.label))
+    except Exception:
+        hedge_stats.record("both_failed")
+        raise
+    hedge_stats.record("fallback_won")
+    return fallback.label, content
+
+
+async def ahedged_call(primary: Attempt, fallback: Attempt) -> Tuple[str, str]:
+    """
+    带对冲和熔断的异步调用，语义与 hedged_call 相同，落败方通过 Task.cancel() 立即取消
+
+    @param primary: 主模型调用
+    @param fallback: 备用模型调用
+    @return: (获胜方 label, 回复内容)
+    """
+    primary, fallback = _guarded(primary), _guarded(fallback)
+    if not get_breaker(primary.label).allow_request():
+        hedge_stats.record("primary_skipped")
+        logger.info(f"{primary.label} 熔断中，直接使用 {fallback.label}")
+        return await _afallback_only(fallback)
+
+    delay = policy.deadline(get_tracker(primary.label))
+    start = time.perf_counter()
+    primary_started, primary_alive = asyncio.Event(), asyncio.Event()
+    primary_marker = _AliveMarker(primary.label, primary_alive, primary_started)
+    primary_task = asyncio.ensure_future(_arun(primary, primary_marker))
+    primary_task.add_done_callback(lambda _: primary_alive.set())
+    tasks = [primary_task]
+
+    try:
+        try:
+            await primary_started.wait()
+            await asyncio.wait_for(primary_alive.wait(), primary_marker.remaining(delay))
+            responded = True
+        except asyncio.TimeoutError:
+            responded = False
+        if not responded and not _should_hedge(fallback):
+            logger.warning(f"{primary.label} 超过 {delay:.1f}s 未响应，{fallback.label} 熔断中，继续等待主模型")
+            await primary_alive.wait()
+            responded = True
+
+        if responded:
+            try:
+                content = await primary_task
+                hedge_stats.record("primary_won")
+                return primary.label, content
+            except asyncio.CancelledError:
+                raise
+            except Exception as primary_error:
+                hedge_stats.record("primary_failed")
+                logger.warning(f"{primary.label} 调用失败，切换到 {fallback.label}: {str(primary_error)}")
+            return await _afallback_only(fallback)
+
+        hedge_stats.record("hedged")
+        logger.warning(f"{primary.label} 超过 {delay:.1f}s 未响应，并行启动 {fallback.label}")
+        fallback_task = asyncio.ensure_future(_arun(fallback, _AliveMarker(fallback.label)))
+        tasks.append(fallback_task)
+        contenders = {
+            primary_task: (primary, "primary_won"),
+            fallback_task: (fallback, "fallback_won"),
+        }
+        pending = set(contenders)
+        last_error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                attempt, outcome = contenders[task]
+                try:
+                    content = task.result()
+                except Exception as e:
+                    last_error = e
+                    logger.warning(f"{attempt.label} 对冲调用失败: {str(e)}")
+                    continue
+                hedge_stats.record(outcome)
+                logger.info(f"对冲请求由 {attempt.label} 胜出，耗时 {time.perf_counter() - start:.2f}s")
+                return attempt.label, content
+
+        hedge_stats.record("both_failed")
+        raise last_error
+    finally:
+        # 取消落败的一方；调用方被取消时（如客户端断开）本次创建的任务也一并取消，不留无人等待的请求
+        for task in tasks:
+            if not task.done():
+                # 已对冲时主模型至少等待了截止时间，作为截尾样本记录
+                if task is primary_task and len(tasks) > 1:
+                    primary_marker.censor()
+                task.cancel()
+                hedge_stats.record("cancelled")
+
+
+def hedge_snapshot() -> Dict[str, Any]:
+    """对冲统计快照：各结果计数和各模型的首个片段延迟分位数"""
+    with _trackers_lock:
+        trackers = dict(_first_response_trackers)
+    return {
+        "outcomes": hedge_stats.snapshot(),
+        "first_response_latency": {
+            label: {
+                "samples": len(tracker),
+                "p50": tracker.percentile(50),
+                "p95": tracker.percentile(95),
+                "hedge_deadline": policy.deadline(tracker),
+            }
+            for label, tracker in trackers.items()
+        },
+    }
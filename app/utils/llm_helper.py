@@ -1,4 +1,5 @@
 import logging
+import time
 from .llm_clients import create_llm_client
 from .test_helper import get_test_questions  # 导入测试生成函数
 
@@ -18,10 +19,7 @@ def get_chat_response(question, provider="openai"):
         client = create_llm_client(provider)
         
         # 构建消息
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": question}
-        ]
+        messages = _build_chat_messages(question)
         
         # 获取回答
         response = client.get_completion(messages)
@@ -33,5 +31,41 @@ def get_chat_response(question, provider="openai"):
         logger.error(f"调用 {provider} 失败: {str(e)}")
         raise
 
+def stream_chat_response(question, provider="openai"):
+    """
+    流式获取AI回答，模型返回的片段到达即转发
+    
+    @param question: 用户问题
+    @param provider: 模型提供商
+    @return: 回答片段迭代器
+    """
+    # 在生成器外创建客户端，不支持的提供商在开始响应前就报错
+    client = create_llm_client(provider)
+    messages = _build_chat_messages(question)
+    
+    def generate():
+        start = time.perf_counter()
+        first_token_at = None
+        try:
+            for delta in client.stream_completion(messages):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    logger.info(f"{provider} 首字延迟: {(first_token_at - start) * 1000:.0f}ms")
+                yield delta
+        except Exception as e:
+            logger.error(f"流式调用 {provider} 失败: {str(e)}")
+            raise
+        finally:
+            logger.info(f"{provider} 流式响应结束, 总耗时: {(time.perf_counter() - start) * 1000:.0f}ms")
+    
+    return generate()
+
+def _build_chat_messages(question):
+    """构建聊天消息"""
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": question}
+    ]
+
 # 导出测试生成函数
-__all__ = ['get_chat_response', 'get_test_questions'] 
\ No newline at end of file
+__all__ = ['get_chat_response', 'stream_chat_response', 'get_test_questions'] 
\ No newline at end of file
@@ -0,0 +1,111 @@
+from typing import Optional, Tuple
+import asyncio
+import logging
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# gunicorn 多 worker 部署时设置该目录（见 gunicorn.conf.py），各 worker 的指标写入其中并在导出时汇总
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+_LABELS = ("provider", "model", "route")
+
+REQUEST_LATENCY = Histogram(
+    "llm_request_duration_seconds", "LLM 调用总耗时", _LABELS,
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 90, 120, 180),
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "LLM 流式调用首个正文片段的延迟", _LABELS,
+    buckets=(0.25, 0.5, 1, 2, 3, 5, 10, 20, 30, 60),
+)
+REQUESTS = Counter("llm_requests_total", "LLM 调用次数", _LABELS + ("outcome",))
+ERRORS = Counter("llm_errors_total", "LLM 调用失败次数", _LABELS + ("error_class",))
+PROMPT_TOKENS = Counter("llm_prompt_tokens_total", "提示词 token 数", _LABELS)
+COMPLETION_TOKENS = Counter("llm_completion_tokens_total", "回复 token 数", _LABELS)
+FALLBACKS = Counter("llm_fallbacks_total", "切换到备用模型的次数", ("route", "primary", "fallback"))
+HEDGE_OUTCOMES = Counter("llm_hedge_outcomes_total", "对冲调用结果", ("outcome",))
+EMBEDDING_TEXTS = Counter("embedding_texts_total", "向量化文本数，outcome 为 cached（缓存命中）或 embedded", ("model", "kind", "outcome"))
+EMBEDDING_CALLS = Counter("embedding_calls_total", "向量化接口调用次数", ("model", "kind", "outcome"))
+EMBEDDING_LATENCY = Histogram(
+    "embedding_call_duration_seconds", "向量化接口单次调用耗时", ("model", "kind"),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+
+
+class CallTracker:
+    """
+    记录一次模型调用的耗时、首字延迟和结果
+
+    用作上下文管理器：正常退出记为 success，流式调用被提前关闭（如对冲落败）记为 cancelled，
+    其余异常记为 error 并按异常类名计数。
+    """
+
+    def __init__(self, provider: str, model: str, route: str):
+        self.labels = (provider, model, route)
+        self._start = 0.0
+        self._first_token_seen = False
+
+    def __enter__(self) -> "CallTracker":
+        self._start = time.perf_counter()
+        return self
+
+    def first_token(self):
+        """收到第一个正文片段时调用，重复调用只记录一次"""
+        if not self._first_token_seen:
+            self._first_token_seen = True
+            TIME_TO_FIRST_TOKEN.labels(*self.labels).observe(time.perf_counter() - self._start)
+
+    def tokens(self, prompt_tokens: int, completion_tokens: int):
+        PROMPT_TOKENS.labels(*self.labels).inc(prompt_tokens)
+        COMPLETION_TOKENS.labels(*self.labels).inc(completion_tokens)
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is None:
+            outcome = "success"
+        elif issubclass(exc_type, (GeneratorExit, asyncio.CancelledError)):
+            outcome = "cancelled"
+        else:
+            outcome = "error"
+            ERRORS.labels(*self.labels, exc_type.__name__).inc()
+        REQUESTS.labels(*self.labels, outcome).inc()
+        if outcome != "cancelled":
+            REQUEST_LATENCY.labels(*self.labels).observe(time.perf_counter() - self._start)
+        return False
+
+
+def track_call(provider: str, model: str, route: str) -> CallTracker:
+    """
+    记录一次模型调用
+
+    @param provider: 提供商
+    @param model: 模型名称
+    @param route: 调用路由，见 llm_tokens.current_endpoint()
+    @return: CallTracker
+    """
+    return CallTracker(provider, model, route)
+
+
+def record_fallback(route: str, primary: str, fallback: str):
+    """记录一次从主模型切换到备用模型"""
+    FALLBACKS.labels(route, primary, fallback).inc()
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    导出 Prometheus 文本格式的指标
+
+    设置了 PROMETHEUS_MULTIPROC_DIR 时汇总所有 worker 的数据，否则只导出当前进程。
+
+    @return: (内容, Content-Type)
+    """
+    registry: Optional[CollectorRegistry] = REGISTRY
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
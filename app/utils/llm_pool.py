@@ -0,0 +1,291 @@
+from dataclasses import dataclass, replace
+from typing import Dict, List, Tuple
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import weakref
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from dotenv import load_dotenv
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 加载环境变量
+load_dotenv()
+
+DASHSCOPE_COMPATIBLE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+
+def env_int(name: str, default: int) -> int:
+    """读取整数环境变量，非法值时回退到默认值"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        logger.warning(f"环境变量 {name} 不是合法整数，使用默认值 {default}")
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """读取浮点环境变量，非法值时回退到默认值"""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        logger.warning(f"环境变量 {name} 不是合法数字，使用默认值 {default}")
+        return default
+
+
+@dataclass(frozen=True)
+class ProviderConfig:
+    """单个模型提供商的连接配置"""
+    name: str
+    api_key_env: str
+    base_url: str
+    max_connections: int = 50
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 60.0
+    timeout: float = 120.0
+    connect_timeout: float = 10.0
+    max_retries: int = 2
+
+    @classmethod
+    def from_env(cls, name: str, api_key_env: str, base_url: str, **defaults) -> "ProviderConfig":
+        """
+        从环境变量读取提供商配置，变量名以提供商名称大写为前缀
+
+        例如 DEEPSEEK_MAX_CONNECTIONS、DASHSCOPE_TIMEOUT
+
+        @param name: 提供商名称
+        @param api_key_env: API Key 所在的环境变量名
+        @param base_url: 默认接口地址
+        @return: ProviderConfig
+        """
+        prefix = name.upper()
+        config = cls(name=name, api_key_env=api_key_env, base_url=base_url, **defaults)
+        return replace(
+            config,
+            base_url=os.getenv(f"{prefix}_BASE_URL", config.base_url),
+            max_connections=env_int(f"{prefix}_MAX_CONNECTIONS", config.max_connections),
+            max_keepalive_connections=env_int(f"{prefix}_MAX_KEEPALIVE", config.max_keepalive_connections),
+            keepalive_expiry=env_float(f"{prefix}_KEEPALIVE_EXPIRY", config.keepalive_expiry),
+            timeout=env_float(f"{prefix}_TIMEOUT", config.timeout),
+            connect_timeout=env_float(f"{prefix}_CONNECT_TIMEOUT", config.connect_timeout),
+            max_retries=env_int(f"{prefix}_MAX_RETRIES", config.max_retries),
+        )
+
+    @property
+    def api_key(self) -> str:
+        return os.getenv(self.api_key_env)
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    @property
+    def http_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+
+# 各提供商默认配置（DeepSeek 目前也走通义千问的兼容接口）
+PROVIDER_CONFIGS: Dict[str, ProviderConfig] = {
+    "deepseek": ProviderConfig.from_env("deepseek", "DEEPSEEK_API_KEY", DASHSCOPE_COMPATIBLE_URL),
+    "dashscope": ProviderConfig.from_env("dashscope", "DASHSCOPE_API_KEY", DASHSCOPE_COMPATIBLE_URL),
+}
+
+
+class LLMClientRegistry:
+    """
+    进程级 OpenAI 兼容客户端注册表
+
+    按 (提供商, base_url) 缓存长连接客户端，同一个 gunicorn worker 内的
+    所有路由共享同一组 httpx 连接池，避免每个请求重复握手和建池。
+    异步客户端的连接池绑定在事件循环上，因此额外按事件循环区分。
+    修改配置后被替换的客户端可能仍有进行中的请求，不立即关闭：同步客户端在 close() 时关闭，
+    异步客户端在所属事件循环的 aclose() 时关闭。
+    """
+
+    def __init__(self, configs: Dict[str, ProviderConfig] = None):
+        self._configs = dict(configs or PROVIDER_CONFIGS)
+        self._clients: Dict[Tuple[str, str], OpenAI] = {}
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._retired: List[OpenAI] = []
+        self._retired_async = weakref.WeakKeyDictionary()  # 事件循环 -> 被替换的异步客户端
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _reset_after_fork(self):
+        """gunicorn --preload 时 worker 由 master fork 而来，连接池不能跨进程复用"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._clients = {}
+                self._async_clients = weakref.WeakKeyDictionary()
+                self._retired = []
+                self._retired_async = weakref.WeakKeyDictionary()
+                self._lock = threading.Lock()
+                self._pid = os.getpid()
+
+    def get_config(self, provider: str) -> ProviderConfig:
+        """
+        获取提供商配置
+
+        @param provider: 提供商名称
+        @return: ProviderConfig
+        """
+        config = self._configs.get(provider.lower())
+        if not config:
+            raise ValueError(f"不支持的模型提供商: {provider}")
+        return config
+
+    def configure(self, provider: str, **overrides) -> ProviderConfig:
+        """
+        修改提供商配置（连接数、超时等），之后获取的客户端使用新配置
+
+        旧客户端从缓存中移除但不关闭，已经拿到它的请求可以正常完成。
+
+        @param provider: 提供商名称
+        @return: 新的配置
+        """
+        config = replace(self.get_config(provider), **overrides)
+        with self._lock:
+            self._configs[config.name] = config
+            for key in [key for key in self._clients if key[0] == config.name]:
+                self._retired.append(self._clients.pop(key))
+            for loop, per_loop in list(self._async_clients.items()):
+                stale = [per_loop.pop(key) for key in [key for key in per_loop if key[0] == config.name]]
+                if stale:
+                    self._retired_async.setdefault(loop, []).extend(stale)
+        return config
+
+    def get_client(self, provider: str) -> OpenAI:
+        """
+        获取（必要时创建）提供商对应的同步客户端
+
+        @param provider: 提供商名称
+        @return: OpenAI 客户端
+        """
+        self._reset_after_fork()
+        config = self.get_config(provider)
+        key = (config.name, config.base_url)
+
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = OpenAI(
+                    api_key=config.api_key,
+                    base_url=config.base_url,
+                    timeout=config.http_timeout,
+                    max_retries=config.max_retries,
+                    http_client=DefaultHttpxClient(
+                        limits=config.limits,
+                        timeout=config.http_timeout,
+                    ),
+                )
+                self._clients[key] = client
+                logger.info(
+                    f"创建 {config.name} 连接池: {config.base_url} "
+                    f"(max_connections={config.max_connections}, timeout={config.timeout}s)"
+                )
+        return client
+
+    def get_async_client(self, provider: str) -> AsyncOpenAI:
+        """
+        获取（必要时创建）当前事件循环下提供商对应的异步客户端
+
+        必须在运行中的事件循环内调用。
+
+        @param provider: 提供商名称
+        @return: AsyncOpenAI 客户端
+        """
+        self._reset_after_fork()
+        config = self.get_config(provider)
+        key = (config.name, config.base_url)
+        loop = asyncio.get_running_loop()
+
+        with self._lock:
+            per_loop = self._async_clients.setdefault(loop, {})
+            client = per_loop.get(key)
+            if client is None:
+                client = AsyncOpenAI(
+                    api_key=config.api_key,
+                    base_url=config.base_url,
+                    timeout=config.http_timeout,
+                    max_retries=config.max_retries,
+                    http_client=DefaultAsyncHttpxClient(
+                        limits=config.limits,
+                        timeout=config.http_timeout,
+                    ),
+                )
+                per_loop[key] = client
+                logger.info(f"创建 {config.name} 异步连接池: {config.base_url}")
+        return client
+
+    async def aclose(self):
+        """关闭当前事件循环下的所有异步连接池（包括修改配置后被替换的）"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = list(self._async_clients.pop(loop, {}).values()) + self._retired_async.pop(loop, [])
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning(f"关闭异步LLM客户端失败: {str(e)}")
+
+    def stats(self) -> Dict[str, Dict]:
+        """返回当前进程中已创建的客户端及其配置"""
+        return {
+            f"{name}@{base_url}": {
+                "max_connections": self._configs[name].max_connections,
+                "max_keepalive_connections": self._configs[name].max_keepalive_connections,
+                "timeout": self._configs[name].timeout,
+            }
+            for name, base_url in list(self._clients)
+        }
+
+    def close(self):
+        """关闭所有同步连接池（包括修改配置后被替换的）"""
+        with self._lock:
+            for client in list(self._clients.values()) + self._retired:
+                try:
+                    client.close()
+                except Exception as e:
+                    logger.warning(f"关闭LLM客户端失败: {str(e)}")
+            self._clients = {}
+            self._retired = []
+
+
+# 进程级单例，由所有路由共享
+registry = LLMClientRegistry()
+atexit.register(registry.close)
+
+
+def get_openai_client(provider: str) -> OpenAI:
+    """
+    获取共享的同步 OpenAI 兼容客户端
+
+    @param provider: 提供商名称 (deepseek/dashscope)
+    @return: OpenAI 客户端
+    """
+    return registry.get_client(provider)
+
+
+def get_async_openai_client(provider: str) -> AsyncOpenAI:
+    """
+    获取当前事件循环下共享的异步 OpenAI 兼容客户端
+
+    @param provider: 提供商名称 (deepseek/dashscope)
+    @return: AsyncOpenAI 客户端
+    """
+    return registry.get_async_client(provider)
@@ -0,0 +1,278 @@
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from app.routes.config import CACHE_DIR
+from .llm_pool import env_float
+from .sqlite_helper import thread_connection
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, "true" if default else "false").lower() not in ("0", "false", "no")
+
+
+@dataclass
+class SingleFlightConfig:
+    """合并配置"""
+    enabled: bool = True
+    cross_process: bool = False
+    db_path: str = ""
+    lease_seconds: float = 300.0
+    poll_interval: float = 0.25
+
+    @classmethod
+    def from_env(cls) -> "SingleFlightConfig":
+        return cls(
+            enabled=_env_flag("LLM_SINGLEFLIGHT_ENABLED", cls.enabled),
+            cross_process=_env_flag("LLM_SINGLEFLIGHT_CROSS_PROCESS", cls.cross_process),
+            db_path=os.getenv(
+                "LLM_SINGLEFLIGHT_DB",
+                os.getenv("LLM_CACHE_DB", os.path.join(CACHE_DIR, "llm_cache.sqlite3"))
+            ),
+            lease_seconds=env_float("LLM_SINGLEFLIGHT_LEASE", cls.lease_seconds),
+            poll_interval=env_float("LLM_SINGLEFLIGHT_POLL", cls.poll_interval),
+        )
+
+
+class InflightLease:
+    """
+    跨 worker 的在途标记，保存在 SQLite 的 inflight 表中
+
+    每个键同一时刻只有一个持有者；持有者崩溃时租约到期后自动失效。
+    """
+
+    def __init__(self, db_path: str, lease_seconds: float):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        return thread_connection(
+            self._local, self.db_path,
+            "CREATE TABLE IF NOT EXISTS inflight ("
+            " key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL);"
+        )
+
+    def acquire(self, key: str) -> Optional[str]:
+        """
+        尝试获取租约
+
+        @return: 持有者标识，已被其他请求持有时返回 None
+        """
+        now = time.time()
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        conn = self._connect()
+        conn.execute("DELETE FROM inflight WHERE key = ? AND expires_at <= ?", (key, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO inflight (key, owner, expires_at) VALUES (?, ?, ?)",
+            (key, owner, now + self.lease_seconds)
+        )
+        conn.commit()
+        return owner if cursor.rowcount == 1 else None
+
+    def held(self, key: str) -> bool:
+        """键当前是否有未过期的租约（不获取租约）"""
+        row = self._connect().execute(
+            "SELECT 1 FROM inflight WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def release(self, key: str, owner: str):
+        conn = self._connect()
+        conn.execute("DELETE FROM inflight WHERE key = ? AND owner = ?", (key, owner))
+        conn.commit()
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    相同请求在途合并
+
+    同一进程内，相同键的请求只有第一个（leader）真正执行，其余请求等待并共享其结果或异常。
+    开启 cross_process 且调用方提供 lookup 时，多个 worker 之间通过 InflightLease 协调：
+    拿不到租约的 worker 轮询 lookup（通常是读取响应缓存），直到 leader 写入结果或租约释放。
+    """
+
+    def __init__(self, config: SingleFlightConfig = None):
+        self.config = config or SingleFlightConfig.from_env()
+        self._lease = InflightLease(self.config.db_path, self.config.lease_seconds)
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "coalesced": 0, "remote_coalesced": 0}
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def do(self, key: str, fn: Callable[[], Any], lookup: Callable[[], Any] = None) -> Any:
+        """
+        执行 fn，相同键已在执行时等待其结果
+
+        @param key: 请求指纹
+        @param fn: 实际调用
+        @param lookup: 跨 worker 合并时读取其他 worker 结果的函数，None 表示只做进程内合并
+        @return: fn 的结果
+        """
+        if not self.config.enabled:
+            return fn()
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["leaders"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            logger.info(f"合并在途请求: {key[:12]}")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, fn, lookup)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _run(self, key: str, fn: Callable[[], Any], lookup: Optional[Callable[[], Any]]) -> Any:
+        if lookup is None or not self.config.cross_process:
+            return fn()
+
+        owner = None
+        deadline = time.monotonic() + self.config.lease_seconds
+        try:
+            while True:
+                owner = self._lease.acquire(key)
+                # 拿到租约后也要再查一次：上一个持有者可能刚写入结果并释放
+                value = lookup()
+                if value is not None:
+                    self._count("remote_coalesced")
+                    logger.info(f"合并其他 worker 的在途请求: {key[:12]}")
+                    self._release(key, owner)
+                    return value
+                if owner is not None:
+                    break
+                if time.monotonic() >= deadline:
+                    logger.warning(f"等待其他 worker 结果超时，直接调用: {key[:12]}")
+                    break
+                time.sleep(self.config.poll_interval)
+        except sqlite3.Error as e:
+            logger.warning(f"跨 worker 合并失败，直接调用: {str(e)}")
+
+        try:
+            return fn()
+        finally:
+            self._release(key, owner)
+
+    def _release(self, key: str, owner: Optional[str]):
+        if owner is None:
+            return
+        try:
+            self._lease.release(key, owner)
+        except sqlite3.Error as e:
+            logger.warning(f"释放在途标记失败: {str(e)}")
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]],
+                  lookup: Callable[[], Any] = None) -> Any:
+        """do 的异步版本，在同一事件循环内合并"""
+        if not self.config.enabled:
+            return await fn()
+
+        loop = asyncio.get_running_loop()
+        slot = (id(loop), key)
+        with self._lock:
+            future = self._async_calls.get(slot)
+            leader = future is None
+            if leader:
+                future = self._async_calls[slot] = loop.create_future()
+                self._stats["leaders"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            logger.info(f"合并在途请求: {key[:12]}")
+            return await asyncio.shield(future)
+
+        try:
+            result = await self._arun(key, fn, lookup)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                self._async_calls.pop(slot, None)
+
+    async def _arun(self, key: str, fn: Callable[[], Awaitable[Any]],
+                    lookup: Optional[Callable[[], Any]]) -> Any:
+        if lookup is None or not self.config.cross_process:
+            return await fn()
+
+        owner = None
+        deadline = time.monotonic() + self.config.lease_seconds
+        try:
+            while True:
+                owner = self._lease.acquire(key)
+                # 拿到租约后也要再查一次：上一个持有者可能刚写入结果并释放
+                value = lookup()
+                if value is not None:
+                    self._count("remote_coalesced")
+                    logger.info(f"合并其他 worker 的在途请求: {key[:12]}")
+                    self._release(key, owner)
+                    return value
+                if owner is not None:
+                    break
+                if time.monotonic() >= deadline:
+                    logger.warning(f"等待其他 worker 结果超时，直接调用: {key[:12]}")
+                    break
+                await asyncio.sleep(self.config.poll_interval)
+        except sqlite3.Error as e:
+            logger.warning(f"跨 worker 合并失败，直接调用: {str(e)}")
+
+        try:
+            return await fn()
+        finally:
+            self._release(key, owner)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls) + len(self._async_calls)
+        stats["cross_process"] = self.config.cross_process
+        return stats
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,194 @@
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import threading
+
+from .llm_pool import env_int
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 各模型的上下文窗口和单次最大输出（DashScope 兼容接口的限制）
+CONTEXT_WINDOWS = {
+    "deepseek-r1": 65536,
+    "qwen-turbo": 131072,
+    "qwen-omni-turbo": 32768,
+}
+MAX_OUTPUT_TOKENS = {
+    "deepseek-r1": 8192,
+    "qwen-turbo": 8192,
+    "qwen-omni-turbo": 2048,
+}
+DEFAULT_CONTEXT_WINDOW = 32768
+DEFAULT_MAX_OUTPUT = 2048
+
+# 每条消息的格式开销和回复起始开销（与 OpenAI 的计算方式一致）
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 2
+
+# 预留给分词差异的安全余量，以及留给回复的最少 token 数
+SAFETY_MARGIN = env_int("LLM_TOKEN_SAFETY_MARGIN", 256)
+MIN_COMPLETION_TOKENS = env_int("LLM_MIN_COMPLETION_TOKENS", 512)
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_encoding_failed = False
+
+
+def _get_encoding():
+    """
+    懒加载 tiktoken 编码
+
+    DeepSeek/通义千问没有公开的 tiktoken 编码，cl100k_base 对中英文的估算足够接近；
+    编码文件下载失败（如离线环境）时退化为按字符估算。
+    """
+    global _encoding, _encoding_failed
+    if _encoding is not None or _encoding_failed:
+        return _encoding
+    with _encoding_lock:
+        if _encoding is None and not _encoding_failed:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                _encoding_failed = True
+                logger.warning(f"加载 tiktoken 编码失败，改用字符数估算: {str(e)}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """
+    计算文本的 token 数
+
+    @param text: 文本
+    @return: token 数
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # 估算：非 ASCII 字符约 1 token/字，ASCII 约 4 字符/token
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+
+def count_message_tokens(messages: List[Dict[str, Any]]) -> int:
+    """
+    计算 OpenAI 格式消息列表的提示词 token 数
+
+    @param messages: OpenAI 格式消息
+    @return: token 数
+    """
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        content = message.get("content")
+        total += TOKENS_PER_MESSAGE + count_tokens(content if isinstance(content, str) else str(content))
+    return total
+
+
+def context_window(model: str) -> int:
+    return CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+
+def trim_messages(messages: List[Dict[str, Any]], budget: int) -> List[Dict[str, Any]]:
+    """
+    丢弃最早的非 system 消息，直到提示词不超过预算；system 消息和最后一条消息始终保留
+
+    @param messages: OpenAI 格式消息
+    @param budget: 提示词 token 上限
+    @return: 裁剪后的消息列表
+    """
+    counts = [TOKENS_PER_MESSAGE + count_tokens(str(m.get("content") or "")) for m in messages]
+    total = TOKENS_PER_REPLY + sum(counts)
+    keep = [True] * len(messages)
+    for i, message in enumerate(messages[:-1]):
+        if total <= budget:
+            break
+        if message.get("role") == "system":
+            continue
+        keep[i] = False
+        total -= counts[i]
+    trimmed = [m for m, kept in zip(messages, keep) if kept]
+    if len(trimmed) < len(messages):
+        logger.warning(f"提示词超出上下文窗口，丢弃了 {len(messages) - len(trimmed)} 条历史消息")
+    return trimmed
+
+
+def prepare_request(messages: List[Dict[str, Any]], model: str,
+                    max_tokens: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int, int]:
+    """
+    请求前的 token 预算
+
+    统计提示词长度，历史过长时裁剪，并根据上下文窗口剩余空间计算 max_tokens。
+
+    @param messages: OpenAI 格式消息
+    @param model: 模型名称
+    @param max_tokens: 调用方期望的最大输出，None 时使用模型上限
+    @return: (发送的消息, max_tokens, 提示词 token 数)
+    """
+    window = context_window(model)
+    requested = min(max_tokens or MAX_OUTPUT_TOKENS.get(model, DEFAULT_MAX_OUTPUT),
+                    MAX_OUTPUT_TOKENS.get(model, DEFAULT_MAX_OUTPUT))
+    prompt_tokens = count_message_tokens(messages)
+
+    # 至少给回复留出 MIN_COMPLETION_TOKENS，超出部分从历史中裁掉
+    reserve = min(requested, MIN_COMPLETION_TOKENS)
+    if prompt_tokens + reserve + SAFETY_MARGIN > window:
+        messages = trim_messages(messages, window - reserve - SAFETY_MARGIN)
+        prompt_tokens = count_message_tokens(messages)
+
+    budget = max(1, min(requested, window - prompt_tokens - SAFETY_MARGIN))
+    if budget < requested:
+        logger.info(f"{model} 提示词 {prompt_tokens} tokens，max_tokens 由 {requested} 调整为 {budget}")
+    return messages, budget, prompt_tokens
+
+
+class UsageStats:
+    """按调用路由和模型累计的 token 用量"""
+
+    def __init__(self):
+        self._usage: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, model: str, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            usage = self._usage.setdefault(
+                (endpoint, model), {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            )
+            usage["calls"] += 1
+            usage["prompt_tokens"] += prompt_tokens
+            usage["completion_tokens"] += completion_tokens
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        with self._lock:
+            result: Dict[str, Dict[str, Dict[str, int]]] = {}
+            for (endpoint, model), usage in self._usage.items():
+                result.setdefault(endpoint, {})[model] = dict(usage)
+            return result
+
+
+usage_stats = UsageStats()
+
+
+def current_endpoint() -> str:
+    """当前 Flask 路由名称，不在请求上下文中（离线任务、后台线程）时为 offline"""
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            return request.endpoint or request.path
+    except ImportError:
+        pass
+    return "offline"
+
+
+def record_usage(endpoint: str, model: str, prompt_tokens: int, completion_tokens: int):
+    """
+    记录一次调用的 token 用量
+
+    @param endpoint: 调用路由，见 current_endpoint()
+    @param model: 模型名称
+    @param prompt_tokens: 提示词 token 数
+    @param completion_tokens: 回复 token 数
+    """
+    usage_stats.record(endpoint, model, prompt_tokens, completion_tokens)
+    logger.debug(f"[{endpoint}] {model} 用量: prompt={prompt_tokens}, completion={completion_tokens}")
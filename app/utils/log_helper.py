@@ -1,39 +1,35 @@
-import os
-import json
+import logging
 from datetime import datetime
+from .question_bank import question_bank_store, question_bank_index, extract_questions
 
-def save_deepseek_response(test_type: str, response: str):
+logger = logging.getLogger(__name__)
+
+def save_deepseek_response(test_type: str, response: str, suffix: str = None, questions: list = None):
     """
-    保存 DeepSeek 的响应到题库文件
+    保存 DeepSeek 的响应到题库
+    
+    解析出的题目和原始响应分开保存，无法解析时只保存原始响应，不会进入题库。
     
     @param test_type: 测试类型
     @param response: DeepSeek 的响应
+    @param suffix: 来源名称后缀，批量生成时避免同一秒内的题库重名
+    @param questions: 已解析并校验的题目（如分片合并的结果），提供时不再从响应中解析
+    @return: file_id
     """
-    # 创建 question_bank 目录和对应的测试类型子目录
-    question_bank_dir = os.path.join("question_bank", test_type)
-    if not os.path.exists(question_bank_dir):
-        os.makedirs(question_bank_dir)
-    
-    # 生成文件名，包含时间戳
+    # 来源名称沿用旧版文件名格式，file_id 为其 MD5
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = os.path.join(question_bank_dir, f"deepseek_{test_type}_{timestamp}.json")
+    if suffix:
+        timestamp = f"{timestamp}_{suffix}"
+    source = f"deepseek_{test_type}_{timestamp}.json"
+    
+    try:
+        raw_questions = questions if questions is not None else extract_questions(response)
+        file_id = question_bank_store.add(test_type, source, raw_questions, response=response)
+    except (ValueError, KeyError, TypeError) as e:
+        # json.JSONDecodeError 是 ValueError 的子类
+        logger.error(f"题库 JSON 解析失败，只保存原始响应: {str(e)}")
+        return question_bank_store.add_raw(test_type, source, response)
     
-    # 保存响应
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(f"# 测试类型: {test_type}\n")
-        f.write(f"# 时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"# 原始响应:\n")
-        f.write(response)
-        
-        # 尝试解析并格式化 JSON
-        try:
-            # 查找 JSON 开始和结束位置
-            start = response.find('[')
-            end = response.rfind(']') + 1
-            if start >= 0 and end > start:
-                json_str = response[start:end]
-                parsed_json = json.loads(json_str)
-                f.write("\n\n# 格式化的 JSON:\n")
-                f.write(json.dumps(parsed_json, ensure_ascii=False, indent=2))
-        except Exception as e:
-            f.write(f"\n\n# JSON 解析失败: {str(e)}") 
\ No newline at end of file
+    # 新题库立即可见，不必等待索引的下一次检查
+    question_bank_index.invalidate(test_type)
+    return file_id
@@ -0,0 +1,106 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Set
+import hashlib
+import json
+import logging
+import re
+import threading
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from .llm_pool import env_int, env_float
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_ROUTE = "knowledge"
+CONVERSATION_ROUTE = "conversation"
+
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def _bigrams(text: str) -> Set[str]:
+    """去掉标点和空白后的字符二元组（中文没有分词，二元组足以衡量关键词重合）"""
+    text = _NON_WORD.sub("", text.lower())
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def keyword_overlap(query: str, text: str) -> float:
+    """查询的字符二元组中出现在 text 里的比例（0-1）"""
+    query_grams = _bigrams(query)
+    if not query_grams:
+        return 0.0
+    return len(query_grams & _bigrams(text)) / len(query_grams)
+
+
+@dataclass
+class RouteDecision:
+    """一次路由的结果"""
+    route: str
+    score: float
+    similarity: float
+    overlap: float
+    documents: List[Document] = field(default_factory=list, repr=False)
+
+    def log_fields(self) -> Dict[str, Any]:
+        return {
+            "route": self.route,
+            "score": round(self.score, 4),
+            "similarity": round(self.similarity, 4),
+            "overlap": round(self.overlap, 4),
+            "sections": [doc.metadata.get("section") for doc in self.documents],
+        }
+
+
+class KnowledgeRouter:
+    """
+    调用模型之前判断问题是否由知识库回答
+
+    得分 = vector_weight × 最高向量相似度 + (1 - vector_weight) × 最高关键词重合度，
+    不低于 threshold 时走知识库问答，否则走普通对话。每次决策以一行 JSON 记录日志，便于校准阈值。
+    """
+
+    def __init__(self, vectorstore: FAISS, threshold: float = None, vector_weight: float = None, k: int = None):
+        self.vectorstore = vectorstore
+        self.threshold = env_float("CS_ROUTE_THRESHOLD", 0.5) if threshold is None else threshold
+        self.vector_weight = env_float("CS_ROUTE_VECTOR_WEIGHT", 0.6) if vector_weight is None else vector_weight
+        self.k = k or env_int("CS_ROUTE_TOP_K", 4)
+        self._lock = threading.Lock()
+        self._stats = {KNOWLEDGE_ROUTE: 0, CONVERSATION_ROUTE: 0}
+
+    def route(self, query: str) -> RouteDecision:
+        """
+        为查询选择路由
+
+        @param query: 用户问题
+        @return: RouteDecision，documents 为检索到的文档（按相似度排序），走知识库时直接作为上下文
+        """
+        results = self.vectorstore.similarity_search_with_score(query, k=self.k)
+        # 索引以 normalize_L2 构建（见 knowledge_index.NORMALIZE_L2），IndexFlatL2 返回的平方欧氏距离 d
+        # 对应余弦相似度 1 - d/2
+        similarity = max((1.0 - float(distance) / 2 for _, distance in results), default=0.0)
+        overlap = max((keyword_overlap(query, doc.page_content) for doc, _ in results), default=0.0)
+        score = self.vector_weight * similarity + (1 - self.vector_weight) * overlap
+        route = KNOWLEDGE_ROUTE if results and score >= self.threshold else CONVERSATION_ROUTE
+
+        decision = RouteDecision(
+            route=route,
+            score=score,
+            similarity=similarity,
+            overlap=overlap,
+            documents=[doc for doc, _ in results],
+        )
+        with self._lock:
+            self._stats[route] += 1
+        # 不记录问题原文，只记录长度和哈希，同一问题的多次决策仍可对应起来
+        fields = dict(decision.log_fields(), query_length=len(query),
+                      query_hash=hashlib.sha256(query.encode('utf-8')).hexdigest()[:12])
+        logger.info(f"客服路由决策: {json.dumps(fields, ensure_ascii=False)}")
+        return decision
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,501 @@
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from app.models.test_models import TestGenerator
+from app.routes.config import QUESTION_BANK_DB, SCRIPT_DIR_QUESTION_BANK
+from .llm_pool import env_float, env_int
+from .scoring import ScoringTable, compile_scoring_table
+from .sqlite_helper import thread_connection
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+FORMATTED_JSON_MARKER = "# 格式化的 JSON:\n"
+# 题库文件名中的时间戳，如 deepseek_mbti_20250217_234758.json、deepseek_mbti_20250217_234758_3.json
+_FILENAME_TIMESTAMP = re.compile(r"_(\d{8}_\d{6})(?:_\w+)?\.json$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS banks (
+    file_id TEXT PRIMARY KEY,
+    test_type TEXT NOT NULL,
+    source TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    total INTEGER NOT NULL,
+    questions TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_banks_type_created ON banks (test_type, created_at);
+CREATE TABLE IF NOT EXISTS bank_raw (
+    file_id TEXT PRIMARY KEY,
+    test_type TEXT NOT NULL,
+    response TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bank_pool (
+    file_id TEXT PRIMARY KEY,
+    test_type TEXT NOT NULL,
+    source TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    questions TEXT NOT NULL,
+    response TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_bank_pool_type_created ON bank_pool (test_type, created_at);
+"""
+
+
+def file_id_for(source: str) -> str:
+    """题库对外的 file_id（来源文件名的 MD5，与旧版按文件名计算的结果一致）"""
+    return hashlib.md5(source.encode('utf-8')).hexdigest()
+
+
+def extract_questions(response: str) -> List[Dict[str, Any]]:
+    """从模型响应中取出第一个 JSON 数组"""
+    start = response.find('[')
+    end = response.rfind(']') + 1
+    if start >= 0 and end > start:
+        return json.loads(response[start:end])
+    raise ValueError("无法在文件中找到有效的JSON")
+
+
+class QuestionStreamParser:
+    """
+    增量解析模型流式输出中的 JSON 数组
+
+    每次 feed 一个片段，返回本次闭合的顶层对象。只扫描新到达的字符，已返回的对象从缓冲区丢弃；
+    无法解析的对象记录日志后跳过，不影响后续题目。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._start = 0
+        self._depth = 0
+        self._in_array = False
+        self._opening = False
+        self._in_string = False
+        self._escape = False
+        self.done = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        追加一个片段
+
+        @param chunk: 模型输出片段
+        @return: 本次解析出的题目对象
+        """
+        if self.done or not chunk:
+            return []
+        self._buffer += chunk
+        buffer, objects = self._buffer, []
+        i = self._pos
+        while i < len(buffer):
+            c = buffer[i]
+            if not self._in_array:
+                if c == '[':
+                    self._opening = True
+                elif self._opening and not c.isspace():
+                    # 前言里也可能出现 "["，只有后面紧跟 "{" 的才是题目数组的开头
+                    self._opening = False
+                    if c == '{':
+                        self._in_array = True
+                        continue
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c == '{':
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif c == '}' and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        obj = json.loads(buffer[self._start:i + 1])
+                        if isinstance(obj, dict):
+                            objects.append(obj)
+                    except ValueError as e:
+                        logger.warning(f"跳过无法解析的题目: {str(e)}")
+            elif c == ']' and self._depth == 0:
+                self.done = True
+                break
+            i += 1
+
+        # 未闭合的对象保留在缓冲区，其余部分已处理完
+        keep = self._start if self._depth else i
+        self._buffer = buffer[keep:]
+        self._pos = i - keep
+        self._start = 0
+        return objects
+
+
+def parse_bank_content(content: str) -> List[Dict[str, Any]]:
+    """
+    从旧版题库文件内容中解析题目列表
+
+    优先使用 "# 格式化的 JSON:" 之后的部分，没有时取第一个 JSON 数组。
+
+    @param content: 文件内容
+    @return: 原始题目列表
+    """
+    json_start = content.find(FORMATTED_JSON_MARKER)
+    if json_start >= 0:
+        return json.loads(content[json_start + len(FORMATTED_JSON_MARKER):])
+    return extract_questions(content)
+
+
+def format_questions(test_type: str, raw_questions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """转换为接口返回的题目结构"""
+    if test_type == 'mbti':
+        questions = TestGenerator.format_mbti_questions(raw_questions)
+    else:
+        questions = TestGenerator.format_other_questions(raw_questions)
+    return [asdict(q) for q in questions]
+
+
+def validate_bank(test_type: str, raw_questions: List[Dict[str, Any]], min_questions: int = 1):
+    """
+    校验一套题目能否返回给前端并计分
+
+    @param test_type: 测试类型
+    @param raw_questions: 题目列表
+    @param min_questions: 最少题目数
+    @raise ValueError: 题目数不足、编号重复、缺少字段或维度无效
+    """
+    if not isinstance(raw_questions, list) or len(raw_questions) < min_questions:
+        raise ValueError(f"题目数不足 {min_questions} 个")
+    try:
+        ids = [str(q['id']) for q in raw_questions]
+        format_questions(test_type, raw_questions)
+        compile_scoring_table(test_type, raw_questions)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"题目格式无效: {str(e)}")
+    if len(set(ids)) != len(ids):
+        raise ValueError("题目编号重复")
+
+
+@dataclass
+class BankEntry:
+    """一套已解析的题目"""
+    test_type: str
+    file_id: str
+    source: str
+    created_at: float
+    raw_questions: List[Dict[str, Any]]
+    questions: List[Dict[str, Any]]
+    scoring: ScoringTable = field(repr=False, compare=False)
+    # 预先渲染的接口响应，题库版本不变时直接复用（见 test_helper.render_test_from_bank）
+    rendered: Dict[str, Any] = field(default_factory=dict, repr=False, compare=False)
+
+
+class QuestionBankStore:
+    """
+    题库存储（SQLite）
+
+    banks 表每个题库版本一行，questions 为紧凑 JSON，读取时只需一次 json.loads；
+    模型原始响应单独保存在 bank_raw 表，只在排查问题时读取。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        return thread_connection(self._local, self.db_path, _SCHEMA)
+
+    @staticmethod
+    def _entry(row) -> BankEntry:
+        test_type, file_id, source, created_at, questions = row
+        raw_questions = json.loads(questions)
+        return BankEntry(
+            test_type=test_type,
+            file_id=file_id,
+            source=source,
+            created_at=created_at,
+            raw_questions=raw_questions,
+            questions=format_questions(test_type, raw_questions),
+            scoring=compile_scoring_table(test_type, raw_questions),
+        )
+
+    def add(self, test_type: str, source: str, raw_questions: List[Dict[str, Any]],
+            response: str = None, created_at: float = None) -> str:
+        """
+        保存一套题目，同一来源重复保存时忽略
+
+        @param test_type: 测试类型
+        @param source: 来源名称（文件名），用于计算 file_id
+        @param raw_questions: 题目列表
+        @param response: 模型原始响应
+        @param created_at: 生成时间，默认当前时间
+        @return: file_id
+        """
+        # 先校验格式，避免存入接口无法返回或无法计分的题目
+        validate_bank(test_type, raw_questions)
+        file_id = file_id_for(source)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO banks (file_id, test_type, source, created_at, total, questions) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (file_id, test_type, source, created_at or time.time(), len(raw_questions),
+                 json.dumps(raw_questions, ensure_ascii=False, separators=(",", ":")))
+            )
+            if response is not None:
+                self._save_raw(conn, file_id, test_type, response)
+        return file_id
+
+    def add_raw(self, test_type: str, source: str, response: str) -> str:
+        """只保存原始响应（无法解析出题目时），不会出现在题库中"""
+        file_id = file_id_for(source)
+        conn = self._connect()
+        with conn:
+            self._save_raw(conn, file_id, test_type, response)
+        return file_id
+
+    @staticmethod
+    def _save_raw(conn: sqlite3.Connection, file_id: str, test_type: str, response: str):
+        conn.execute(
+            "INSERT OR IGNORE INTO bank_raw (file_id, test_type, response) VALUES (?, ?, ?)",
+            (file_id, test_type, response)
+        )
+
+    def add_pooled(self, test_type: str, source: str, raw_questions: List[Dict[str, Any]],
+                   response: str = None) -> str:
+        """
+        把预生成的题目放入备用池，被领取之前不会出现在题库中
+
+        @return: file_id
+        """
+        validate_bank(test_type, raw_questions)
+        file_id = file_id_for(source)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO bank_pool (file_id, test_type, source, created_at, questions, response) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (file_id, test_type, source, time.time(),
+                 json.dumps(raw_questions, ensure_ascii=False, separators=(",", ":")), response)
+            )
+        return file_id
+
+    def pool_size(self, test_type: str) -> int:
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM bank_pool WHERE test_type = ?", (test_type,)
+        ).fetchone()
+        return row[0]
+
+    def claim_pooled(self, test_type: str) -> Optional[str]:
+        """
+        从备用池领取最早生成的一套题目并转入题库，多个 worker 同时领取时不会拿到同一套
+
+        @return: file_id，备用池为空时返回 None
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT file_id, source, questions, response FROM bank_pool "
+                "WHERE test_type = ? ORDER BY created_at LIMIT 1", (test_type,)
+            ).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            file_id, source, questions, response = row
+            # 以领取时间作为生成时间，领取后即为该类型最新的题库
+            conn.execute(
+                "INSERT OR IGNORE INTO banks (file_id, test_type, source, created_at, total, questions) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (file_id, test_type, source, time.time(), len(json.loads(questions)), questions)
+            )
+            if response is not None:
+                self._save_raw(conn, file_id, test_type, response)
+            conn.execute("DELETE FROM bank_pool WHERE file_id = ?", (file_id,))
+            conn.commit()
+            return file_id
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def get(self, file_id: str) -> Optional[BankEntry]:
+        row = self._connect().execute(
+            "SELECT test_type, file_id, source, created_at, questions FROM banks WHERE file_id = ?", (file_id,)
+        ).fetchone()
+        return self._entry(row) if row else None
+
+    def latest(self, test_type: str) -> Optional[BankEntry]:
+        row = self._connect().execute(
+            "SELECT test_type, file_id, source, created_at, questions FROM banks "
+            "WHERE test_type = ? ORDER BY created_at DESC, source DESC LIMIT 1", (test_type,)
+        ).fetchone()
+        return self._entry(row) if row else None
+
+    def max_rowid(self, test_type: str) -> int:
+        row = self._connect().execute(
+            "SELECT MAX(rowid) FROM banks WHERE test_type = ?", (test_type,)
+        ).fetchone()
+        return row[0] or 0
+
+    def get_raw(self, file_id: str) -> Optional[str]:
+        row = self._connect().execute("SELECT response FROM bank_raw WHERE file_id = ?", (file_id,)).fetchone()
+        return row[0] if row else None
+
+    def import_directory(self, root: str) -> int:
+        """
+        导入旧版题库文件（root/<测试类型>/*.json），已导入的文件按 file_id 跳过
+
+        @param root: 题库目录
+        @return: 新导入的题库数
+        """
+        if not os.path.isdir(root):
+            return 0
+        known = {row[0] for row in self._connect().execute("SELECT file_id FROM banks")}
+        imported = 0
+        for test_type in sorted(os.listdir(root)):
+            directory = os.path.join(root, test_type)
+            if not os.path.isdir(directory):
+                continue
+            for filename in sorted(os.listdir(directory)):
+                path = os.path.join(directory, filename)
+                if file_id_for(filename) in known or not os.path.isfile(path):
+                    continue
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        content = f.read()
+                    self.add(test_type, filename, parse_bank_content(content),
+                             response=content, created_at=_created_at(filename, path))
+                    imported += 1
+                except Exception as e:
+                    logger.error(f"导入题库文件失败，已跳过 {path}: {str(e)}")
+        if imported:
+            logger.info(f"已导入 {imported} 个题库文件: {root}")
+        return imported
+
+
+def _created_at(filename: str, path: str) -> float:
+    """从文件名中的时间戳推断生成时间，没有时使用文件修改时间"""
+    match = _FILENAME_TIMESTAMP.search(filename)
+    if match:
+        return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S").timestamp()
+    return os.stat(path).st_mtime
+
+
+@dataclass
+class _TypeIndex:
+    checked_at: float = 0.0
+    last_rowid: int = 0
+    latest: Optional[BankEntry] = None
+
+
+class QuestionBankIndex:
+    """
+    进程内的题库索引
+
+    每种测试类型只常驻最新的一套题目；其他版本按 file_id 从存储中按需加载，保存在最多 max_entries 套的
+    LRU 中（每套题目带有计分表和预渲染的响应，全部常驻会让 worker 内存随题库版本数无限增长）。
+    两次检查之间至少间隔 check_interval 秒；检查时只比较存储中该类型的最大 rowid，
+    有新题库（包括其他 worker 写入的）时只加载最新的一套。首次使用时导入旧版题库目录中尚未入库的文件。
+    """
+
+    def __init__(self, store: QuestionBankStore, check_interval: float = 2.0, import_root: str = None,
+                 max_entries: int = 64):
+        self.store = store
+        self.check_interval = check_interval
+        self.import_root = import_root
+        self.max_entries = max_entries
+        self._imported = import_root is None
+        self._types: Dict[str, _TypeIndex] = {}
+        self._recent = OrderedDict()  # file_id -> BankEntry（非最新版本）
+        self._lock = threading.Lock()
+
+    def _remember(self, entry: BankEntry):
+        # 调用方持有 self._lock
+        self._recent[entry.file_id] = entry
+        self._recent.move_to_end(entry.file_id)
+        while len(self._recent) > self.max_entries:
+            self._recent.popitem(last=False)
+
+    def _refresh(self, test_type: str) -> _TypeIndex:
+        now = time.monotonic()
+        index = self._types.get(test_type)
+        if index is not None and now - index.checked_at < self.check_interval:
+            return index
+
+        with self._lock:
+            if not self._imported:
+                self._imported = True
+                self.store.import_directory(self.import_root)
+            index = self._types.setdefault(test_type, _TypeIndex())
+            if now - index.checked_at < self.check_interval:
+                return index
+            max_rowid = self.store.max_rowid(test_type)
+            if max_rowid > index.last_rowid:
+                latest = self.store.latest(test_type)
+                if latest is not None and (index.latest is None or latest.file_id != index.latest.file_id):
+                    # 刚被替换的版本仍可能有用户在作答，放入 LRU 供提交时使用
+                    if index.latest is not None:
+                        self._remember(index.latest)
+                    index.latest = self._recent.pop(latest.file_id, latest)
+                    logger.info(f"题库索引已更新: {test_type}，最新题库 {latest.file_id}")
+                index.last_rowid = max_rowid
+            index.checked_at = now
+            return index
+
+    def latest(self, test_type: str) -> Optional[BankEntry]:
+        """最新的一套题目，题库为空时返回 None"""
+        return self._refresh(test_type).latest
+
+    def get(self, test_type: str, file_id: str) -> Optional[BankEntry]:
+        """按 file_id 查找题目，不在内存中时从存储加载"""
+        latest = self._refresh(test_type).latest
+        if latest is not None and latest.file_id == file_id:
+            return latest
+        with self._lock:
+            entry = self._recent.get(file_id)
+            if entry is not None:
+                self._recent.move_to_end(file_id)
+                return entry if entry.test_type == test_type else None
+        entry = self.store.get(file_id)
+        if entry is None or entry.test_type != test_type:
+            return None
+        with self._lock:
+            # 并发加载同一版本时保留先放入的，渲染结果等缓存挂在同一个对象上
+            entry = self._recent.get(file_id, entry)
+            self._remember(entry)
+        return entry
+
+    def invalidate(self, test_type: str = None):
+        """下次读取时立即检查存储"""
+        with self._lock:
+            for name, index in self._types.items():
+                if test_type is None or name == test_type:
+                    index.checked_at = 0.0
+
+
+question_bank_store = QuestionBankStore(QUESTION_BANK_DB)
+question_bank_index = QuestionBankIndex(
+    question_bank_store,
+    check_interval=env_float("QUESTION_BANK_CHECK_INTERVAL", 2.0),
+    import_root=SCRIPT_DIR_QUESTION_BANK,
+    max_entries=env_int("QUESTION_BANK_CACHE_SIZE", 64),
+)
+
+
+if __name__ == "__main__":
+    # python -m app.utils.question_bank [题库目录]：导入旧版题库文件
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    root = sys.argv[1] if len(sys.argv) > 1 else SCRIPT_DIR_QUESTION_BANK
+    print(f"导入 {question_bank_store.import_directory(root)} 个题库到 {QUESTION_BANK_DB}")
@@ -0,0 +1,229 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+MBTI_DIMENSIONS = ['E', 'I', 'S', 'N', 'T', 'F', 'J', 'P']
+ENNEAGRAM_TYPES = [str(i) for i in range(1, 10)]
+LIKERT_OPTIONS = ['A', 'B', 'C', 'D', 'E']
+
+# 各测试的选项分值：职业倾向 A=1 … E=5，九型人格 A=5 … E=1
+CAREER_POINTS = [1, 2, 3, 4, 5]
+ENNEAGRAM_POINTS = [5, 4, 3, 2, 1]
+
+
+@dataclass
+class ScoreResult:
+    """一份答卷的计分结果"""
+    dimensions: List[str]
+    totals: np.ndarray        # 各维度得分
+    counts: np.ndarray        # 各维度被作答的题目数
+    rows: np.ndarray          # 每个答案对应的题目行号（与答案顺序一致）
+    options: np.ndarray       # 每个答案对应的选项下标
+
+    def scores(self) -> Dict[str, int]:
+        """各维度得分，按维度顺序"""
+        return {dim: int(total) for dim, total in zip(self.dimensions, self.totals)}
+
+    def answered_scores(self) -> Dict[str, int]:
+        """只包含被作答过的维度"""
+        return {dim: int(total) for dim, total, count in zip(self.dimensions, self.totals, self.counts) if count}
+
+
+class ScoringTable:
+    """
+    一套题目编译后的计分矩阵
+
+    weights[题目行, 选项, 维度] 为选择该选项时各维度得到的分数，
+    一份答卷的得分即 weights[rows, options].sum(axis=0)。
+    """
+
+    def __init__(self, test_type: str, questions: List[Dict[str, Any]], options: List[str],
+                 dimensions: List[str], weights: np.ndarray, option_points: List[int] = None):
+        self.test_type = test_type
+        self.questions = questions
+        self.options = options
+        self.dimensions = dimensions
+        self.weights = weights
+        self.option_points = option_points
+        # 前端可能以数字或字符串提交题目编号
+        self.row_by_id = {str(q['id']): row for row, q in enumerate(questions)}
+        self._option_index = {option: i for i, option in enumerate(options)}
+
+    def _resolve(self, answers: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+        if not isinstance(answers, list):
+            raise ValueError("答案必须是列表")
+        rows = np.empty(len(answers), dtype=np.intp)
+        options = np.empty(len(answers), dtype=np.intp)
+        for i, answer in enumerate(answers):
+            if not isinstance(answer, dict) or 'questionId' not in answer or 'answer' not in answer:
+                raise ValueError(f"第 {i + 1} 个答案格式无效，需要包含 questionId 和 answer")
+            row = self.row_by_id.get(str(answer['questionId']))
+            if row is None:
+                raise ValueError(f"题目 {answer['questionId']} 不存在")
+            rows[i] = row
+            options[i] = self._option(answer['answer'])
+        return rows, options
+
+    def _option(self, answer: str) -> int:
+        if self.test_type == 'mbti':
+            # 与旧版一致：除 A 以外都视为 B
+            return 0 if answer == 'A' else 1
+        index = self._option_index.get(answer) if isinstance(answer, str) else None
+        if index is None:
+            raise ValueError(f"无效的选项: {answer}")
+        return index
+
+    def score(self, answers: List[Dict[str, Any]]) -> ScoreResult:
+        """
+        计算一份答卷的得分
+
+        @param answers: [{'questionId': 题目编号, 'answer': 选项字母}]
+        @return: ScoreResult
+        @raise ValueError: 答案格式无效、题目不存在或选项无效
+        """
+        rows, options = self._resolve(answers)
+        selected = self.weights[rows, options]
+        return ScoreResult(
+            dimensions=self.dimensions,
+            totals=selected.sum(axis=0),
+            counts=np.count_nonzero(selected, axis=0),
+            rows=rows,
+            options=options,
+        )
+
+    def score_batch(self, sheets: List[List[Dict[str, Any]]]) -> List[Optional[ScoreResult]]:
+        """
+        一次计算多份答卷的得分
+
+        先逐份解析题目和选项（某份答卷无效时对应位置为 None，不影响其他答卷），
+        再把所有答案拼成一个数组，用一次 np.add.at 累加到 [答卷, 维度] 矩阵。
+
+        @param sheets: 多份答卷，每份格式同 score
+        @return: 与 sheets 顺序一致的 ScoreResult 列表，无效答卷为 None
+        """
+        resolved = []
+        for answers in sheets:
+            try:
+                resolved.append(self._resolve(answers))
+            except ValueError:
+                resolved.append(None)
+
+        valid = [i for i, r in enumerate(resolved) if r is not None]
+        results: List[Optional[ScoreResult]] = [None] * len(sheets)
+        if not valid:
+            return results
+
+        lengths = np.array([len(resolved[i][0]) for i in valid], dtype=np.intp)
+        rows = np.concatenate([resolved[i][0] for i in valid])
+        options = np.concatenate([resolved[i][1] for i in valid])
+        owner = np.repeat(np.arange(len(valid)), lengths)
+        selected = self.weights[rows, options]
+        totals = np.zeros((len(valid), len(self.dimensions)), dtype=selected.dtype)
+        counts = np.zeros((len(valid), len(self.dimensions)), dtype=np.int64)
+        np.add.at(totals, owner, selected)
+        np.add.at(counts, owner, selected != 0)
+
+        for n, i in enumerate(valid):
+            results[i] = ScoreResult(
+                dimensions=self.dimensions,
+                totals=totals[n],
+                counts=counts[n],
+                rows=resolved[i][0],
+                options=resolved[i][1],
+            )
+        return results
+
+
+def _compile_mbti(questions: List[Dict[str, Any]]) -> ScoringTable:
+    index = {dim: i for i, dim in enumerate(MBTI_DIMENSIONS)}
+    weights = np.zeros((len(questions), 2, len(MBTI_DIMENSIONS)), dtype=np.int32)
+    for row, q in enumerate(questions):
+        weights[row, 0, index[q['dimension_a']]] = 1
+        weights[row, 1, index[q['dimension_b']]] = 1
+    return ScoringTable('mbti', questions, ['A', 'B'], MBTI_DIMENSIONS, weights)
+
+
+def _compile_career(questions: List[Dict[str, Any]]) -> ScoringTable:
+    # 职业类型按在题库中首次出现的顺序排列
+    categories = [[c.strip() for c in q['category'].split(',') if c.strip()] for q in questions]
+    dimensions = list(dict.fromkeys(c for cats in categories for c in cats))
+    index = {dim: i for i, dim in enumerate(dimensions)}
+    weights = np.zeros((len(questions), len(LIKERT_OPTIONS), len(dimensions)), dtype=np.int32)
+    points = np.array(CAREER_POINTS, dtype=np.int32)
+    for row, cats in enumerate(categories):
+        for category in cats:
+            weights[row, :, index[category]] = points
+    return ScoringTable('career', questions, LIKERT_OPTIONS, dimensions, weights, CAREER_POINTS)
+
+
+def _compile_enneagram(questions: List[Dict[str, Any]]) -> ScoringTable:
+    index = {dim: i for i, dim in enumerate(ENNEAGRAM_TYPES)}
+    weights = np.zeros((len(questions), len(LIKERT_OPTIONS), len(ENNEAGRAM_TYPES)), dtype=np.int32)
+    points = np.array(ENNEAGRAM_POINTS, dtype=np.int32)
+    for row, q in enumerate(questions):
+        weights[row, :, index[str(q['category']).strip()]] = points
+    return ScoringTable('enneagram', questions, LIKERT_OPTIONS, ENNEAGRAM_TYPES, weights, ENNEAGRAM_POINTS)
+
+
+_COMPILERS = {
+    'mbti': _compile_mbti,
+    'career': _compile_career,
+    'enneagram': _compile_enneagram,
+}
+
+
+def compile_scoring_table(test_type: str, questions: List[Dict[str, Any]]) -> ScoringTable:
+    """
+    将一套题目编译为计分矩阵
+
+    @param test_type: 测试类型 (mbti/career/enneagram)
+    @param questions: 原始题目列表
+    @return: ScoringTable
+    """
+    compiler = _COMPILERS.get(test_type)
+    if compiler is None:
+        raise ValueError(f"不支持的测试类型: {test_type}")
+    return compiler(questions)
+
+
+def mbti_type(result: ScoreResult) -> str:
+    """由维度得分得出 MBTI 类型，同分时取后一个字母（I/N/F/P）"""
+    scores = result.scores()
+    return ''.join(
+        first if scores[first] > scores[second] else second
+        for first, second in (('E', 'I'), ('S', 'N'), ('T', 'F'), ('J', 'P'))
+    )
+
+
+def top_dimension(result: ScoreResult) -> str:
+    """得分最高的维度，同分时取靠前的"""
+    return result.dimensions[int(np.argmax(result.totals))]
+
+
+def top_dimensions(result: ScoreResult, n: int) -> List[str]:
+    """得分最高的 n 个被作答过的维度，同分时取靠前的"""
+    order = np.argsort(-result.totals, kind="stable")
+    return [result.dimensions[i] for i in order if result.counts[i]][:n]
+
+
+def score_profile(test_type: str, result: ScoreResult, margin_step: int = 2, top_n: int = 3) -> str:
+    """
+    量化的得分画像，得分相近的答卷得到相同的画像
+
+    MBTI 为类型加上每对维度差值按 margin_step 分档；职业倾向和九型人格为得分最高的 top_n 个维度
+    （按名次排列）。margin_step 越大、top_n 越小，画像越粗，缓存命中率越高。
+
+    @param test_type: 测试类型
+    @param result: 计分结果
+    @param margin_step: MBTI 维度差值的分档步长
+    @param top_n: 职业倾向/九型人格保留的维度数
+    @return: 画像字符串，如 "INTJ:1-0-3-2"、"5>4>9"
+    """
+    if test_type == 'mbti':
+        scores = result.scores()
+        margins = (
+            abs(scores[first] - scores[second]) // max(1, margin_step)
+            for first, second in (('E', 'I'), ('S', 'N'), ('T', 'F'), ('J', 'P'))
+        )
+        return f"{mbti_type(result)}:{'-'.join(str(m) for m in margins)}"
+    return '>'.join(top_dimensions(result, max(1, top_n)))
@@ -0,0 +1,28 @@
+import os
+import sqlite3
+import threading
+
+
+def thread_connection(local: threading.local, db_path: str, schema: str) -> sqlite3.Connection:
+    """
+    获取当前线程的 SQLite 连接，不存在时创建并初始化表结构
+
+    使用 WAL 模式，多个 gunicorn worker 可以同时读写同一个数据库文件；
+    fork 后的子进程不会复用父进程的连接。
+
+    @param local: 调用方持有的 threading.local
+    @param db_path: 数据库文件路径
+    @param schema: 建表语句（需可重复执行）
+    @return: sqlite3.Connection
+    """
+    conn = getattr(local, "conn", None)
+    if conn is not None and getattr(local, "pid", None) == os.getpid():
+        return conn
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=5)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(schema)
+    conn.commit()
+    local.conn, local.pid = conn, os.getpid()
+    return conn
@@ -1,14 +1,57 @@
 from .llm_clients import create_llm_client
-from app.models.test_models import TestGenerator
 from .log_helper import save_deepseek_response
+from .question_bank import question_bank_index, question_bank_store, validate_bank, format_questions, QuestionStreamParser
+from .bank_pool import QuestionBankPool
+from .bank_generator import Shard, generate_sharded
+from .scoring import ScoringTable, mbti_type as scoring_mbti_type, top_dimension, score_profile
+from .llm_cache import TwoTierCache, CACHE_DB, cached_call
+from .llm_pool import env_int, env_float
+from .llm_singleflight import InflightLease
 import logging
+import sqlite3
 import json
-from datetime import datetime
-import os
 import hashlib
-from app.routes.config import SCRIPT_DIR_QUESTION_BANK
+import gzip
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
 logger = logging.getLogger(__name__)
 
+# 测试分析缓存：按测试类型、题库和量化后的得分画像缓存，默认保留七天
+analysis_cache = TwoTierCache(
+    "analysis",
+    CACHE_DB,
+    ttl=env_float("ANALYSIS_CACHE_TTL", 7 * 24 * 3600),
+    max_entries=env_int("ANALYSIS_CACHE_MEMORY_SIZE", 256),
+)
+# 画像粒度：MBTI 维度差值的分档步长，职业倾向/九型人格保留的最高维度数
+ANALYSIS_MARGIN_STEP = env_int("ANALYSIS_PROFILE_MARGIN_STEP", 2)
+ANALYSIS_TOP_N = env_int("ANALYSIS_PROFILE_TOP_N", 3)
+# 后台生成分析的线程数
+analysis_executor = ThreadPoolExecutor(max_workers=env_int("ANALYSIS_WORKERS", 4), thread_name_prefix="analysis")
+# 正在生成的分析：SQLite 租约在所有 worker 间共享，同一画像只由一个 worker 生成；
+# 租约时长应大于一次分析调用（含降级）的最长耗时，持有者崩溃时到期后由其他 worker 重新提交
+analysis_leases = InflightLease(CACHE_DB, env_float("ANALYSIS_LEASE_SECONDS", 300))
+_scheduled_analyses = set()
+_scheduled_lock = threading.Lock()
+# 生成失败的分析缓存键，ANALYSIS_RETRY_AFTER 秒内所有 worker 都不再重新提交
+ANALYSIS_RETRY_AFTER = env_float("ANALYSIS_RETRY_AFTER", 30)
+analysis_failures = TwoTierCache("analysis_failures", CACHE_DB, ttl=ANALYSIS_RETRY_AFTER, max_entries=1024)
+# 两阶段提交的测试结果（本地计分结果和答卷），凭 result_id 查询分析进度
+test_results = TwoTierCache(
+    "results",
+    CACHE_DB,
+    ttl=env_float("TEST_RESULT_TTL", 7 * 24 * 3600),
+    max_entries=env_int("TEST_RESULT_MEMORY_SIZE", 1024),
+)
+# 预渲染题库响应的 gzip 压缩级别，0 表示不压缩
+QUESTION_BANK_GZIP_LEVEL = env_int("QUESTION_BANK_GZIP_LEVEL", 6)
+# 批量计分时每组向量化计算的答卷数
+BULK_SCORE_CHUNK = env_int("BULK_SCORE_CHUNK", 500)
+
 TEST_PROMPTS = {
     'mbti': """请生成30个MBTI性格测试题目，每个题目包含以下简单格式：
 {
@@ -63,14 +106,38 @@ EXPECTED_FORMAT = {
     ]
 }
 
-def get_test_questions(test_type):
-    """生成测试题目"""
-    client = create_llm_client('deepseek')
-    
-    prompt = f"""请生成30个全新的、独特的{test_type.upper()}测试题目，要求：
+# 分片生成：每个分片只覆盖一部分维度，各分片并发调用后合并
+GENERATION_SHARDS = {
+    'mbti': [Shard("E/I、S/N", 15), Shard("T/F、J/P", 15)],
+    'career': [
+        Shard("管理、领导、销售、行政、财务", 10),
+        Shard("技术、工程、研究、分析、数据", 10),
+        Shard("艺术、设计、教育、医疗、社会服务", 10),
+    ],
+    'enneagram': [Shard("1、2、3", 10), Shard("4、5、6", 10), Shard("7、8、9", 10)],
+}
+
+# 分片失败时的重试轮数；合并去重的相似度阈值（RapidFuzz ratio，0-100）
+QUESTION_SHARD_RETRIES = env_int("QUESTION_SHARD_RETRIES", 2)
+QUESTION_DEDUPE_THRESHOLD = env_float("QUESTION_DEDUPE_THRESHOLD", 85.0)
+# 生成的题目少于该数量时视为无效
+QUESTION_BANK_MIN_QUESTIONS = env_int("QUESTION_BANK_MIN_QUESTIONS", 20)
+# 预生成题库池：每种类型保持 QUESTION_POOL_SIZE 套，低于 QUESTION_POOL_LOW_WATERMARK 时后台补充
+QUESTION_POOL_SIZE = env_int("QUESTION_POOL_SIZE", 3)
+QUESTION_POOL_LOW_WATERMARK = env_int("QUESTION_POOL_LOW_WATERMARK", 1)
+QUESTION_POOL_WORKERS = env_int("QUESTION_POOL_WORKERS", 1)
+
+def _build_generation_messages(test_type: str, variant: int = None, shard: Shard = None) -> list:
+    """构造生成题目的消息，variant 用于批量生成时区分每一套题，shard 限定题目数量和覆盖的维度"""
+    count = shard.count if shard else 30
+    if shard:
+        coverage = f"只覆盖{test_type.upper()}测试的以下维度：{shard.scope}，各维度题目数量大致相同"
+    else:
+        coverage = f"确保问题覆盖{test_type.upper()}测试的所有维度"
+    prompt = f"""请生成{count}个全新的、独特的{test_type.upper()}测试题目，要求：
 1. 每个问题都要有独特的视角和内容
 2. 避免使用常见或重复的表述
-3. 确保问题覆盖{test_type.upper()}测试的所有维度
+3. {coverage}
 4. 使用多样化的场景和情境
 
 请严格按照以下格式生成，直接返回JSON数组：
@@ -79,221 +146,506 @@ def get_test_questions(test_type):
 
 要求：
 1. 只返回JSON数组，不要包含其他文字
-2. 确保生成30个不同的题目
+2. 确保生成{count}个不同的题目
 3. 格式必须与示例完全一致
-4. {TEST_PROMPTS[test_type]}
+4. {TEST_PROMPTS[test_type].replace('30个', f'{count}个')}
 
 注意：每次生成的题目都应该是独特的，不要重复之前的内容。"""
     
     # 添加随机性提示
-    messages = [
+    system_content = f"你是一个专业的{test_type.upper()}测试题目生成器。每次都要生成独特的、富有创意的题目，避免重复和套路化。当前时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    if variant is not None:
+        system_content += f" 题套编号: {variant}"
+    return [
         {
             "role": "system", 
-            "content": f"你是一个专业的{test_type.upper()}测试题目生成器。每次都要生成独特的、富有创意的题目，避免重复和套路化。当前时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+            "content": system_content
         },
         {
             "role": "user", 
             "content": prompt
         }
     ]
+
+def _bank_payload(entry):
+    """题库接口返回的数据"""
+    return {
+        'test_type': entry.test_type,
+        'total': len(entry.questions),
+        'questions': entry.questions,
+        'file_id': entry.file_id  # 添加加密后的文件名
+    }
+
+def generate_bank(test_type: str):
+    """
+    调用模型生成一套题目并校验
     
-    response = client.get_completion(messages)
+    按 GENERATION_SHARDS 并发生成各分片，合并时去掉相似题目并重新编号，只重试失败的分片；
+    去重后题目不足时补充生成不足的分片。
     
-    # 保存响应到题库文件
-    save_deepseek_response(test_type, response)
+    @param test_type: 测试类型
+    @return: (原始题目列表, 各分片模型原始响应)
+    @raise ValueError: 分片重试后仍失败，或补充生成后题目仍不足
+    """
+    client = create_llm_client('deepseek')
+    
+    def run_batch(batch):
+        # 每次都要生成新题目，不使用响应缓存
+        return client.get_completions(batch, len(batch), use_cache=False)
     
+    raw_questions, response = generate_sharded(
+        test_type,
+        GENERATION_SHARDS[test_type],
+        lambda t, shard: _build_generation_messages(t, shard=shard),
+        run_batch,
+        retries=QUESTION_SHARD_RETRIES,
+        threshold=QUESTION_DEDUPE_THRESHOLD,
+        min_questions=QUESTION_BANK_MIN_QUESTIONS,
+    )
+    validate_bank(test_type, raw_questions, QUESTION_BANK_MIN_QUESTIONS)
+    return raw_questions, response
+
+# 预生成题库池，由 generate_bank 补充
+bank_pool = QuestionBankPool(
+    question_bank_store,
+    question_bank_index,
+    generate_bank,
+    list(TEST_PROMPTS),
+    target=QUESTION_POOL_SIZE,
+    low_watermark=QUESTION_POOL_LOW_WATERMARK,
+    workers=QUESTION_POOL_WORKERS,
+)
+
+def warm_bank_pool():
+    """补充所有类型的题库池并等待完成（gunicorn 主进程启动时在独立进程中调用，见 gunicorn.conf.py）"""
+    bank_pool.warm(wait=True)
+
+def get_test_questions(test_type):
+    """生成测试题目"""
     try:
-        # 提取JSON
-        start = response.find('[')
-        end = response.rfind(']') + 1
-        if start >= 0 and end > start:
-            json_str = response[start:end]
-            raw_questions = json.loads(json_str)
-            
-            # 转换为对应的数据结构
-            if test_type == 'mbti':
-                questions = TestGenerator.format_mbti_questions(raw_questions)
-            else:
-                questions = TestGenerator.format_other_questions(raw_questions)
-            
-            return {
-                'test_type': test_type,
-                'total': len(questions),
-                'questions': [q.__dict__ for q in questions]
-            }
-            
-        raise ValueError("无法在响应中找到有效的JSON数组")
-        
-    except Exception as e:
+        raw_questions, response = generate_bank(test_type)
+    except ValueError as e:
         logger.error(f"处理题目时出错: {str(e)}")
-        logger.error(f"原始响应: {response}")
         raise ValueError("生成题目失败，请重试")
+    
+    file_id = save_deepseek_response(test_type, response, questions=raw_questions)
+    entry = question_bank_index.get(test_type, file_id)
+    if entry is None:
+        logger.error(f"处理题目时出错，原始响应: {response}")
+        raise ValueError("生成题目失败，请重试")
+    return _bank_payload(entry)
 
-def get_test_from_bank(test_type: str):
+def get_pooled_test_questions(test_type: str):
     """
-    从题库中读取测试题目
+    获取一套新题目，优先从预生成题库池领取，池为空时同步生成
     
-    @param test_type: 测试类型 (mbti/career/enneagram)
-    @return: 最新的测试题目
+    @param test_type: 测试类型
+    @return: 题目数据（含 file_id）
     """
-    # 获取题库目录
-    question_bank_dir = os.path.join(SCRIPT_DIR_QUESTION_BANK, test_type)
-    print(question_bank_dir)
-    logger.info(question_bank_dir)
-    if not os.path.exists(question_bank_dir):
-        raise ValueError(f"题库 {test_type} 不存在")
-    
-    # 获取最新的题库文件
-    files = os.listdir(question_bank_dir)
-    if not files:
-        raise ValueError(f"题库 {test_type} 中没有题目")
+    if test_type not in TEST_PROMPTS:
+        raise ValueError(f"不支持的测试类型: {test_type}")
+    entry = bank_pool.claim(test_type)
+    if entry is not None:
+        return _bank_payload(entry)
+    logger.info(f"{test_type} 题库池为空，同步生成题目")
+    return get_test_questions(test_type)
+
+def stream_test_questions(test_type: str):
+    """
+    流式获取一套新题目，每解析出一道合法题目就返回，前端不必等整套题生成完
+    
+    优先从预生成题库池领取（整套立即返回）；池为空时流式调用模型，逐个解析题目对象并校验，
+    生成结束后保存到题库。
     
-    # 按文件名排序（因为包含时间戳）
-    files.sort(reverse=True)
-    latest_file = os.path.join(question_bank_dir, files[0])
+    @param test_type: 测试类型
+    @return: (事件, 数据) 迭代器：question 为一道格式化后的题目，done 为 {test_type, total, file_id}
+    @raise ValueError: 不支持的测试类型（开始返回之前抛出）；迭代中合法题目不足时也抛出 ValueError
+    """
+    if test_type not in TEST_PROMPTS:
+        raise ValueError(f"不支持的测试类型: {test_type}")
     
-    # 计算文件名的MD5值
-    filename_md5 = hashlib.md5(files[0].encode('utf-8')).hexdigest()
+    entry = bank_pool.claim(test_type)
+    if entry is not None:
+        def pooled():
+            for question in entry.questions:
+                yield 'question', question
+            yield 'done', {'test_type': test_type, 'total': len(entry.questions), 'file_id': entry.file_id}
+        return pooled()
     
-    # 读取文件内容
-    with open(latest_file, 'r', encoding='utf-8') as f:
-        content = f.read()
+    logger.info(f"{test_type} 题库池为空，流式生成题目")
+    client = create_llm_client('deepseek')
+    messages = _build_generation_messages(test_type)
     
-    # 提取JSON部分
-    try:
-        # 查找格式化的JSON部分（在"# 格式化的 JSON:"之后）
-        formatted_json_marker = "# 格式化的 JSON:\n"
-        json_start = content.find(formatted_json_marker)
-        
-        if json_start >= 0:
-            # 使用格式化的JSON部分
-            json_content = content[json_start + len(formatted_json_marker):]
-            raw_questions = json.loads(json_content)
-        else:
-            # 回退到查找第一个JSON数组
-            start = content.find('[')
-            end = content.rfind(']') + 1
-            if start >= 0 and end > start:
-                json_str = content[start:end]
-                raw_questions = json.loads(json_str)
-            else:
-                raise ValueError("无法在文件中找到有效的JSON")
-        
-        # 转换为对应的数据结构
-        if test_type == 'mbti':
-            questions = TestGenerator.format_mbti_questions(raw_questions)
-        else:
-            questions = TestGenerator.format_other_questions(raw_questions)
+    def generate():
+        parser = QuestionStreamParser()
+        raw_questions, chunks = [], []
+        for delta in client.stream_completion(messages):
+            chunks.append(delta)
+            for question in parser.feed(delta):
+                # 按返回顺序编号，模型给出的编号可能重复或不连续
+                question = dict(question, id=len(raw_questions) + 1)
+                try:
+                    validate_bank(test_type, [question])
+                except ValueError as e:
+                    logger.warning(f"跳过不合法的题目: {str(e)}")
+                    continue
+                raw_questions.append(question)
+                yield 'question', format_questions(test_type, [question])[0]
         
-        return {
-            'test_type': test_type,
-            'total': len(questions),
-            'questions': [q.__dict__ for q in questions],
-            'file_id': filename_md5  # 添加加密后的文件名
-        }
-        
-    except Exception as e:
-        logger.error(f"处理题目时出错: {str(e)}")
-        logger.error(f"文件路径: {latest_file}")
-        logger.error(f"文件内容: {content}")
-        raise ValueError(f"读取题库失败: {str(e)}")
+        response = "".join(chunks)
+        if len(raw_questions) < QUESTION_BANK_MIN_QUESTIONS:
+            logger.error(f"流式生成的合法题目不足: {len(raw_questions)}，原始响应: {response}")
+            raise ValueError("生成题目失败，请重试")
+        file_id = save_deepseek_response(test_type, response, questions=raw_questions)
+        yield 'done', {'test_type': test_type, 'total': len(raw_questions), 'file_id': file_id}
+    
+    return generate()
 
-def analyze_test_result(test_type: str, file_id: str, answers: list):
+def regenerate_question_banks(test_type: str, count: int, max_concurrency: int = None) -> dict:
     """
-    分析测试结果
-    
-    @param test_type: 测试类型 (mbti/career/enneagram)
-    @param file_id: 文件MD5值
-    @param answers: 答案列表
-    @return: 分析结果
+    离线批量生成题库
+
+    并发调用模型生成 count 套题目并写入题库目录，单套失败不影响其他题套。
+
+    @param test_type: 测试类型
+    @param count: 生成的题套数量
+    @param max_concurrency: 最大并发数，默认 LLM_BATCH_CONCURRENCY
+    @return: 批量调用统计，saved 为成功写入的题套数
     """
-    # 获取题库目录
-    question_bank_dir = os.path.join("question_bank", test_type)
-    if not os.path.exists(question_bank_dir):
-        raise ValueError(f"题库 {test_type} 不存在")
-    
-    # 查找对应的文件
-    target_file = None
-    for filename in os.listdir(question_bank_dir):
-        if hashlib.md5(filename.encode('utf-8')).hexdigest() == file_id:
-            target_file = os.path.join(question_bank_dir, filename)
-            break
-    
-    if not target_file:
-        raise ValueError(f"找不到对应的题目文件")
+    if test_type not in TEST_PROMPTS:
+        raise ValueError(f"不支持的测试类型: {test_type}")
     
-    # 读取题目文件
-    with open(target_file, 'r', encoding='utf-8') as f:
-        content = f.read()
+    client = create_llm_client('deepseek')
+    batch = [_build_generation_messages(test_type, variant=i + 1) for i in range(count)]
+    result = client.get_completions(batch, max_concurrency, use_cache=False)
     
-    # 提取题目
-    formatted_json_marker = "# 格式化的 JSON:\n"
-    json_start = content.find(formatted_json_marker)
+    saved = 0
+    for item in result.items:
+        if item.ok and item.content:
+            save_deepseek_response(test_type, item.content, suffix=str(item.index + 1))
+            saved += 1
     
-    if json_start >= 0:
-        json_content = content[json_start + len(formatted_json_marker):]
-        questions = json.loads(json_content)
-    else:
-        start = content.find('[')
-        end = content.rfind(']') + 1
-        if start >= 0 and end > start:
-            questions = json.loads(content[start:end])
-        else:
-            raise ValueError("无法解析题目文件")
+    summary = result.summary()
+    summary['saved'] = saved
+    logger.info(f"{test_type} 题库批量生成完成: {summary}")
+    return summary
+
+def get_test_from_bank(test_type: str):
+    """
+    从题库中读取测试题目
+    
+    @param test_type: 测试类型 (mbti/career/enneagram)
+    @return: 最新的测试题目
+    """
+    entry = question_bank_index.latest(test_type)
+    if entry is None:
+        raise ValueError(f"题库 {test_type} 中没有题目")
+    return _bank_payload(entry)
+
+def render_test_from_bank(test_type: str) -> dict:
+    """
+    最新题库的 /api/test 响应，每个题库版本只渲染和压缩一次
     
+    @param test_type: 测试类型 (mbti/career/enneagram)
+    @return: {'etag': 强 ETag（即 file_id）, 'body': JSON 字节, 'gzip': gzip 压缩后的字节（未启用时为 None）}
+    @raise ValueError: 题库中没有题目
+    """
+    entry = question_bank_index.latest(test_type)
+    if entry is None:
+        raise ValueError(f"题库 {test_type} 中没有题目")
+    rendered = entry.rendered.get('test')
+    if rendered is None:
+        body = json.dumps(
+            {'success': True, 'code': 200, 'data': _bank_payload(entry)},
+            ensure_ascii=False, separators=(',', ':')
+        ).encode('utf-8')
+        rendered = {
+            'etag': entry.file_id,
+            'body': body,
+            'gzip': gzip.compress(body, compresslevel=QUESTION_BANK_GZIP_LEVEL) if QUESTION_BANK_GZIP_LEVEL else None
+        }
+        # 并发渲染时结果相同，后写入的覆盖即可
+        entry.rendered['test'] = rendered
+    return rendered
+
+def _analysis_key(test_type: str, file_id: str, profile: str) -> str:
+    """分析缓存键：得分画像相同的答卷共用一份分析"""
+    return hashlib.sha256(f"{test_type}|{file_id}|{profile}".encode('utf-8')).hexdigest()
+
+def _compute_analysis(entry, answers):
+    """调用模型生成一份答卷的分析"""
     # 构建分析提示词
-    if test_type == 'mbti':
-        analysis_prompt = construct_mbti_analysis(questions, answers)
-    elif test_type == 'career':
-        analysis_prompt = construct_career_analysis(questions, answers)
+    if entry.test_type == 'mbti':
+        analysis_prompt = construct_mbti_analysis(entry.scoring, answers)
+    elif entry.test_type == 'career':
+        analysis_prompt = construct_career_analysis(entry.scoring, answers)
     else:  # enneagram
-        analysis_prompt = construct_enneagram_analysis(questions, answers)
+        analysis_prompt = construct_enneagram_analysis(entry.scoring, answers)
     
-    # 调用DeepSeek进行分析
+    # 调用DeepSeek进行分析（提示词包含逐题记录，不走响应缓存）
     client = create_llm_client('deepseek')
-    print(type(client))
-    response = client.get_completion([
+    return client.get_completion([
         {
             "role": "system",
-            "content": f"你是一个专业的{test_type.upper()}测试分析师，请根据用户的答案提供专业、详细的分析。"
+            "content": f"你是一个专业的{entry.test_type.upper()}测试分析师，请根据用户的答案提供专业、详细的分析。"
         },
         {
             "role": "user",
             "content": analysis_prompt
         }
-    ])
+    ], use_cache=False)
+
+def score_summary(test_type: str, result) -> dict:
+    """
+    本地计分得出的类型和各维度得分
+    
+    @param test_type: 测试类型
+    @param result: ScoreResult
+    @return: {'type': MBTI 类型 / 得分最高的职业类型或九型人格类型, 'scores': 各维度得分}
+    """
+    if test_type == 'mbti':
+        return {'type': scoring_mbti_type(result), 'scores': result.scores()}
+    if test_type == 'career':
+        return {'type': top_dimension(result), 'scores': result.answered_scores()}
+    return {'type': top_dimension(result), 'scores': result.scores()}
+
+def analyze_test_result(test_type: str, file_id: str, answers: list):
+    """
+    分析测试结果
+    
+    @param test_type: 测试类型 (mbti/career/enneagram)
+    @param file_id: 文件MD5值
+    @param answers: 答案列表
+    @return: 分析结果
+    """
+    entry = question_bank_index.get(test_type, file_id)
+    if entry is None:
+        raise ValueError(f"找不到对应的题目文件")
+    
+    # 得分画像相同的答卷共用一份分析
+    profile = score_profile(test_type, entry.scoring.score(answers), ANALYSIS_MARGIN_STEP, ANALYSIS_TOP_N)
+    key = _analysis_key(test_type, file_id, profile)
+    response = cached_call(key, lambda: _compute_analysis(entry, answers), cache=analysis_cache)
     
     return {
         'test_type': test_type,
         'file_id': file_id,
+        'profile': profile,
         'analysis': response
     }
 
-def construct_mbti_analysis(questions, answers):
+def _analysis_lease_key(key: str) -> str:
+    # 与 cached_call 内部跨 worker 合并使用的键区分开
+    return f"analysis:{key}"
+
+def _analysis_in_flight(key: str) -> bool:
+    """本进程或其他 worker 是否正在生成该分析"""
+    with _scheduled_lock:
+        if key in _scheduled_analyses:
+            return True
+    try:
+        return analysis_leases.held(_analysis_lease_key(key))
+    except sqlite3.Error as e:
+        logger.warning(f"查询分析生成租约失败: {str(e)}")
+        return False
+
+def _schedule_analysis(entry, profile: str, answers) -> str:
+    """
+    在后台为一个得分画像生成分析
+    
+    提交前先获取 SQLite 租约：其他 worker 正在生成时不重复提交，只有没有存活的租约时才提交。
+    
+    @return: ready（已缓存）、pending（生成中）或 failed（最近生成失败，稍后重试）
+    """
+    key = _analysis_key(entry.test_type, entry.file_id, profile)
+    if analysis_cache.get(key) is not None:
+        return 'ready'
+    if analysis_failures.get(key) is not None:
+        return 'failed'
+    lease_key = _analysis_lease_key(key)
+    with _scheduled_lock:
+        if key in _scheduled_analyses:
+            return 'pending'
+        try:
+            owner = analysis_leases.acquire(lease_key)
+            if owner is None:
+                return 'pending'
+        except sqlite3.Error as e:
+            logger.warning(f"获取分析生成租约失败，只在本进程内去重: {str(e)}")
+            owner = None
+        _scheduled_analyses.add(key)
+    
+    def run():
+        try:
+            cached_call(key, lambda: _compute_analysis(entry, answers), cache=analysis_cache)
+            analysis_failures.delete(key)
+        except Exception as e:
+            logger.error(f"后台生成 {entry.test_type} 分析失败: {str(e)}")
+            analysis_failures.set(key, str(e) or type(e).__name__)
+        finally:
+            with _scheduled_lock:
+                _scheduled_analyses.discard(key)
+            if owner is not None:
+                try:
+                    analysis_leases.release(lease_key, owner)
+                except sqlite3.Error as e:
+                    logger.warning(f"释放分析生成租约失败: {str(e)}")
+    
+    analysis_executor.submit(run)
+    return 'pending'
+
+def submit_test_result(test_type: str, file_id: str, answers: list):
+    """
+    两阶段提交测试答案：立即返回本地计分结果，分析在后台生成
+    
+    @param test_type: 测试类型 (mbti/career/enneagram)
+    @param file_id: 文件MD5值
+    @param answers: 答案列表
+    @return: 结果数据，含 result_id、类型、各维度得分和分析状态；分析已缓存时直接带上分析
+    @raise ValueError: 题库不存在或答案无效
+    """
+    entry = question_bank_index.get(test_type, file_id)
+    if entry is None:
+        raise ValueError(f"找不到对应的题目文件")
+    
+    result = entry.scoring.score(answers)
+    record = {
+        'result_id': uuid.uuid4().hex,
+        'test_type': test_type,
+        'file_id': file_id,
+        'profile': score_profile(test_type, result, ANALYSIS_MARGIN_STEP, ANALYSIS_TOP_N),
+        **score_summary(test_type, result),
+        'answers': answers,
+        'created_at': time.time()
+    }
+    test_results.set(record['result_id'], json.dumps(record, ensure_ascii=False))
+    status = _schedule_analysis(entry, record['profile'], answers)
+    return _result_payload(record, status)
+
+def get_test_result(result_id: str):
+    """
+    查询两阶段提交的测试结果
+    
+    分析未缓存且没有任何 worker 持有生成租约（如负责生成的进程已重启且租约到期）时才重新提交生成。
+    
+    @param result_id: submit_test_result 返回的 result_id
+    @return: 结果数据，status 为 pending / ready / failed；result_id 不存在或已过期时返回 None
+    """
+    raw = test_results.get(result_id)
+    if raw is None:
+        return None
+    record = json.loads(raw)
+    status, analysis = get_profile_analysis(record['test_type'], record['file_id'], record['profile'])
+    if status == 'missing':
+        entry = question_bank_index.get(record['test_type'], record['file_id'])
+        status = _schedule_analysis(entry, record['profile'], record['answers']) if entry else 'failed'
+    return _result_payload(record, status, analysis)
+
+def _result_payload(record: dict, status: str, analysis: str = None) -> dict:
+    """测试结果接口返回的数据（不含答卷）"""
+    if status == 'ready' and analysis is None:
+        analysis = analysis_cache.get(_analysis_key(record['test_type'], record['file_id'], record['profile']))
+    return {
+        'result_id': record['result_id'],
+        'test_type': record['test_type'],
+        'file_id': record['file_id'],
+        'type': record['type'],
+        'scores': record['scores'],
+        'profile': record['profile'],
+        'status': status,
+        'analysis': analysis
+    }
+
+def score_answer_sheets(test_type: str, file_id: str, sheets, with_analysis: bool = False):
+    """
+    批量计分多份答卷（如团体测评）
+    
+    按 BULK_SCORE_CHUNK 份一组向量化计分，逐份返回结果，内存占用与答卷总数无关。
+    with_analysis 为真时，每个不同的得分画像只在后台生成一次分析，可通过 get_profile_analysis 获取。
+    
+    @param test_type: 测试类型
+    @param file_id: 题库 file_id
+    @param sheets: 答卷迭代器，每份为 {'id': 答卷编号（可选）, 'answers': [...]}，无法解析的答卷为 None
+    @param with_analysis: 是否在后台生成分析
+    @return: 结果迭代器，每份为 {'id', 'type', 'scores', 'profile'[, 'analysis']} 或 {'id', 'error'}
+    @raise ValueError: 题库不存在（开始迭代之前抛出）
+    """
+    entry = question_bank_index.get(test_type, file_id)
+    if entry is None:
+        raise ValueError(f"找不到对应的题目文件")
+    
+    def sheet_answers(sheet):
+        answers = sheet.get('answers') if isinstance(sheet, dict) else None
+        return answers if isinstance(answers, list) and answers else None
+    
+    def generate():
+        index = 0
+        for chunk in _chunked(sheets, BULK_SCORE_CHUNK):
+            answer_lists = [sheet_answers(sheet) for sheet in chunk]
+            results = entry.scoring.score_batch([answers or [] for answers in answer_lists])
+            for sheet, answers, result in zip(chunk, answer_lists, results):
+                sheet_id = sheet.get('id', index) if isinstance(sheet, dict) else index
+                index += 1
+                if answers is None or result is None:
+                    yield {'id': sheet_id, 'error': '答卷无效'}
+                    continue
+                item = {'id': sheet_id, **score_summary(test_type, result)}
+                item['profile'] = score_profile(test_type, result, ANALYSIS_MARGIN_STEP, ANALYSIS_TOP_N)
+                if with_analysis:
+                    item['analysis'] = _schedule_analysis(entry, item['profile'], answers)
+                yield item
+    
+    return generate()
+
+def get_profile_analysis(test_type: str, file_id: str, profile: str):
+    """
+    获取一个得分画像的分析
+    
+    @return: (状态, 分析)：ready 时为分析内容，pending 表示正在后台生成，failed 表示最近生成失败，missing 表示未生成
+    """
+    key = _analysis_key(test_type, file_id, profile)
+    analysis = analysis_cache.get(key)
+    if analysis is not None:
+        return 'ready', analysis
+    if _analysis_in_flight(key):
+        return 'pending', None
+    if analysis_failures.get(key) is not None:
+        return 'failed', None
+    return 'missing', None
+
+def _chunked(iterable, size: int):
+    """按 size 个一组切分迭代器"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, max(1, size)))
+        if not chunk:
+            return
+        yield chunk
+
+def _answer_details(table: ScoringTable, result):
+    """李克特量表题的答题记录"""
+    details = []
+    for row, option in zip(result.rows, result.options):
+        question = table.questions[row]
+        details.append(
+            f"问题{question['id']}: {question['content']}\n"
+            f"选择: {table.options[option]}（{table.option_points[option]}分）"
+        )
+    return details
+
+def construct_mbti_analysis(table: ScoringTable, answers):
     """构建MBTI分析提示词"""
     # 统计各维度得分
-    dimensions = {'E': 0, 'I': 0, 'S': 0, 'N': 0, 'T': 0, 'F': 0, 'J': 0, 'P': 0}
+    result = table.score(answers)
+    dimensions = result.scores()
     
     answer_details = []
-    for answer in answers:
-        q_id = answer['questionId']
-        q_answer = answer['answer']
-        question = next(q for q in questions if q['id'] == q_id)
-        
-        if q_answer == 'A':
-            dimensions[question['dimension_a']] += 1
-            selected_option = question['option_a']
-        else:
-            dimensions[question['dimension_b']] += 1
-            selected_option = question['option_b']
-            
-        answer_details.append(f"问题{q_id}: {question['content']}\n选择: {selected_option}")
-    
-    mbti_type = ''
-    mbti_type += 'E' if dimensions['E'] > dimensions['I'] else 'I'
-    mbti_type += 'S' if dimensions['S'] > dimensions['N'] else 'N'
-    mbti_type += 'T' if dimensions['T'] > dimensions['F'] else 'F'
-    mbti_type += 'J' if dimensions['J'] > dimensions['P'] else 'P'
+    for row, option in zip(result.rows, result.options):
+        question = table.questions[row]
+        selected_option = question['option_a'] if option == 0 else question['option_b']
+        answer_details.append(f"问题{question['id']}: {question['content']}\n选择: {selected_option}")
+    
+    mbti_type = scoring_mbti_type(result)
     
     return f"""请分析以下MBTI测试结果：
 
@@ -315,25 +667,12 @@ J/P: J({dimensions['J']}) - P({dimensions['P']})
 4. 人际关系建议
 5. 个人成长建议"""
 
-def construct_career_analysis(questions, answers):
+def construct_career_analysis(table: ScoringTable, answers):
     """构建职业倾向分析提示词"""
-    answer_details = []
-    career_types = {}
-    
-    for answer in answers:
-        q_id = answer['questionId']
-        q_answer = answer['answer']
-        question = next(q for q in questions if q['id'] == q_id)
-        
-        # 计算分数（A=1, B=2, C=3, D=4, E=5）
-        score = ord(q_answer) - ord('A') + 1
-        
-        # 统计职业类型
-        categories = question['category'].split(',')
-        for category in categories:
-            career_types[category] = career_types.get(category, 0) + score
-            
-        answer_details.append(f"问题{q_id}: {question['content']}\n选择: {q_answer}（{score}分）")
+    # 计算分数（A=1, B=2, C=3, D=4, E=5），每题的分数计入其所有职业类型
+    result = table.score(answers)
+    career_types = result.answered_scores()
+    answer_details = _answer_details(table, result)
     
     return f"""请分析以下职业倾向测试结果：
 
@@ -350,24 +689,15 @@ def construct_career_analysis(questions, answers):
 4. 需要提升的能力
 5. 职业规划建议"""
 
-def construct_enneagram_analysis(questions, answers):
+def construct_enneagram_analysis(table: ScoringTable, answers):
     """构建九型人格分析提示词"""
-    type_scores = {str(i): 0 for i in range(1, 10)}
-    answer_details = []
-    
-    for answer in answers:
-        q_id = answer['questionId']
-        q_answer = answer['answer']
-        question = next(q for q in questions if q['id'] == q_id)
-        
-        # 计算分数（A=5, B=4, C=3, D=2, E=1）
-        score = 5 - (ord(q_answer) - ord('A'))
-        type_scores[question['category']] += score
-        
-        answer_details.append(f"问题{q_id}: {question['content']}\n选择: {q_answer}（{score}分）")
+    # 计算分数（A=5, B=4, C=3, D=2, E=1）
+    result = table.score(answers)
+    type_scores = result.scores()
+    answer_details = _answer_details(table, result)
     
     # 找出得分最高的类型
-    main_type = max(type_scores.items(), key=lambda x: x[1])[0]
+    main_type = top_dimension(result)
     
     return f"""请分析以下九型人格测试结果：
 
@@ -384,4 +714,4 @@ def construct_enneagram_analysis(questions, answers):
 2. 核心特质和行为模式
 3. 个人成长方向
 4. 人际关系建议
-5. 压力管理建议""" 
\ No newline at end of file
+5. 压力管理建议""" 
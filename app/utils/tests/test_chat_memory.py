@@ -0,0 +1,119 @@
+from types import SimpleNamespace
+
+from app.utils import chat_memory
+from app.utils.chat_memory import ChatMemory, SessionMemoryStore
+from app.utils.llm_tokens import count_tokens
+
+
+class SyncExecutor:
+    def submit(self, fn):
+        fn()
+
+
+def _turn(i):
+    return f"问题 {i}: " + "请介绍一下退款流程" * 3, f"回答 {i}: " + "七天内可以申请退款" * 3
+
+
+def _formatted(turns):
+    return "".join(f"用户: {q}\n助手: {a}\n\n" for q, a in turns)
+
+
+def _save(memory, turns):
+    for question, answer in turns:
+        memory.save_context({"input": question}, {"output": answer})
+
+
+def test_keeps_everything_within_budget():
+    turns = [_turn(i) for i in range(3)]
+    memory = ChatMemory(max_tokens=10_000)
+    _save(memory, turns)
+    assert memory.load_memory_variables({})["chat_history"] == _formatted(turns)
+    assert memory.tokens == sum(count_tokens(_formatted([t])) for t in turns)
+    assert len(memory.chat_history) == 6
+
+
+def test_evicts_oldest_turns_over_budget():
+    turns = [_turn(i) for i in range(10)]
+    per_turn = count_tokens(_formatted(turns[:1]))
+    memory = ChatMemory(max_tokens=per_turn * 3 + 1)
+    _save(memory, turns)
+    history = memory.load_memory_variables({})["chat_history"]
+    kept = [t for t in turns if f"用户: {t[0]}\n" in history]
+    assert kept == turns[-len(kept):]
+    assert 1 <= len(kept) <= 3
+    assert history == _formatted(kept)
+    assert memory.tokens == per_turn * len(kept)
+    assert [m.content for m in memory.chat_history] == [text for turn in kept for text in turn]
+
+
+def test_token_count_matches_window():
+    memory = ChatMemory(max_tokens=200)
+    turns = [_turn(i) for i in range(20)]
+    _save(memory, turns)
+    history = memory.load_memory_variables({})["chat_history"]
+    kept = [t for t in turns if f"用户: {t[0]}\n" in history]
+    assert memory.tokens == sum(count_tokens(_formatted([t])) for t in kept)
+    assert memory.tokens <= 200
+
+
+def test_always_keeps_latest_turn():
+    memory = ChatMemory(max_tokens=1)
+    turns = [_turn(i) for i in range(3)]
+    _save(memory, turns)
+    assert memory.load_memory_variables({})["chat_history"] == _formatted(turns[-1:])
+    assert memory.tokens > memory.max_tokens
+
+
+def test_evicted_turns_go_to_summary():
+    calls = []
+
+    def summarizer(summary, evicted):
+        calls.append((summary, evicted))
+        return summary + f"[{evicted.count('用户: ')}]"
+
+    turns = [_turn(i) for i in range(4)]
+    memory = ChatMemory(max_tokens=1, summarizer=summarizer, executor=SyncExecutor())
+    _save(memory, turns)
+    assert [evicted for _, evicted in calls] == [_formatted([t]) for t in turns[:3]]
+    assert memory.summary == "[1][1][1]"
+    assert memory.load_memory_variables({})["chat_history"] == (
+        "之前的对话摘要: [1][1][1]\n\n" + _formatted(turns[-1:])
+    )
+
+
+def test_summarizer_failure_keeps_previous_summary():
+    def summarizer(summary, evicted):
+        raise RuntimeError("down")
+
+    memory = ChatMemory(max_tokens=1, summarizer=summarizer, executor=SyncExecutor(), summary="旧摘要")
+    _save(memory, [_turn(0), _turn(1)])
+    assert memory.summary == "旧摘要"
+
+
+def test_clear():
+    memory = ChatMemory(max_tokens=1, summary="摘要")
+    _save(memory, [_turn(0), _turn(1)])
+    memory.clear()
+    assert memory.load_memory_variables({})["chat_history"] == ""
+    assert memory.tokens == 0 and memory.chat_history == []
+
+
+def test_store_isolates_sessions_and_evicts_lru():
+    store = SessionMemoryStore(max_sessions=2, max_tokens=500)
+    store.get("a").save_context({"input": "a"}, {"output": "1"})
+    store.get("b")
+    store.get("a")
+    store.get("c")
+    assert "用户: a" in store.get("a").load_memory_variables({})["chat_history"]
+    assert store.get("b").tokens == 0
+    assert store.stats()["evicted"] >= 1
+
+
+def test_store_expires_idle_sessions(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(chat_memory, "time", SimpleNamespace(time=lambda: now[0]))
+    store = SessionMemoryStore(idle_seconds=60)
+    store.get("a").save_context({"input": "a"}, {"output": "1"})
+    now[0] += 61
+    assert store.get("a").tokens == 0
+    assert store.stats()["expired"] == 1
@@ -0,0 +1,75 @@
+import pytest
+
+from app.utils.knowledge_index import chunk_documents
+
+FAQ = """欢迎使用客服知识库。
+
+# 退款政策
+购买后七天内可以申请退款。
+退款会在三个工作日内原路返回。
+
+# 会员权益
+会员可以享受免费配送。
+
+#不是标题
+# 联系方式
+客服电话 400-000-0000。
+"""
+
+
+@pytest.fixture
+def kb(tmp_path):
+    def write(name, text):
+        path = tmp_path / name
+        path.write_text(text, encoding='utf-8')
+        return str(path)
+    return write
+
+
+def test_splits_by_section(kb):
+    docs = chunk_documents([kb('faq.txt', FAQ)], chunk_size=800)
+    assert [d.metadata['section'] for d in docs] == ['', '退款政策', '会员权益', '联系方式']
+    assert docs[0].page_content == '欢迎使用客服知识库。'
+    assert docs[1].page_content.startswith('# 退款政策\n购买后七天内')
+    assert '#不是标题' in docs[2].page_content
+    assert all(d.metadata['source'] == 'faq.txt' for d in docs)
+
+
+def test_long_section_is_split_with_title_on_continuations(kb):
+    body = '\n'.join(f'第{i}条：' + '内容' * 20 + '。' for i in range(30))
+    docs = chunk_documents([kb('long.txt', '# 长章节\n' + body)], chunk_size=200, chunk_overlap=40)
+    assert len(docs) > 1
+    assert docs[0].page_content.startswith('# 长章节\n')
+    for doc in docs[1:]:
+        assert doc.page_content.startswith('# 长章节\n')
+        assert len(doc.page_content) <= 200 + len('# 长章节\n')
+    assert all(d.metadata['section'] == '长章节' for d in docs)
+
+
+def test_chunk_ids_are_stable_and_local(kb):
+    path = kb('faq.txt', FAQ)
+    before = chunk_documents([path])
+    assert [d.metadata['chunk_id'] for d in chunk_documents([path])] == [d.metadata['chunk_id'] for d in before]
+
+    kb('faq.txt', FAQ.replace('免费配送', '免费配送和专属客服'))
+    after = chunk_documents([path])
+    changed = [b.metadata['section'] for b, a in zip(before, after) if b.metadata['chunk_id'] != a.metadata['chunk_id']]
+    assert changed == ['会员权益']
+
+
+def test_chunk_ids_depend_on_source(kb):
+    first = chunk_documents([kb('a.txt', FAQ)])
+    second = chunk_documents([kb('b.txt', FAQ)])
+    assert not {d.metadata['chunk_id'] for d in first} & {d.metadata['chunk_id'] for d in second}
+
+
+def test_duplicate_chunks_get_distinct_ids(kb):
+    text = '# 重复\n同样的内容。\n\n# 重复\n同样的内容。\n'
+    docs = chunk_documents([kb('dup.txt', text)])
+    ids = [d.metadata['chunk_id'] for d in docs]
+    assert len(docs) == 2
+    assert ids[1] == f'{ids[0]}-2'
+
+
+def test_blank_file_has_no_chunks(kb):
+    assert chunk_documents([kb('blank.txt', '\n\n')]) == []
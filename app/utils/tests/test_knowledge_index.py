@@ -0,0 +1,85 @@
+import hashlib
+import os
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.utils.knowledge_index import chunk_documents, load_or_build_index
+
+FAQ = """# 退款政策
+购买后七天内可以申请退款。
+
+# 会员权益
+会员可以享受免费配送。
+"""
+
+
+class CountingEmbeddings(Embeddings):
+    """按文本哈希生成向量，并记录每次向量化的文本"""
+
+    def __init__(self):
+        self.calls = []
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        return [b / 255.0 + 0.01 for b in digest[:8]]
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+def _chunk_ids(path):
+    return {doc.metadata['section']: doc.metadata['chunk_id'] for doc in chunk_documents([path])}
+
+
+def test_incremental_update_reembeds_only_changed_chunk(tmp_path):
+    path = tmp_path / "faq.txt"
+    path.write_text(FAQ, encoding='utf-8')
+    index_dir = str(tmp_path / "index")
+    embeddings = CountingEmbeddings()
+
+    index = load_or_build_index([str(path)], embeddings, "fake-model", index_dir=index_dir)
+    assert sum(len(texts) for texts in embeddings.calls) == 2
+    before = _chunk_ids(str(path))
+
+    path.write_text(FAQ.replace("免费配送", "免费配送和专属客服"), encoding='utf-8')
+    after = _chunk_ids(str(path))
+    embeddings.calls.clear()
+    index = load_or_build_index([str(path)], embeddings, "fake-model", index_dir=index_dir)
+
+    assert embeddings.calls == [["# 会员权益\n会员可以享受免费配送和专属客服。"]]
+    assert before['退款政策'] == after['退款政策']
+    assert set(index.index_to_docstore_id.values()) == set(after.values())
+    assert index.index.ntotal == 2
+    assert not isinstance(index.docstore.search(before['会员权益']), Document)
+    assert index.docstore.search(after['会员权益']).page_content.endswith("专属客服。")
+    # 旧指纹的索引目录已清理
+    assert len(os.listdir(index_dir)) == 1
+
+
+def test_unchanged_content_loads_without_embedding(tmp_path):
+    path = tmp_path / "faq.txt"
+    path.write_text(FAQ, encoding='utf-8')
+    index_dir = str(tmp_path / "index")
+    load_or_build_index([str(path)], CountingEmbeddings(), "fake-model", index_dir=index_dir)
+
+    embeddings = CountingEmbeddings()
+    index = load_or_build_index([str(path)], embeddings, "fake-model", index_dir=index_dir)
+    assert embeddings.calls == []
+    assert index._normalize_L2
+    assert index.similarity_search("# 退款政策\n购买后七天内可以申请退款。", k=1)[0].metadata['section'] == '退款政策'
+
+
+def test_model_change_rebuilds_everything(tmp_path):
+    path = tmp_path / "faq.txt"
+    path.write_text(FAQ, encoding='utf-8')
+    index_dir = str(tmp_path / "index")
+    load_or_build_index([str(path)], CountingEmbeddings(), "fake-model", index_dir=index_dir)
+
+    embeddings = CountingEmbeddings()
+    load_or_build_index([str(path)], embeddings, "other-model", index_dir=index_dir)
+    assert sum(len(texts) for texts in embeddings.calls) == 2
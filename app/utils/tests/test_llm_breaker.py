@@ -0,0 +1,145 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils import llm_breaker
+from app.utils.llm_breaker import CLOSED, HALF_OPEN, OPEN, BreakerConfig, CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_breaker, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def _breaker(**overrides):
+    config = BreakerConfig(window_seconds=60, min_calls=4, failure_rate_threshold=0.5,
+                           slow_call_seconds=10, slow_call_rate_threshold=0.75,
+                           open_seconds=30, half_open_max_calls=1)
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    return CircuitBreaker("test/model", config)
+
+
+def _open(breaker):
+    for _ in range(breaker.config.min_calls):
+        breaker.record_failure(1.0)
+    assert breaker.state == OPEN
+
+
+def test_stays_closed_below_min_calls(clock):
+    breaker = _breaker()
+    for _ in range(3):
+        breaker.record_failure(1.0)
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+
+def test_opens_on_failure_rate(clock):
+    breaker = _breaker()
+    breaker.record_success(1.0)
+    breaker.record_success(1.0)
+    breaker.record_failure(1.0)
+    assert breaker.state == CLOSED
+    breaker.record_failure(1.0)
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+
+
+def test_opens_on_slow_call_rate(clock):
+    breaker = _breaker()
+    breaker.record_success(1.0)
+    for _ in range(3):
+        breaker.record_success(12.0)
+    assert breaker.state == OPEN
+
+
+def test_old_calls_leave_the_window(clock):
+    breaker = _breaker()
+    for _ in range(3):
+        breaker.record_failure(1.0)
+    clock.advance(61)
+    breaker.record_failure(1.0)
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["calls"] == 1
+
+
+def test_half_open_after_open_seconds(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock.advance(29)
+    assert breaker.state == OPEN
+    assert breaker.snapshot()["retry_in"] == 1.0
+    clock.advance(1)
+    assert breaker.state == HALF_OPEN
+
+
+def test_half_open_limits_probes(clock):
+    breaker = _breaker(half_open_max_calls=2)
+    _open(breaker)
+    clock.advance(30)
+    assert breaker.allow_request()
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.release()
+    assert breaker.allow_request()
+
+
+def test_successful_probe_closes_and_resets_window(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock.advance(30)
+    assert breaker.allow_request()
+    breaker.record_success(1.0)
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["calls"] == 0
+    assert breaker.snapshot()["health_score"] == 1.0
+
+
+@pytest.mark.parametrize("record", [
+    lambda breaker: breaker.record_failure(1.0),
+    lambda breaker: breaker.record_success(15.0),
+])
+def test_failed_or_slow_probe_reopens(clock, record):
+    breaker = _breaker()
+    _open(breaker)
+    clock.advance(30)
+    assert breaker.allow_request()
+    record(breaker)
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    clock.advance(30)
+    assert breaker.state == HALF_OPEN
+
+
+def test_snapshot_health_score(clock):
+    breaker = _breaker(min_calls=100)
+    breaker.record_success(1.0)
+    breaker.record_success(20.0)
+    breaker.record_failure(1.0)
+    breaker.record_failure(3.0)
+    snapshot = breaker.snapshot()
+    assert snapshot["state"] == CLOSED
+    assert snapshot["failure_rate"] == 0.5
+    assert snapshot["slow_call_rate"] == 0.25
+    assert snapshot["health_score"] == round(0.5 * (1 - 0.5 * 0.25), 3)
+    assert snapshot["avg_latency"] == 6.25
+    assert snapshot["retry_in"] == 0.0
+
+
+def test_open_breaker_health_is_zero(clock):
+    breaker = _breaker()
+    _open(breaker)
+    assert breaker.snapshot()["health_score"] == 0.0
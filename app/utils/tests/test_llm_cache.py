@@ -0,0 +1,76 @@
+import sqlite3
+
+from app.utils import llm_cache
+from app.utils.llm_cache import TwoTierCache
+
+
+def _rows(db_path, namespace):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+
+def _expire(db_path, namespace):
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE cache_entries SET expires_at = 0 WHERE namespace = ?", (namespace,))
+
+
+def test_get_set_delete(tmp_path):
+    cache = TwoTierCache("t", str(tmp_path / "cache.db"), ttl=60)
+    cache.set("a", "1")
+    assert cache.get("a") == "1"
+    cache.delete("a")
+    assert cache.get("a") is None
+
+
+def test_disk_tier_is_shared(tmp_path):
+    db = str(tmp_path / "cache.db")
+    TwoTierCache("t", db, ttl=60).set("a", b"value")
+    assert TwoTierCache("t", db, ttl=60).get("a") == b"value"
+    assert TwoTierCache("other", db, ttl=60).get("a") is None
+
+
+def test_purge_expired_only_touches_own_namespace(tmp_path):
+    db = str(tmp_path / "cache.db")
+    mine, other = TwoTierCache("mine", db, ttl=60), TwoTierCache("other", db, ttl=60)
+    for i in range(5):
+        mine.set(f"k{i}", "v")
+        other.set(f"k{i}", "v")
+    _expire(db, "mine")
+    _expire(db, "other")
+    assert mine.purge_expired() == 5
+    assert _rows(db, "mine") == 0
+    assert _rows(db, "other") == 5
+
+
+def test_writes_trigger_purge(tmp_path):
+    db = str(tmp_path / "cache.db")
+    cache = TwoTierCache("t", db, ttl=60, purge_every=10)
+    cache.set("first", "v")
+    for i in range(5):
+        cache.set(f"old{i}", "v")
+    _expire(db, "t")
+    # 第一次写入时已清理过，之后每 10 次写入清理一次
+    for i in range(4):
+        cache.set(f"new{i}", "v")
+    assert _rows(db, "t") == 10
+    cache.set("new4", "v")
+    assert _rows(db, "t") == 5
+    assert cache.stats()["purged"] == 6
+
+
+def test_disk_entries_are_capped_by_expiry(tmp_path):
+    db = str(tmp_path / "cache.db")
+    cache = TwoTierCache("t", db, ttl=60, max_disk_entries=3, purge_every=1000)
+    for i in range(6):
+        cache.set(f"k{i}", "v", ttl=60 + i)
+    assert cache.purge_expired() == 3
+    with sqlite3.connect(db) as conn:
+        keys = {row[0] for row in conn.execute("SELECT key FROM cache_entries WHERE namespace = 't'")}
+    assert keys == {"k3", "k4", "k5"}
+
+
+def test_default_limits_come_from_env(monkeypatch, tmp_path):
+    monkeypatch.setattr(llm_cache, "DISK_MAX_ENTRIES", 7)
+    monkeypatch.setattr(llm_cache, "PURGE_EVERY", 5)
+    cache = TwoTierCache("t", str(tmp_path / "cache.db"), ttl=60)
+    assert (cache.max_disk_entries, cache.purge_every) == (7, 5)
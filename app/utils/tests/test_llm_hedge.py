@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import time
+import uuid
+
+import pytest
+
+from app.utils import llm_hedge
+from app.utils.llm_hedge import Attempt, HedgeCancelled, HedgePolicy, ahedged_call, get_tracker, hedged_call
+
+
+@pytest.fixture(autouse=True)
+def hedge_policy(monkeypatch):
+    policy = HedgePolicy(default_delay=0.05, min_delay=0.01, max_delay=5.0, min_samples=5)
+    monkeypatch.setattr(llm_hedge, "policy", policy)
+    return policy
+
+
+def _labels():
+    suffix = uuid.uuid4().hex[:8]
+    return f"p/r1-{suffix}", f"f/qwen-{suffix}"
+
+
+def _reasoning_primary(label, first_delta=0.01, content_after=0.08):
+    """先很快输出推理片段，content_after 秒后才输出正文"""
+    def fn(cancel, mark_alive):
+        time.sleep(first_delta)
+        mark_alive()
+        deadline = time.perf_counter() + content_after
+        while time.perf_counter() < deadline:
+            if cancel.is_set():
+                raise HedgeCancelled(label)
+            time.sleep(0.005)
+            mark_alive()
+        return "primary"
+
+    async def afn(mark_alive):
+        await asyncio.sleep(first_delta)
+        mark_alive()
+        await asyncio.sleep(content_after)
+        return "primary"
+    return Attempt(label=label, fn=fn, afn=afn)
+
+
+def _silent_primary(label):
+    """在被取消之前不输出任何片段"""
+    def fn(cancel, mark_alive):
+        while not cancel.is_set():
+            time.sleep(0.005)
+        raise HedgeCancelled(label)
+
+    async def afn(mark_alive):
+        await asyncio.sleep(60)
+    return Attempt(label=label, fn=fn, afn=afn)
+
+
+def _fallback(label, seconds=0.1):
+    def fn(cancel, mark_alive):
+        time.sleep(seconds)
+        mark_alive()
+        return "fallback"
+
+    async def afn(mark_alive):
+        await asyncio.sleep(seconds)
+        mark_alive()
+        return "fallback"
+    return Attempt(label=label, fn=fn, afn=afn)
+
+
+def test_reasoning_deltas_keep_primary_alive():
+    primary, fallback = _labels()
+    winners = [hedged_call(_reasoning_primary(primary), _fallback(fallback))[0] for _ in range(30)]
+    assert winners == [primary] * 30
+    tracker = get_tracker(primary)
+    assert len(tracker) == 30
+    assert tracker.percentile(95) < 0.05
+
+
+def test_async_reasoning_deltas_keep_primary_alive():
+    primary, fallback = _labels()
+
+    async def main():
+        return [(await ahedged_call(_reasoning_primary(primary), _fallback(fallback)))[0] for _ in range(10)]
+    assert asyncio.run(main()) == [primary] * 10
+    assert len(get_tracker(primary)) == 10
+
+
+def test_cancelled_primary_records_censored_sample(hedge_policy):
+    primary, fallback = _labels()
+    assert hedged_call(_silent_primary(primary), _fallback(fallback, 0.1)) == (fallback, "fallback")
+    tracker = get_tracker(primary)
+    assert len(tracker) == 1
+    # 被取消时已等待了截止时间加备用模型的耗时
+    assert tracker.percentile(50) >= hedge_policy.default_delay + 0.1
+
+
+def test_async_cancelled_primary_records_censored_sample(hedge_policy):
+    primary, fallback = _labels()
+    assert asyncio.run(ahedged_call(_silent_primary(primary), _fallback(fallback, 0.1))) == (fallback, "fallback")
+    tracker = get_tracker(primary)
+    assert len(tracker) == 1
+    assert tracker.percentile(50) >= hedge_policy.default_delay + 0.1
+
+
+def test_deadline_adapts_to_slow_primary(hedge_policy):
+    primary, fallback = _labels()
+    for _ in range(hedge_policy.min_samples):
+        hedged_call(_silent_primary(primary), _fallback(fallback, 0.1))
+    assert hedge_policy.deadline(get_tracker(primary)) >= 0.15
+    # 截止时间放宽后，0.12s 才输出首个片段的主模型不再被对冲
+    assert hedged_call(_reasoning_primary(primary, first_delta=0.12, content_after=0.01),
+                       _fallback(fallback))[0] == primary
+
+
+def test_queue_time_does_not_trigger_hedge(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(llm_hedge, "_executor", executor)
+    primary, fallback = _labels()
+    release = threading.Event()
+    executor.submit(release.wait, 5)
+    threading.Timer(0.2, release.set).start()
+    try:
+        assert hedged_call(_reasoning_primary(primary, first_delta=0.01, content_after=0.01),
+                           _fallback(fallback))[0] == primary
+        assert get_tracker(primary).percentile(50) < 0.05
+    finally:
+        release.set()
+        executor.shutdown(wait=True)
@@ -0,0 +1,97 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from app.utils.llm_pool import LLMClientRegistry, ProviderConfig
+
+
+class SlowStreamHandler(BaseHTTPRequestHandler):
+    """每 50ms 输出一个片段的流式补全接口"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write(data):
+            payload = data.encode()
+            self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+            self.wfile.flush()
+
+        for i in range(6):
+            chunk = {"id": "x", "object": "chat.completion.chunk", "created": 0, "model": "m",
+                     "choices": [{"index": 0, "delta": {"content": str(i)}, "finish_reason": None}]}
+            write(f"data: {json.dumps(chunk)}\n\n")
+            time.sleep(0.05)
+        write("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), SlowStreamHandler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}/v1"
+    srv.shutdown()
+
+
+@pytest.fixture
+def registry(monkeypatch, server):
+    monkeypatch.setenv("FAKE_API_KEY", "x")
+    return LLMClientRegistry({"fake": ProviderConfig("fake", "FAKE_API_KEY", server, max_retries=0)})
+
+
+def test_client_is_shared(registry):
+    assert registry.get_client("fake") is registry.get_client("fake")
+    with pytest.raises(ValueError):
+        registry.get_client("unknown")
+
+
+def test_configure_does_not_close_clients_in_use(registry):
+    client = registry.get_client("fake")
+    stream = client.chat.completions.create(model="m", messages=[{"role": "user", "content": "hi"}], stream=True)
+    chunks = iter(stream)
+    first = next(chunks).choices[0].delta.content
+
+    registry.configure("fake", max_connections=5)
+    new_client = registry.get_client("fake")
+    assert new_client is not client
+    assert registry.get_config("fake").max_connections == 5
+
+    # 进行中的请求不受影响
+    rest = [chunk.choices[0].delta.content for chunk in chunks]
+    assert first + "".join(rest) == "012345"
+    assert not client.is_closed()
+
+    registry.close()
+    assert client.is_closed() and new_client.is_closed()
+
+
+def test_configure_defers_async_close_to_aclose(registry):
+    async def main():
+        client = registry.get_async_client("fake")
+        stream = await client.chat.completions.create(
+            model="m", messages=[{"role": "user", "content": "hi"}], stream=True
+        )
+        registry.configure("fake", timeout=30.0)
+        new_client = registry.get_async_client("fake")
+        assert new_client is not client
+        content = "".join([chunk.choices[0].delta.content async for chunk in stream])
+        assert content == "012345"
+        assert not client.is_closed()
+        await registry.aclose()
+        return client, new_client
+
+    client, new_client = asyncio.run(main())
+    assert client.is_closed() and new_client.is_closed()
@@ -0,0 +1,62 @@
+import logging
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.utils.knowledge_index import _update
+from app.utils.query_router import CONVERSATION_ROUTE, KNOWLEDGE_ROUTE, KnowledgeRouter, keyword_overlap
+
+# 未归一化、长度各不相同的向量，验证相似度不受向量长度影响
+VECTORS = {
+    "退款政策": [30.0, 0.0, 0.0],
+    "会员权益": [0.0, 0.5, 0.0],
+    "如何退款": [20.0, 20.0, 0.0],
+    "今天天气怎么样": [0.0, 0.0, 7.0],
+}
+
+
+class FixedEmbeddings(Embeddings):
+    def embed_documents(self, texts):
+        return [VECTORS[text] for text in texts]
+
+    def embed_query(self, text):
+        return VECTORS[text]
+
+
+def _router(**kwargs):
+    docs = [
+        Document(page_content=text, metadata={'chunk_id': text, 'section': text, 'source': 'faq.txt'})
+        for text in ("退款政策", "会员权益")
+    ]
+    return KnowledgeRouter(_update(None, docs, FixedEmbeddings()), **kwargs)
+
+
+def test_similarity_is_cosine_for_unnormalized_embeddings():
+    router = _router(threshold=0.5, vector_weight=1.0, k=2)
+    assert abs(router.route("退款政策").similarity - 1.0) < 1e-6
+    assert abs(router.route("如何退款").similarity - 2 ** -0.5) < 1e-6
+    assert abs(router.route("今天天气怎么样").similarity) < 1e-6
+
+
+def test_routes_by_threshold():
+    router = _router(threshold=0.5, vector_weight=0.6, k=2)
+    decision = router.route("退款政策")
+    assert decision.route == KNOWLEDGE_ROUTE
+    assert decision.documents[0].page_content == "退款政策"
+    assert router.route("今天天气怎么样").route == CONVERSATION_ROUTE
+    assert router.stats() == {KNOWLEDGE_ROUTE: 1, CONVERSATION_ROUTE: 1}
+
+
+def test_query_text_is_not_logged(caplog):
+    router = _router(threshold=0.5, vector_weight=0.6, k=2)
+    with caplog.at_level(logging.INFO, logger="app.utils.query_router"):
+        router.route("今天天气怎么样")
+    assert "今天天气怎么样" not in caplog.text
+    assert '"query_length": 7' in caplog.text
+    assert '"query_hash"' in caplog.text
+
+
+def test_keyword_overlap():
+    assert keyword_overlap("退款政策", "我们的退款政策如下") == 1.0
+    assert keyword_overlap("退款", "会员权益") == 0.0
+    assert keyword_overlap("！！", "任何内容") == 0.0
@@ -0,0 +1,93 @@
+import json
+import random
+
+import pytest
+
+from app.utils.question_bank import QuestionStreamParser
+
+QUESTIONS = [
+    {'id': 1, 'content': '我喜欢 {组织} 活动', 'category': '1'},
+    {'id': 2, 'content': '他说："先做完[清单]再休息"', 'category': '2'},
+    {'id': 3, 'content': '反斜杠 \\ 和引号 " 都要转义', 'category': '3', 'tags': ['a', {'b': [1, 2]}]},
+    {'id': 4, 'content': '最后一题', 'category': '4'},
+]
+RESPONSE = "好的，以下是题目：\n```json\n" + json.dumps(QUESTIONS, ensure_ascii=False, indent=2) + "\n```\n以上。"
+
+
+def _feed_all(parser, chunks):
+    objects = []
+    for chunk in chunks:
+        objects.extend(parser.feed(chunk))
+    return objects
+
+
+def _split(text, cuts):
+    bounds = [0] + sorted(cuts) + [len(text)]
+    return [text[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+def test_whole_response():
+    parser = QuestionStreamParser()
+    assert parser.feed(RESPONSE) == QUESTIONS
+    assert parser.done
+
+
+def test_single_character_chunks():
+    parser = QuestionStreamParser()
+    assert _feed_all(parser, list(RESPONSE)) == QUESTIONS
+    assert parser.done
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_random_chunk_boundaries(seed):
+    rng = random.Random(seed)
+    cuts = rng.sample(range(1, len(RESPONSE)), rng.randint(1, 40))
+    parser = QuestionStreamParser()
+    assert _feed_all(parser, _split(RESPONSE, cuts)) == QUESTIONS
+
+
+def test_every_two_way_split():
+    for cut in range(1, len(RESPONSE)):
+        parser = QuestionStreamParser()
+        assert _feed_all(parser, _split(RESPONSE, [cut])) == QUESTIONS, cut
+
+
+def test_objects_are_returned_as_soon_as_they_close():
+    text = json.dumps(QUESTIONS, ensure_ascii=False)
+    first_end = text.index('}, {') + 1
+    parser = QuestionStreamParser()
+    assert parser.feed(text[:first_end - 1]) == []
+    assert parser.feed(text[first_end - 1:first_end]) == QUESTIONS[:1]
+    assert parser.feed(text[first_end:]) == QUESTIONS[1:]
+
+
+@pytest.mark.parametrize('preamble', [
+    "题目数量 [共 4 道]，如下：\n",
+    "[注意] 以下为 JSON：\n",
+    "参考 [链接](http://example.com) 和 [ ] 复选框\n",
+    "[[1, 2]] 不是题目\n",
+])
+def test_preamble_with_brackets(preamble):
+    text = preamble + json.dumps(QUESTIONS, ensure_ascii=False)
+    assert QuestionStreamParser().feed(text) == QUESTIONS
+    for cut in range(1, len(preamble) + 3):
+        parser = QuestionStreamParser()
+        assert _feed_all(parser, _split(text, [cut])) == QUESTIONS, cut
+
+
+def test_invalid_object_is_skipped():
+    text = '[{"id": 1, "content": "ok"}, {"id": 2, "content": bad}, {"id": 3, "content": "ok"}]'
+    assert [q['id'] for q in QuestionStreamParser().feed(text)] == [1, 3]
+
+
+def test_stops_after_array_closes():
+    parser = QuestionStreamParser()
+    assert parser.feed('[{"id": 1}]') == [{'id': 1}]
+    assert parser.done
+    assert parser.feed('[{"id": 2}]') == []
+
+
+def test_buffer_does_not_keep_returned_objects():
+    parser = QuestionStreamParser()
+    parser.feed('[' + ', '.join(json.dumps(q, ensure_ascii=False) for q in QUESTIONS * 50))
+    assert len(parser._buffer) < 10
@@ -0,0 +1,194 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.utils import test_helper
+from app.utils.scoring import compile_scoring_table, mbti_type, top_dimension
+
+MBTI_PAIRS = [('E', 'I'), ('S', 'N'), ('T', 'F'), ('J', 'P')]
+CAREERS = ['技术', '管理', '艺术', '研究']
+
+
+def _mbti_questions(n=16):
+    return [
+        {
+            'id': i + 1,
+            'content': f'MBTI 题目 {i + 1}',
+            'dimension_a': MBTI_PAIRS[i % 4][0],
+            'dimension_b': MBTI_PAIRS[i % 4][1],
+            'option_a': f'选项 A{i + 1}',
+            'option_b': f'选项 B{i + 1}',
+        }
+        for i in range(n)
+    ]
+
+
+def _career_questions(n=12):
+    return [
+        {
+            'id': i + 1,
+            'content': f'职业题目 {i + 1}',
+            'category': ','.join(CAREERS[i % 4:i % 4 + 1 + i % 2]),
+        }
+        for i in range(n)
+    ]
+
+
+def _enneagram_questions(n=18):
+    return [
+        {'id': i + 1, 'content': f'九型题目 {i + 1}', 'category': str(i % 9 + 1)}
+        for i in range(n)
+    ]
+
+
+def _answers(questions, options, seed):
+    rng = random.Random(seed)
+    return [{'questionId': q['id'], 'answer': rng.choice(options)} for q in questions]
+
+
+# 基线版本 test_helper 中的计分逻辑，作为 ScoringTable 的对照
+
+def _legacy_mbti(questions, answers):
+    dimensions = {'E': 0, 'I': 0, 'S': 0, 'N': 0, 'T': 0, 'F': 0, 'J': 0, 'P': 0}
+    for answer in answers:
+        question = next(q for q in questions if q['id'] == answer['questionId'])
+        if answer['answer'] == 'A':
+            dimensions[question['dimension_a']] += 1
+        else:
+            dimensions[question['dimension_b']] += 1
+    mbti = ''.join(first if dimensions[first] > dimensions[second] else second for first, second in MBTI_PAIRS)
+    return dimensions, mbti
+
+
+def _legacy_career(questions, answers):
+    career_types = {}
+    for answer in answers:
+        question = next(q for q in questions if q['id'] == answer['questionId'])
+        score = ord(answer['answer']) - ord('A') + 1
+        for category in question['category'].split(','):
+            career_types[category] = career_types.get(category, 0) + score
+    return career_types
+
+
+def _legacy_enneagram(questions, answers):
+    type_scores = {str(i): 0 for i in range(1, 10)}
+    for answer in answers:
+        question = next(q for q in questions if q['id'] == answer['questionId'])
+        type_scores[question['category']] += 5 - (ord(answer['answer']) - ord('A'))
+    main_type = max(type_scores.items(), key=lambda x: x[1])[0]
+    return type_scores, main_type
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_mbti_matches_legacy(seed):
+    questions = _mbti_questions()
+    answers = _answers(questions, ['A', 'B'], seed)
+    result = compile_scoring_table('mbti', questions).score(answers)
+    dimensions, mbti = _legacy_mbti(questions, answers)
+    assert result.scores() == dimensions
+    assert mbti_type(result) == mbti
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_career_matches_legacy(seed):
+    questions = _career_questions()
+    answers = _answers(questions, ['A', 'B', 'C', 'D', 'E'], seed)
+    random.Random(seed).shuffle(answers)
+    result = compile_scoring_table('career', questions).score(answers)
+    assert result.answered_scores() == _legacy_career(questions, answers)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_enneagram_matches_legacy(seed):
+    questions = _enneagram_questions()
+    answers = _answers(questions, ['A', 'B', 'C', 'D', 'E'], seed)
+    result = compile_scoring_table('enneagram', questions).score(answers)
+    type_scores, main_type = _legacy_enneagram(questions, answers)
+    assert result.scores() == type_scores
+    assert top_dimension(result) == main_type
+
+
+def test_partial_answers_only_count_answered_questions():
+    questions = _career_questions()
+    answers = [{'questionId': 3, 'answer': 'E'}, {'questionId': '5', 'answer': 'B'}]
+    result = compile_scoring_table('career', questions).score(answers)
+    assert result.answered_scores() == _legacy_career(questions, [
+        {'questionId': 3, 'answer': 'E'}, {'questionId': 5, 'answer': 'B'},
+    ])
+    assert list(result.rows) == [2, 4]
+
+
+def test_mbti_non_a_answer_counts_as_b():
+    questions = _mbti_questions(4)
+    result = compile_scoring_table('mbti', questions).score([{'questionId': 1, 'answer': 'X'}])
+    assert result.scores()['I'] == 1
+
+
+@pytest.mark.parametrize('answers', [
+    None,
+    'A',
+    [['questionId', 1]],
+    [{'questionId': 1}],
+    [{'answer': 'A'}],
+    [{'questionId': 999, 'answer': 'A'}],
+    [{'questionId': 1, 'answer': 'F'}],
+    [{'questionId': 1, 'answer': 3}],
+])
+def test_invalid_answers_raise_value_error(answers):
+    table = compile_scoring_table('enneagram', _enneagram_questions())
+    with pytest.raises(ValueError):
+        table.score(answers)
+
+
+@pytest.mark.parametrize('test_type, build, options', [
+    ('mbti', _mbti_questions, ['A', 'B']),
+    ('career', _career_questions, ['A', 'B', 'C', 'D', 'E']),
+    ('enneagram', _enneagram_questions, ['A', 'B', 'C', 'D', 'E']),
+])
+def test_score_batch_matches_single(test_type, build, options):
+    questions = build()
+    table = compile_scoring_table(test_type, questions)
+    sheets = [_answers(questions, options, seed) for seed in range(10)]
+    sheets[3] = sheets[3][:5]
+    sheets[6] = []
+    results = table.score_batch(sheets)
+    assert len(results) == len(sheets)
+    for answers, result in zip(sheets, results):
+        single = table.score(answers)
+        np.testing.assert_array_equal(result.totals, single.totals)
+        np.testing.assert_array_equal(result.counts, single.counts)
+        np.testing.assert_array_equal(result.rows, single.rows)
+        np.testing.assert_array_equal(result.options, single.options)
+
+
+def test_score_batch_isolates_invalid_sheets():
+    questions = _enneagram_questions()
+    table = compile_scoring_table('enneagram', questions)
+    good = _answers(questions, ['A', 'B', 'C', 'D', 'E'], 0)
+    results = table.score_batch([good, [{'questionId': 999, 'answer': 'A'}], 'bad', good])
+    assert results[1] is None and results[2] is None
+    assert results[0].scores() == results[3].scores() == _legacy_enneagram(questions, good)[0]
+    assert table.score_batch([None]) == [None]
+
+
+def test_analysis_prompts_keep_legacy_scores():
+    questions = _mbti_questions()
+    answers = _answers(questions, ['A', 'B'], 7)
+    dimensions, mbti = _legacy_mbti(questions, answers)
+    prompt = test_helper.construct_mbti_analysis(compile_scoring_table('mbti', questions), answers)
+    assert f"测试结果: {mbti}" in prompt
+    assert f"E/I: E({dimensions['E']}) - I({dimensions['I']})" in prompt
+    assert "问题1: MBTI 题目 1\n选择: 选项" in prompt
+
+    questions = _enneagram_questions()
+    answers = _answers(questions, ['A', 'B', 'C', 'D', 'E'], 7)
+    type_scores, main_type = _legacy_enneagram(questions, answers)
+    prompt = test_helper.construct_enneagram_analysis(compile_scoring_table('enneagram', questions), answers)
+    assert f"主要类型: {main_type}" in prompt
+    assert '\n'.join(f'类型{k}: {v}分' for k, v in type_scores.items()) in prompt
+
+    questions = _career_questions()
+    answers = _answers(questions, ['A', 'B', 'C', 'D', 'E'], 7)
+    prompt = test_helper.construct_career_analysis(compile_scoring_table('career', questions), answers)
+    assert '\n'.join(f'{k}: {v}分' for k, v in _legacy_career(questions, answers).items()) in prompt
@@ -0,0 +1,42 @@
+"""
+gunicorn 配置（在工作目录下启动时自动加载）
+
+设置了 PROMETHEUS_MULTIPROC_DIR 时，启动前清空旧的指标文件，worker 退出时标记其指标为已结束，
+/metrics 会汇总所有 worker 的数据。
+
+QUESTION_POOL_WARM_ON_START 未关闭时，主进程启动时在独立进程中补充一次题库池（多个实例之间由
+SQLite 租约保证同一类型只有一个在补充），worker 中的 create_app 不再各自补充。
+"""
+import os
+import shutil
+import subprocess
+import sys
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+QUESTION_POOL_WARM_ON_START = os.getenv("QUESTION_POOL_WARM_ON_START", "true").lower() not in ("0", "false", "no")
+
+_warm_process = None
+
+
+def on_starting(server):
+    global _warm_process
+    if PROMETHEUS_MULTIPROC_DIR:
+        shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    if QUESTION_POOL_WARM_ON_START:
+        # 不在主进程中导入应用或启动线程，fork 出的 worker 不会继承后台线程和连接
+        _warm_process = subprocess.Popen(
+            [sys.executable, "-c", "from app.utils.test_helper import warm_bank_pool; warm_bank_pool()"]
+        )
+    os.environ["QUESTION_POOL_WARM_ON_START"] = "false"
+
+
+def on_exit(server):
+    if _warm_process is not None and _warm_process.poll() is None:
+        _warm_process.terminate()
+
+
+def child_exit(server, worker):
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)